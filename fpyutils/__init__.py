@@ -19,6 +19,28 @@
 # You should have received a copy of the GNU General Public License
 # along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
 #
-"""Exposed API."""
+"""Exposed API.
 
-from . import exceptions, filelines, notify, path, shell
+Submodules are imported on first access (PEP 562), so that a program
+using only some of them does not pay for the imports of the others.
+"""
+
+import importlib
+
+__all__ = ['exceptions', 'filelines', 'notify', 'path', 'shell']
+
+
+def __getattr__(name: str):
+    r"""Import a submodule the first time it is accessed."""
+    if name not in __all__:
+        raise AttributeError('module ' + __name__ + ' has no attribute ' +
+                             name)
+
+    # import_module also binds the submodule as a package attribute, so this
+    # function is not called again for the same name.
+    return importlib.import_module('.' + name, __name__)
+
+
+def __dir__() -> list:
+    r"""List the submodules as well."""
+    return sorted(set(globals()) | set(__all__))
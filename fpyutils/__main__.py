@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+#
+# __main__.py
+#
+# Copyright (C) 2017-2023 Franco Masotti (see /README.md)
+#
+# This file is part of fpyutils.
+#
+# fpyutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fpyutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Allow running ``python -m fpyutils``."""
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+#
+# cli.py
+#
+# Copyright (C) 2017-2023 Franco Masotti (see /README.md)
+#
+# This file is part of fpyutils.
+#
+# fpyutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fpyutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Command line interface."""
+from __future__ import annotations
+
+import argparse
+import contextlib
+import os
+import re
+import shlex
+import sys
+
+from . import filelines
+from .exceptions import LineOutOfFileBoundsError, NegativeLineRangeError
+
+NEWLINES: dict[str, str] = {
+    'lf': '\n',
+    'crlf': '\r\n',
+    'cr': '\r',
+}
+
+ESCAPES: dict[str, str] = {
+    '\\n': '\n',
+    '\\r': '\r',
+    '\\t': '\t',
+    '\\\\': '\\',
+}
+
+
+class CliError(Exception):
+    r"""An invalid combination of command line arguments."""
+
+
+@contextlib.contextmanager
+def _input_lines(input_file: str):
+    r"""Open a file, or the standard input, for reading lines.
+
+    Compressed files are decompressed on the fly.
+    """
+    if input_file is None or input_file == '-':
+        yield iter(sys.stdin.readline, str())
+    else:
+        with filelines._open_detected(input_file) as (f, _):
+            yield iter(f.readline, str())
+
+
+def _check_output(args: argparse.Namespace):
+    r"""Validate the output options of the editing subcommands."""
+    if args.in_place and args.file in (None, '-'):
+        raise CliError('--in-place needs a file')
+
+
+def _match(args: argparse.Namespace) -> int:
+    r"""Print the numbers of the matching lines."""
+    if args.max_occurrencies < 0 or args.max_occurrencies > sys.maxsize:
+        raise ValueError
+
+    max_occurrencies: int = args.max_occurrencies or sys.maxsize
+    pattern: str = args.pattern.strip() if args.loose else args.pattern
+    matches: int = 0
+    with _input_lines(args.file) as lines:
+        for line_number, line, _ in filelines._iter_line_matches(
+                lines, pattern, max_occurrencies, args.loose, False):
+            matches += 1
+            sys.stdout.write(str(line_number) + '\n')
+
+    # Like grep: no match is an exit status of 1.
+    return 0 if matches else 1
+
+
+def _insert(args: argparse.Namespace) -> int:
+    r"""Insert a string at a line."""
+    _check_output(args)
+    if args.line < 1:
+        raise ValueError
+
+    newline: str = NEWLINES[args.newline]
+    if args.escapes:
+        args.string = re.sub(r'\\[nrt\\]', lambda m: ESCAPES[m.group(0)],
+                             args.string)
+
+    if args.in_place or args.output is not None:
+        filelines.insert_string_at_line(
+            args.file, args.string, args.line,
+            args.file if args.in_place else args.output, not args.prepend,
+            newline)
+    else:
+        with _input_lines(args.file) as lines:
+            sys.stdout.writelines(
+                filelines._iter_insert_string_at_line(lines, args.string,
+                                                      args.line,
+                                                      not args.prepend,
+                                                      newline))
+
+    return 0
+
+
+def _remove_range(args: argparse.Namespace) -> int:
+    r"""Remove a line interval."""
+    _check_output(args)
+    if args.line_from < 1 or args.line_to < 1:
+        raise ValueError
+    if args.line_to - args.line_from < 0:
+        raise NegativeLineRangeError
+
+    if args.in_place or args.output is not None:
+        filelines.remove_line_interval(
+            args.file, args.line_from, args.line_to,
+            args.file if args.in_place else args.output)
+    else:
+        with _input_lines(args.file) as lines:
+            sys.stdout.writelines(
+                filelines._iter_remove_line_interval(lines, args.line_from,
+                                                     args.line_to))
+
+    return 0
+
+
+def _run(args: argparse.Namespace) -> int:
+    r"""Run a shell command."""
+    from .shell import execute_command_live_output
+
+    return execute_command_live_output(args.command, args.shell, args.dry_run,
+                                       args.encoding, args.log_files)
+
+
+def _add_output_arguments(parser: argparse.ArgumentParser):
+    r"""Add the options shared by the editing subcommands."""
+    parser.add_argument('file',
+                        nargs='?',
+                        help='the input file. Defaults to the standard input')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('-i',
+                       '--in-place',
+                       action='store_true',
+                       help='edit the input file')
+    group.add_argument(
+        '-o',
+        '--output',
+        help='write to this file instead of the standard output')
+
+
+def build_parser() -> argparse.ArgumentParser:
+    r"""Build the command line parser."""
+    parser = argparse.ArgumentParser(
+        prog='fpyutils',
+        description='Line based file operations and shell commands.')
+    subparsers = parser.add_subparsers(dest='subcommand', required=True)
+
+    match = subparsers.add_parser('match',
+                                  help='print the numbers of matching lines')
+    match.add_argument('pattern')
+    match.add_argument('file',
+                       nargs='?',
+                       help='the input file. Defaults to the standard input')
+    match.add_argument(
+        '-m',
+        '--max-occurrencies',
+        type=int,
+        default=0,
+        help='stop after this number of matches. Defaults to 0, i.e. all')
+    match.add_argument(
+        '-s',
+        '--strict',
+        dest='loose',
+        action='store_false',
+        help='do not ignore leading and trailing whitespace characters')
+    match.set_defaults(function=_match)
+
+    insert = subparsers.add_parser('insert', help='insert a string at a line')
+    insert.add_argument('string')
+    insert.add_argument('line', type=int)
+    _add_output_arguments(insert)
+    insert.add_argument('-p',
+                        '--prepend',
+                        action='store_true',
+                        help='insert before the line instead of after it')
+    insert.add_argument('-e',
+                        '--escapes',
+                        action='store_true',
+                        help='interpret \\n, \\r, \\t and \\\\ in the string')
+    insert.add_argument(
+        '-n',
+        '--newline',
+        choices=sorted(NEWLINES),
+        default='crlf' if os.linesep == '\r\n' else 'lf',
+        help='the newline used to pad the file and, when writing to a file, '
+        'for all the lines. Defaults to the platform newline')
+    insert.set_defaults(function=_insert)
+
+    remove_range = subparsers.add_parser('remove-range',
+                                         help='remove a line interval')
+    remove_range.add_argument('line_from', type=int)
+    remove_range.add_argument('line_to', type=int)
+    _add_output_arguments(remove_range)
+    remove_range.set_defaults(function=_remove_range)
+
+    run = subparsers.add_parser('run', help='run a shell command')
+    run.add_argument('command')
+    run.add_argument('--shell',
+                     default='/bin/bash',
+                     help='the shell binary. Defaults to /bin/bash')
+    run.add_argument('-d',
+                     '--dry-run',
+                     action='store_true',
+                     help='print the command instead of running it')
+    run.add_argument('-e',
+                     '--encoding',
+                     default='UTF-8',
+                     help='the encoding of the output. Defaults to UTF-8')
+    run.add_argument('-l',
+                     '--log-file',
+                     dest='log_files',
+                     action='append',
+                     help='also append the output to this file. '
+                     'Can be repeated')
+    run.set_defaults(function=_run)
+
+    batch = subparsers.add_parser(
+        'batch',
+        help='run many subcommands, one per line, in a single process')
+    batch.add_argument(
+        'file',
+        nargs='?',
+        help='the file with the subcommands. Defaults to the standard input')
+    batch.add_argument('-k',
+                       '--keep-going',
+                       action='store_true',
+                       help='do not stop at the first failed subcommand')
+    batch.set_defaults(function=None)
+
+    return parser
+
+
+def _execute(args: argparse.Namespace) -> int:
+    r"""Run a subcommand and turn errors into an exit status."""
+    retval: int
+    try:
+        retval = args.function(args)
+    except (CliError, ImportError, OSError, ValueError,
+            LineOutOfFileBoundsError, NegativeLineRangeError) as e:
+        sys.stderr.write('fpyutils: error: ' + args.subcommand + ': ' +
+                         (str(e) or type(e).__name__) + '\n')
+        retval = 2
+
+    return retval
+
+
+def _batch(parser: argparse.ArgumentParser, args: argparse.Namespace) -> int:
+    r"""Run the subcommands listed in a file.
+
+    Empty lines and lines starting with ``#`` are ignored.
+    """
+    retval: int = 0
+    go: bool = True
+    with _input_lines(args.file) as lines:
+        line: str = next(lines, str())
+        while go and line:
+            words: list[str] = shlex.split(line, comments=True)
+            status: int = 0
+            if words != list():
+                status = _execute_batch_line(parser, words)
+            sys.stdout.flush()
+
+            if status != 0:
+                retval = status
+                go = args.keep_going
+            line = next(lines, str())
+
+    return retval
+
+
+def _execute_batch_line(parser: argparse.ArgumentParser,
+                        words: list[str]) -> int:
+    r"""Parse and run a single subcommand of a batch."""
+    status: int
+    try:
+        operation: argparse.Namespace = parser.parse_args(words)
+    except SystemExit as e:
+        # argparse already printed the error.
+        return e.code
+
+    if operation.subcommand == 'batch':
+        sys.stderr.write('fpyutils: error: batch: batches cannot be nested\n')
+        status = 2
+    elif operation.subcommand != 'run' and operation.file in (None, '-'):
+        # The standard input holds the batch itself.
+        sys.stderr.write('fpyutils: error: batch: ' + operation.subcommand +
+                         ' needs an input file\n')
+        status = 2
+    else:
+        status = _execute(operation)
+
+    return status
+
+
+def main(argv: list[str] = None) -> int:
+    r"""Run the command line interface.
+
+    :parameter argv: the arguments, without the program name.
+         Defaults to ``None`` which means ``sys.argv[1:]``.
+    :type argv: list[str]
+    :returns: the exit status.
+    :rtype: int
+    """
+    parser: argparse.ArgumentParser = build_parser()
+    args: argparse.Namespace = parser.parse_args(argv)
+
+    if args.subcommand == 'batch':
+        return _batch(parser, args)
+    else:
+        return _execute(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,13 +22,667 @@
 """Functions on reading and writing files by line."""
 from __future__ import annotations
 
+import array
+import collections
+import contextlib
+import hashlib
+import heapq
+import io
+import itertools
+import operator
 import os
-import shutil
+import select
+import stat
+import struct
 import sys
-import tempfile
+import threading
+import time
+from collections.abc import Iterable, Iterator, Mapping
 
 from .exceptions import LineOutOfFileBoundsError, NegativeLineRangeError
 
+# Slower modules, such as tempfile, shutil, concurrent.futures, json and re,
+# and the platform specific or optional ones are imported where they are
+# needed so that importing fpyutils stays cheap.
+
+# Size of the blocks read and written by the byte level operations.
+BLOCK_SIZE: int = 1024 * 1024
+
+# An in-place edit saves the part of the file it is going to change in
+# a file with this suffix, which is removed once the edit is complete.
+JOURNAL_SUFFIX: str = '.fpyutils-journal'
+
+# Number of bytes read from the beginning of a file to detect its line
+# ending.
+NEWLINE_SAMPLE_SIZE: int = 64 * 1024
+
+# Edits coordinated by FileEditCoordinator lock a file with this suffix,
+# which is left in place.
+LOCK_SUFFIX: str = '.fpyutils-lock'
+
+# A FileTransaction writes the new content of a file, and a link to the
+# old one, next to it in files with this suffix.
+TRANSACTION_SUFFIX: str = '.fpyutils-transaction'
+
+# inotify events that wake a LineMatchFollower: IN_MODIFY, IN_ATTRIB,
+# IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE and IN_DELETE.
+INOTIFY_EVENTS: int = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200
+
+# Default distance, in lines, between the checkpoints of a LineIndex.
+LINE_INDEX_STEP: int = 1000
+
+# The ASCII characters removed by str.strip().
+ASCII_WHITESPACE: bytes = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+
+# Maximum number of sorted runs merged at once by sort_lines. More runs are
+# merged in several passes.
+SORT_MERGE_FAN_IN: int = 128
+
+# Compressed files are recognized by the first bytes of their content.
+COMPRESSION_MAGIC_NUMBERS: dict[str, bytes] = {
+    'gzip': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+    'zstd': b'\x28\xb5\x2f\xfd',
+}
+
+# The number of bytes needed to detect the compression format.
+MAGIC_NUMBER_SIZE: int = 6
+
+
+def _iter_line_matches(
+        lines: Iterable[str], pattern: str, max_occurrencies: int,
+        loose_matching: bool,
+        keep_all_lines: bool) -> Iterator[tuple[int, str, bool]]:
+    r"""Yield the line number, the line and whether it matches.
+
+    Non matching lines are yielded only if ``keep_all_lines`` is set.
+    ``pattern`` and ``max_occurrencies`` must already be normalized.
+    """
+    occurrency_counter: int = 0
+    line_counter: int = 1
+    for line_original in lines:
+        if not keep_all_lines and occurrency_counter >= max_occurrencies:
+            return
+
+        line: str = line_original.strip() if loose_matching else line_original
+        if line == pattern and occurrency_counter < max_occurrencies:
+            occurrency_counter += 1
+            yield line_counter, line_original, True
+        elif keep_all_lines:
+            yield line_counter, line_original, False
+        line_counter += 1
+
+
+def _iter_substitute_lines(lines: Iterable[str], pattern: str,
+                           replacement: str, max_occurrencies: int,
+                           loose_matching: bool) -> Iterator[tuple[str, bool]]:
+    r"""Yield the lines, the matching ones replaced, and whether they match.
+
+    Lines keep their line endings, which are ignored by the comparison
+    like in ``_iter_line_matches``. ``pattern`` and ``max_occurrencies``
+    must already be normalized.
+    """
+    occurrency_counter: int = 0
+    # A substring of every matching line.
+    needle: str = pattern if loose_matching else pattern.rstrip('\n')
+    for line in lines:
+        matched: bool = False
+        if needle in line and occurrency_counter < max_occurrencies:
+            content: str = line.rstrip('\r\n')
+            ending: str = line[len(content):]
+            compared: str = content.strip() if loose_matching else (
+                content + '\n' if ending else content)
+            matched = compared == pattern
+            if matched:
+                occurrency_counter += 1
+                line = (replacement.replace('\n', ending)
+                        if ending else replacement) + ending
+        yield line, matched
+
+
+def _iter_insert_string_at_line(lines: Iterable[str],
+                                string_to_be_inserted: str,
+                                put_at_line_number: int, append: bool,
+                                newline_character: str) -> Iterator[str]:
+    r"""Yield the lines with the string inserted."""
+    line_counter: int = 1
+    for line in lines:
+        # Lines match.
+        if line_counter == put_at_line_number and not append:
+            yield string_to_be_inserted
+        yield line
+        if line_counter == put_at_line_number and append:
+            yield string_to_be_inserted
+        line_counter += 1
+
+    while line_counter <= put_at_line_number:
+        # Out of file bounds.
+        if line_counter == put_at_line_number:
+            # Prepend does not make sense here since we are out of the
+            # file bounds so the `string_to_be_inserted` will always
+            # be the last string inserted in the file.
+            yield string_to_be_inserted
+        else:
+            yield newline_character
+        line_counter += 1
+
+
+def _iter_remove_line_interval(lines: Iterable[str], delete_line_from: int,
+                               delete_line_to: int) -> Iterator[str]:
+    r"""Yield the lines outside the interval.
+
+    LineOutOfFileBoundsError is raised after the last line.
+    """
+    line_counter: int = 1
+    for line in lines:
+        # Ignore the line interval where the content to be deleted lies.
+        if line_counter < delete_line_from or line_counter > delete_line_to:
+            yield line
+        line_counter += 1
+
+    # Invalid line range.
+    if delete_line_from > line_counter or delete_line_to > line_counter:
+        raise LineOutOfFileBoundsError
+
+
+def _line_starts(fd: int, line_numbers: list[int],
+                 newline: bytes) -> dict[int, tuple[int, int]]:
+    r"""Find the byte offsets where some lines start, in a single pass.
+
+    ``newline`` is the single byte ending each line. For every line number
+    the result is the offset and the number of lines preceding it. If the
+    line does not exist the offset is the size of the file and the number
+    of lines is the number of lines in the file.
+    """
+    targets: list[int] = sorted(set(line_numbers))
+    starts: dict[int, tuple[int, int]] = dict()
+    t: int = 0
+    while t < len(targets) and targets[t] <= 1:
+        starts[targets[t]] = (0, 0)
+        t += 1
+
+    # Number of newlines found so far and offset following the last one.
+    lines: int = 0
+    last_start: int = 0
+    offset: int = 0
+    block: bytes = b''
+    if t < len(targets):
+        block = os.pread(fd, BLOCK_SIZE, offset)
+    while t < len(targets) and block:
+        count: int = block.count(newline)
+        if lines + count < targets[t] - 1:
+            # The next line of interest is not in this block.
+            if count > 0:
+                last_start = offset + block.rindex(newline) + 1
+            lines += count
+        else:
+            i: int = block.find(newline)
+            while i >= 0 and t < len(targets):
+                lines += 1
+                last_start = offset + i + 1
+                if targets[t] == lines + 1:
+                    starts[targets[t]] = (last_start, lines)
+                    t += 1
+                i = block.find(newline, i + 1)
+        offset += len(block)
+        block = os.pread(fd, BLOCK_SIZE, offset)
+
+    if t < len(targets):
+        # End of file: a last line without newline is a line anyway.
+        size: int = os.fstat(fd).st_size
+        total: int = lines + (1 if size > last_start else 0)
+        while t < len(targets):
+            starts[targets[t]] = (size, total)
+            t += 1
+
+    return starts
+
+
+def _journal_path(input_file: str) -> str:
+    r"""Return the path of the journal of an in-place edit."""
+    return input_file + JOURNAL_SUFFIX
+
+
+def _sync_directory(path: str):
+    r"""Flush the directory entry of a file to disk."""
+    fd: int = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _journal_header(j) -> tuple[int, int]:
+    r"""Return the offset and the size saved in a complete journal.
+
+    ``(-1, -1)`` is returned if the journal was not completely written.
+    """
+    offset: int = -1
+    size: int = -1
+    header: bytes = j.readline()
+    fields: list[bytes] = header.split()
+    if (header.endswith(b'\n') and len(fields) == 2
+            and all(f.isdigit() for f in fields)):
+        offset, size = int(fields[0]), int(fields[1])
+        if (offset > size or
+                os.fstat(j.fileno()).st_size != len(header) + size - offset):
+            offset, size = -1, -1
+
+    return offset, size
+
+
+def recover_in_place_edit(input_file: str) -> bool:
+    r"""Undo an interrupted in-place edit.
+
+    :parameter input_file: the file that was being edited.
+    :type input_file: str
+    :returns: ``True`` if an interrupted edit was undone, ``False`` if there
+         was nothing to do.
+    :rtype: bool
+    :raises: a built-in exception.
+
+    .. note::
+         This function is called automatically before every in-place edit.
+
+    .. note::
+         A journal that was not completely written means that the file was
+         not modified yet: the journal is removed and ``False`` is returned.
+    """
+    journal: str = _journal_path(input_file)
+    if not os.path.exists(journal):
+        return False
+
+    with open(journal, 'rb') as j:
+        offset, size = _journal_header(j)
+        if offset < 0:
+            os.remove(journal)
+            _sync_directory(journal)
+            return False
+
+        fd: int = os.open(input_file, os.O_RDWR)
+        try:
+            position: int = offset
+            block: bytes = j.read(BLOCK_SIZE)
+            while block:
+                os.pwrite(fd, block, position)
+                position += len(block)
+                block = j.read(BLOCK_SIZE)
+            os.ftruncate(fd, size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.remove(journal)
+    _sync_directory(journal)
+
+    return True
+
+
+def _splice_in_place(input_file: str, offset: int, end: int, data: bytes):
+    r"""Replace the bytes between offset and end with data.
+
+    Only the part of the file starting at offset is read and written.
+    That part is first saved in a journal so that the edit can be undone
+    if it is interrupted.
+    """
+    recover_in_place_edit(input_file)
+
+    fd: int = os.open(input_file, os.O_RDWR)
+    try:
+        size: int = os.fstat(fd).st_size
+
+        # Journal: a header with the offset and the original size,
+        # followed by the original content from the offset to the end.
+        with open(_journal_path(input_file), 'wb') as j:
+            j.write((str(offset) + ' ' + str(size) + '\n').encode('ascii'))
+            position: int = offset
+            while position < size:
+                block: bytes = os.pread(fd, BLOCK_SIZE, position)
+                j.write(block)
+                position += len(block)
+            j.flush()
+            os.fsync(j.fileno())
+        # The journal must be on disk before the file is modified.
+        _sync_directory(_journal_path(input_file))
+
+        try:
+            delta: int = len(data) - (end - offset)
+            if delta > 0:
+                # Shift the tail to the right, starting from its end.
+                position = size
+                while position > end:
+                    start: int = max(end, position - BLOCK_SIZE)
+                    os.pwrite(fd, os.pread(fd, position - start, start),
+                              start + delta)
+                    position = start
+            elif delta < 0:
+                # Shift the tail to the left, starting from its beginning.
+                position = end
+                while position < size:
+                    block = os.pread(fd, min(BLOCK_SIZE, size - position),
+                                     position)
+                    os.pwrite(fd, block, position + delta)
+                    position += len(block)
+                os.ftruncate(fd, size + delta)
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        except BaseException:
+            os.close(fd)
+            fd = -1
+            recover_in_place_edit(input_file)
+            raise
+    finally:
+        if fd >= 0:
+            os.close(fd)
+    # A journal left on disk would undo the edit.
+    os.remove(_journal_path(input_file))
+    _sync_directory(_journal_path(input_file))
+
+
+def _splice_copy(input_file: str, output_file: str, offset: int, end: int,
+                 data: bytes):
+    r"""Copy a file replacing the bytes between offset and end with data.
+
+    The rest of the file is copied in blocks, byte for byte.
+    """
+    import shutil
+    import tempfile
+
+    with open(input_file, 'rb') as src:
+        # Atomic write.
+        with tempfile.NamedTemporaryFile('wb', delete=False) as f:
+            remaining: int = offset
+            block: bytes = src.read(min(BLOCK_SIZE, remaining))
+            while block:
+                f.write(block)
+                remaining -= len(block)
+                block = src.read(min(BLOCK_SIZE, remaining))
+            f.write(data)
+            src.seek(end)
+            shutil.copyfileobj(src, f, BLOCK_SIZE)
+            f.flush()
+            os.fsync(f.fileno())
+    shutil.move(f.name, output_file)
+
+
+def _splice(input_file: str, output_file: str, offset: int, end: int,
+            data: bytes, in_place: bool):
+    r"""Replace the bytes between offset and end, in place or in a copy."""
+    if in_place:
+        _splice_in_place(input_file, offset, end, data)
+    else:
+        _splice_copy(input_file, output_file, offset, end, data)
+
+
+def _check_uncompressed(compression: str):
+    r"""Byte level edits are not possible on compressed files."""
+    if compression != str():
+        raise ValueError
+
+
+def _check_in_place(input_file: str, output_file: str):
+    r"""In-place edits need the same input and output file."""
+    if os.path.realpath(input_file) != os.path.realpath(output_file):
+        raise ValueError
+
+
+def detect_newline(input_file: str,
+                   sample_size: int = NEWLINE_SAMPLE_SIZE,
+                   default: str = os.linesep) -> str:
+    r"""Detect the line ending used by a file.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter sample_size: the number of bytes read from the beginning of
+         the file. Defaults to ``NEWLINE_SAMPLE_SIZE``.
+    :parameter default: the value returned if the sample does not contain
+         any line ending. Defaults to the default platform newline,
+         i.e: ``os.linesep``.
+    :type input_file: str
+    :type sample_size: int
+    :type default: str
+    :returns: the most frequent line ending in the sample, one of ``\n``,
+         ``\r\n`` and ``\r``.
+    :rtype: str
+    :raises: a built-in exception.
+    """
+    if sample_size < 1:
+        raise ValueError
+
+    with open(input_file, 'rb') as f:
+        sample: bytes = f.read(sample_size)
+
+    # A carriage return at the end of a truncated sample might be followed
+    # by a line feed.
+    if len(sample) == sample_size and sample.endswith(b'\r'):
+        sample = sample[:-1]
+
+    crlf: int = sample.count(b'\r\n')
+    counts: dict[str, int] = {
+        '\r\n': crlf,
+        '\n': sample.count(b'\n') - crlf,
+        '\r': sample.count(b'\r') - crlf,
+    }
+    newline: str = max(counts, key=counts.get)
+    if counts[newline] == 0:
+        newline = default
+
+    return newline
+
+
+def _insert_string_at_line_bytes(input_file: str, output_file: str,
+                                 string_to_be_inserted: str,
+                                 put_at_line_number: int, append: bool,
+                                 newline_character: str, in_place: bool):
+    r"""Insert a string leaving the rest of the file untouched."""
+    import locale
+
+    if newline_character not in ('\n', '\r', '\r\n'):
+        raise ValueError
+
+    fd: int = os.open(input_file, os.O_RDONLY)
+    try:
+        # The string goes at the beginning of the selected line or of the
+        # following one.
+        target: int = put_at_line_number + (1 if append else 0)
+        offset, lines = _line_starts(
+            fd, [target], newline_character[-1:].encode('ascii'))[target]
+    finally:
+        os.close(fd)
+
+    # Out of file bounds: pad with empty lines.
+    padding: int = max(0, put_at_line_number - lines - 1)
+    data: str = (padding * newline_character +
+                 string_to_be_inserted.replace('\n', newline_character))
+    _splice(input_file, output_file, offset, offset,
+            data.encode(locale.getpreferredencoding(False)), in_place)
+
+
+def _remove_line_interval_bytes(input_file: str, output_file: str,
+                                delete_line_from: int, delete_line_to: int,
+                                newline: bytes, in_place: bool):
+    r"""Remove a line interval leaving the rest of the file untouched."""
+    fd: int = os.open(input_file, os.O_RDONLY)
+    try:
+        starts: dict[int, tuple[int, int]] = _line_starts(
+            fd, [delete_line_from, delete_line_to + 1], newline)
+    finally:
+        os.close(fd)
+
+    # Same bounds as the line by line version: up to one line after
+    # the end of the file is tolerated.
+    if starts[delete_line_to + 1][1] < delete_line_to - 1:
+        raise LineOutOfFileBoundsError
+
+    _splice(input_file, output_file, starts[delete_line_from][0],
+            starts[delete_line_to + 1][0], b'', in_place)
+
+
+def detect_compression(input_file: str) -> str:
+    r"""Detect the compression format of a file from its magic number.
+
+    :parameter input_file: the file that needs to be read.
+    :type input_file: str
+    :returns: one of the keys of ``COMPRESSION_MAGIC_NUMBERS``, or an empty
+         string if the file is not compressed.
+    :rtype: str
+    :raises: a built-in exception.
+    """
+    with open(input_file, 'rb') as f:
+        compression: str = _magic_compression(f.peek(MAGIC_NUMBER_SIZE))
+
+    return compression
+
+
+def _magic_compression(sample: bytes) -> str:
+    r"""Detect the compression format from the first bytes of a file."""
+    compression: str = str()
+    for name, magic in COMPRESSION_MAGIC_NUMBERS.items():
+        if sample[:len(magic)] == magic:
+            compression = name
+    # bzip2 headers go on with the block size, from 1 to 9: text files can
+    # start with BZh too.
+    if compression == 'bz2' and not b'1' <= sample[3:4] <= b'9':
+        compression = str()
+
+    return compression
+
+
+def _codec_stream(fileobj, mode: str, compression: str):
+    r"""Wrap a binary file object with a decompressor or a compressor.
+
+    ``mode`` is either ``r`` or ``w``. The file object is not closed
+    together with the stream.
+    """
+    stream = None
+    if compression == 'gzip':
+        import gzip
+        stream = gzip.GzipFile(fileobj=fileobj, mode=mode + 'b')
+    elif compression == 'bz2':
+        import bz2
+        stream = bz2.BZ2File(fileobj, mode + 'b')
+    elif compression == 'xz':
+        import lzma
+        stream = lzma.LZMAFile(fileobj, mode + 'b')
+    elif compression == 'zstd':
+        # Python 3.14 ships zstd in the standard library, older versions
+        # need the optional zstandard package.
+        try:
+            from compression import zstd
+            stream = zstd.ZstdFile(fileobj, mode + 'b')
+        except ImportError:
+            import zstandard
+            if mode == 'r':
+                stream = zstandard.ZstdDecompressor().stream_reader(
+                    fileobj, read_across_frames=True, closefd=False)
+            else:
+                stream = zstandard.ZstdCompressor().stream_writer(
+                    fileobj, closefd=False)
+    else:
+        raise ValueError
+
+    return stream
+
+
+@contextlib.contextmanager
+def _text_stream(raw, mode: str, compression: str, newline: str = None):
+    r"""Decode or encode an open binary file, compressed or not.
+
+    ``raw`` is left open: compressed content is complete, and can be
+    synced, once the context exits.
+    """
+    import locale
+
+    stream = raw
+    if compression != str():
+        stream = _codec_stream(raw, mode, compression)
+    f = io.TextIOWrapper(stream,
+                         encoding=locale.getpreferredencoding(False),
+                         newline=newline)
+    try:
+        yield f
+    finally:
+        f.detach()
+        if stream is not raw:
+            stream.close()
+
+
+@contextlib.contextmanager
+def _open_text(input_file: str,
+               mode: str,
+               compression: str = str(),
+               newline: str = None):
+    r"""Open a file in text mode, compressed or not.
+
+    Compressed content is decoded a block at a time, like a regular file.
+    """
+    if compression == str():
+        with open(input_file, mode, newline=newline) as f:
+            yield f
+    else:
+        with open(input_file, mode + 'b') as raw:
+            with _text_stream(raw, mode, compression, newline) as f:
+                yield f
+
+
+@contextlib.contextmanager
+def _open_detected(input_file: str, newline: str = None):
+    r"""Open a file for reading in text mode, compressed or not.
+
+    Yield the text stream and the compression format. The magic number is
+    peeked from the same handle, so no data is lost when reading from a
+    pipe. Data arriving in pieces shorter than the magic number is read
+    as uncompressed.
+    """
+    with open(input_file, 'r', newline=newline) as f:
+        # Nothing is decoded before the first read.
+        compression: str = _magic_compression(f.buffer.peek(MAGIC_NUMBER_SIZE))
+        if compression == str():
+            yield f, compression
+        else:
+            with _text_stream(f.buffer, 'r', compression, newline) as g:
+                yield g, compression
+
+
+@contextlib.contextmanager
+def _atomic_text_file(output_file: str,
+                      newline: str = None,
+                      compression: str = str(),
+                      directory: str = None):
+    r"""Open a temporary text file replacing output_file on success.
+
+    Nothing is replaced if the context exits with an exception. The
+    temporary file is created in ``directory``, by default the system
+    temporary directory.
+    """
+    import shutil
+    import tempfile
+
+    # Atomic write.
+    # See
+    # https://stupidpythonideas.blogspot.com/2014/07/getting-atomic-writes-right.html
+    # https://docs.python.org/3/library/os.html#os.fsync
+    with tempfile.NamedTemporaryFile('wb', delete=False, dir=directory) as raw:
+        try:
+            # The underlying file: the wrapper is slow for many small writes.
+            with _text_stream(raw.file, 'w', compression, newline) as f:
+                yield f
+            raw.flush()
+            os.fsync(raw.fileno())
+        except BaseException:
+            raw.close()
+            os.remove(raw.name)
+            raise
+    shutil.move(raw.name, output_file)
+
+
+def _write_atomically(output_file: str,
+                      text: str,
+                      newline: str = None,
+                      compression: str = str()):
+    r"""Replace a file with the text, optionally compressed."""
+    with _atomic_text_file(output_file, newline, compression) as f:
+        f.write(text)
+
 
 def get_line_matches(
         input_file: str,
@@ -65,6 +719,11 @@ def get_line_matches(
 
     .. note::
          Line numbers start from ``1``.
+
+    .. note::
+         Compressed files are decompressed while they are read, see
+         ``detect_compression``. zstd needs Python 3.14 or the
+         ``zstandard`` package.
     """
     if max_occurrencies < 0 or max_occurrencies > sys.maxsize:
         raise ValueError
@@ -72,7 +731,6 @@ def get_line_matches(
     occurrency_counter: int = 0
     occurrency_matches: dict[int, int] = dict()
     lines: list[str] = list()
-    line_original: str
 
     if max_occurrencies == 0:
         # See
@@ -81,184 +739,1915 @@ def get_line_matches(
     if loose_matching:
         pattern = pattern.strip()
 
-    line_counter: int = 1
-    with open(input_file, 'r') as f:
-        line = f.readline()
-        while line and (keep_all_lines
-                        or occurrency_counter < max_occurrencies):
-            line_original = line
-            if loose_matching:
-                line = line.strip()
-
-            if line == pattern and occurrency_counter < max_occurrencies:
+    with _open_detected(input_file) as (f, _):
+        for line_counter, line, matched in _iter_line_matches(
+                iter(f.readline, str()), pattern, max_occurrencies,
+                loose_matching, keep_all_lines):
+            if matched:
                 occurrency_counter += 1
                 occurrency_matches[occurrency_counter] = line_counter
-                lines.append(line_original)
-            elif keep_all_lines:
-                lines.append(line_original)
-
-            line = f.readline()
-            line_counter += 1
+            lines.append(line)
 
     return occurrency_matches, ''.join(lines)
 
 
-def insert_string_at_line(input_file: str,
-                          string_to_be_inserted: str,
-                          put_at_line_number: int,
-                          output_file: str,
-                          append: bool = True,
-                          newline_character: str = os.linesep):
-    r"""Write a string at the specified line.
+def _match_line(line: bytes, needle: bytes, pattern: str,
+                encoded_pattern: bytes, loose_matching: bool,
+                encoding: str) -> bool:
+    r"""Compare a line, with its newline, like ``get_line_matches`` does."""
+    matched: bool
+    if loose_matching:
+        # ASCII lines do not need to be decoded.
+        matched = (line.strip(ASCII_WHITESPACE) == needle
+                   or not line.isascii()
+                   and line.decode(encoding).strip() == pattern)
+    else:
+        if line.endswith(b'\r\n'):
+            line = line[:-2] + b'\n'
+        elif line.endswith(b'\r'):
+            line = line[:-1] + b'\n'
+        matched = line == encoded_pattern
 
-    :parameter input_file: the file that needs to be read.
-    :parameter string_to_be_inserted: the string that needs to be added.
-    :parameter put_at_line_number: the line number on which to append the
-         string.
-    :parameter output_file: the file that needs to be written with the new
-         content.
-    :parameter append: decides whether to append or prepend the string at the
-         selected line. Defaults to ``True``.
-    :parameter newline_character: set the character used to fill the file
-         in case line_number is greater than the number of lines of
-         input_file. Defaults to the default platform newline,
-         i.e: ``os.linesep``.
-    :type input_file: str
-    :type string_to_be_inserted: str
-    :type line_number: int
-    :type output_file: str
-    :type append: bool
-    :type newline_character: str
-    :returns: None
-    :raises: a built-in exception.
+    return matched
 
-    .. note::
-         Line numbers start from ``1``.
+
+def _match_chunk(chunk: bytes, needle: bytes, pattern: str,
+                 encoded_pattern: bytes, loose_matching: bool,
+                 encoding: str) -> tuple[list[int], list[int]]:
+    r"""Return the indices and the start offsets of the matching lines.
+
+    ``chunk`` holds complete lines. Few occurrencies of ``needle`` are
+    found with ``bytes.find``. Otherwise the chunk is split into lines,
+    which are compared in bulk. Chunks with a lone ``\r``, which also ends
+    a line in text mode, are compared one line at a time.
+    """
+    import re
+
+    indices: list[int] = list()
+    starts: list[int] = list()
+    newlines: int = chunk.count(b'\n')
+    if chunk.count(b'\r') != chunk.count(b'\r\n'):
+        for index, line in enumerate(
+                re.finditer(rb'[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+', chunk)):
+            if _match_line(line.group(), needle, pattern, encoded_pattern,
+                           loose_matching, encoding):
+                indices.append(index)
+                starts.append(line.start())
+    elif needle != b'' and chunk.count(needle) * 8 < newlines:
+        counted: int = 0
+        index: int = 0
+        i: int = chunk.find(needle)
+        while i >= 0:
+            start: int = chunk.rfind(b'\n', 0, i) + 1
+            stop: int = chunk.find(b'\n', i) + 1 or len(chunk)
+            index += chunk.count(b'\n', counted, start)
+            counted = start
+            if _match_line(chunk[start:stop], needle, pattern, encoded_pattern,
+                           loose_matching, encoding):
+                indices.append(index)
+                starts.append(start)
+            i = chunk.find(needle, stop)
+    else:
+        parts: list[bytes] = chunk.split(b'\n')
+        # The empty string after the last newline is not a line.
+        if parts[-1] == b'':
+            parts.pop()
+        lines = range(len(parts))
+        if loose_matching:
+            indices = list(
+                itertools.compress(
+                    lines,
+                    map(
+                        operator.eq,
+                        map(bytes.strip, parts,
+                            itertools.repeat(ASCII_WHITESPACE)),
+                        itertools.repeat(needle))))
+            # Lines with non ASCII whitespace characters.
+            if not chunk.isascii():
+                others: list[int] = [
+                    k for k in itertools.compress(
+                        lines, map(operator.not_, map(bytes.isascii, parts)))
+                    if needle in parts[k]
+                    and _match_line(parts[k], needle, pattern, encoded_pattern,
+                                    True, encoding)
+                    and parts[k].strip(ASCII_WHITESPACE) != needle
+                ]
+                indices = sorted(indices + others)
+        else:
+            if encoded_pattern.endswith(b'\n'):
+                targets: set[bytes] = {needle, needle + b'\r'}
+                indices = list(
+                    itertools.compress(range(newlines),
+                                       map(targets.__contains__, parts)))
+            # The last line of the file, without newline.
+            if len(parts) > newlines and parts[-1] == encoded_pattern:
+                indices.append(newlines)
+        # The line lengths without newline, summed.
+        lengths: list[int] = list(
+            itertools.accumulate(itertools.chain((0, ), map(len, parts))))
+        starts = list(
+            map(operator.add, map(lengths.__getitem__, indices), indices))
+
+    return indices, starts
+
+
+class LineMatches(Mapping):
+    r"""The line numbers and byte offsets of the lines matching a pattern.
+
+    This is a read-only mapping from the number of occurrencies to the line
+    numbers, like the dictionary returned by ``get_line_matches``. Objects
+    of this class are created by ``find_line_matches``.
 
     .. note::
-         Existing line endings of the input file are changed to
-         ``newline_character``.
+         Line numbers and offsets are stored in two ``array('q')``, i.e.
+         16 bytes per match. The text of the lines is read from the file
+         only when requested: the file must not change in the meantime.
     """
-    if put_at_line_number < 1:
-        raise ValueError
 
-    line_counter: int = 1
-    loop: bool = True
-    subst_done: bool = False
-    final_string: list[str] = list()
-    with open(input_file, 'r') as f:
-        while loop:
-            current_line: str = f.readline()
-            while current_line:
-                # Lines match.
-                if line_counter == put_at_line_number:
-                    subst_done = True
-                    if append:
-                        # Append.
-                        final_string.append(current_line)
-                        final_string.append(string_to_be_inserted)
-                    else:
-                        # Prepend.
-                        final_string.append(string_to_be_inserted)
-                        final_string.append(current_line)
-                else:
-                    # No match, generic line.
-                    final_string.append(current_line)
-                current_line = f.readline()
-                line_counter += 1
-            while not current_line and line_counter <= put_at_line_number:
-                # Out of file bounds.
-                if line_counter == put_at_line_number:
-                    final_string.append(string_to_be_inserted)
-                    line_counter += 1
-                    # Prepend does not make sense here since we are out of the
-                    # file bounds so the `string_to_be_inserted` will always
-                    # be the last string inserted in the file.
-                else:
-                    final_string.append(newline_character)
-                    line_counter += 1
+    def __init__(self, input_file: str, line_numbers: array.array,
+                 offsets: array.array, encoding: str):
+        r"""Wrap the arrays."""
+        self.input_file: str = input_file
+        self.encoding: str = encoding
+        self._line_numbers: array.array = line_numbers
+        self._offsets: array.array = offsets
 
-            if not current_line or (line_counter > put_at_line_number
-                                    and subst_done):
-                # All the file has been iterated by this point and the
-                # substitution has been done either in or out of the file
-                # bounds.
-                loop = False
+    def __getitem__(self, occurrency: int) -> int:
+        r"""Return the line number of an occurrency, starting from ``1``."""
+        if not isinstance(occurrency, int) or not (1 <= occurrency <= len(
+                self._line_numbers)):
+            raise KeyError(occurrency)
 
-    # Atomic write.
-    # See
-    # https://stupidpythonideas.blogspot.com/2014/07/getting-atomic-writes-right.html
-    # https://docs.python.org/3/library/os.html#os.fsync
-    with tempfile.NamedTemporaryFile('w',
-                                     newline=newline_character,
-                                     delete=False) as f:
-        f.flush()
-        os.fsync(f.fileno())
-        f.write(''.join(final_string))
-    shutil.move(f.name, output_file)
+        return self._line_numbers[occurrency - 1]
 
+    def __iter__(self) -> Iterator[int]:
+        r"""Iterate over the occurrencies."""
+        return iter(range(1, len(self._line_numbers) + 1))
 
-def remove_line_interval(input_file: str, delete_line_from: int,
-                         delete_line_to: int, output_file: str):
-    r"""Remove a line interval.
+    def __len__(self) -> int:
+        r"""Return the number of matches."""
+        return len(self._line_numbers)
+
+    def __repr__(self) -> str:
+        r"""Show the matches like a dictionary."""
+        return (type(self).__name__ + '(' + repr(self.input_file) + ', ' +
+                repr(dict(self)) + ')')
+
+    @property
+    def line_numbers(self) -> array.array:
+        r"""The matched line numbers."""
+        return self._line_numbers
+
+    @property
+    def offsets(self) -> array.array:
+        r"""The byte offsets where the matched lines start."""
+        return self._offsets
+
+    def to_numpy(self, field: str = 'line_numbers'):
+        r"""Return the line numbers or the offsets as a NumPy array.
+
+        :parameter field: either ``line_numbers`` or ``offsets``.
+             Defaults to ``line_numbers``.
+        :type field: str
+        :returns: a read-only ``int64`` array sharing memory with this
+             object.
+        :rtype: numpy.ndarray
+        :raises: ValueError, ImportError if NumPy is not installed, or
+             a built-in exception.
+        """
+        import numpy
+
+        if field not in ('line_numbers', 'offsets'):
+            raise ValueError
+
+        values = numpy.frombuffer(getattr(self, '_' + field),
+                                  dtype=numpy.int64)
+        values.flags.writeable = False
+
+        return values
+
+    def _read_line(self, f, offset: int) -> str:
+        r"""Read and decode the line starting at offset, like in text mode."""
+        f.seek(offset)
+        line: bytes = f.readline()
+        # Both \r\n and a lone \r end the line.
+        end: int = line.find(b'\r')
+        if end >= 0:
+            line = line[:end] + b'\n'
+
+        return line.decode(self.encoding)
+
+    def line(self, occurrency: int) -> str:
+        r"""Read the text of a matched line.
+
+        :parameter occurrency: the number of the occurrency, starting from
+             ``1``.
+        :type occurrency: int
+        :returns: the line, with its newline.
+        :rtype: str
+        :raises: KeyError or a built-in exception.
+        """
+        self[occurrency]
+        with open(self.input_file, 'rb') as f:
+            line: str = self._read_line(f, self._offsets[occurrency - 1])
+
+        return line
+
+    def lines(self) -> Iterator[str]:
+        r"""Read the text of the matched lines, one at a time.
+
+        :returns: the lines, with their newline.
+        :rtype: Iterator[str]
+        :raises: a built-in exception.
+        """
+        with open(self.input_file, 'rb') as f:
+            for offset in self._offsets:
+                yield self._read_line(f, offset)
+
+    def text(self) -> str:
+        r"""Return the matched lines joined, like ``get_line_matches``.
+
+        :rtype: str
+        :raises: a built-in exception.
+        """
+        return ''.join(self.lines())
+
+
+def find_line_matches(input_file: str,
+                      pattern: str,
+                      max_occurrencies: int = 0,
+                      loose_matching: bool = True) -> LineMatches:
+    r"""Find the lines matching a pattern without keeping their text.
 
     :parameter input_file: the file that needs to be read.
-    :parameter delete_line_from: the line number from which start deleting.
-    :parameter delete_line_to: the line number to which stop deleting.
-    :parameter output_file: the file that needs to be written without the
-         selected lines.
+    :parameter pattern: the pattern that needs to be searched.
+    :parameter max_occurrencies: the maximum number of expected occurrencies.
+         Defaults to ``0`` which means that all occurrencies will be matched.
+    :parameter loose_matching: ignore leading and trailing whitespace
+         characters for both pattern and matched strings. Defaults to ``True``.
     :type input_file: str
-    :type delete_line_from: int
-    :type delete_line_to: int
-    :type output_file: str
-    :returns: None
-    :raises: NegativeLineRangeError, LineOutOfFileBoundsError
-         or a built-in exception.
-
-    .. note::
-         Line numbers start from ``1``.
+    :type pattern: str
+    :type max_occurrencies: int
+    :type loose_matching: bool
+    :returns: the matches, which compare equal to the dictionary returned by
+         ``get_line_matches``.
+    :rtype: LineMatches
+    :raises: a built-in exception.
 
     .. note::
-         It is possible to remove a single line only. This happens when
-         the parameters delete_line_from and delete_line_to are equal.
+         Lines are delimited by ``\n``, ``\r\n`` or ``\r`` and decoded with
+         the preferred locale encoding, like in ``get_line_matches``. The file is read in
+         blocks and only the lines containing the pattern are decoded.
+         Compressed files are not supported.
     """
-    # Invalid line ranges.
-    if delete_line_from < 1 or delete_line_to < 1:
+    import locale
+
+    if max_occurrencies < 0 or max_occurrencies > sys.maxsize:
         raise ValueError
-    # Base case delete_line_to - delete_line_from == 0: single line.
+    if max_occurrencies == 0:
+        max_occurrencies = sys.maxsize
+    if loose_matching:
+        pattern = pattern.strip()
+
+    encoding: str = locale.getpreferredencoding(False)
+    # Every line matching the pattern contains these bytes.
+    needle: bytes = pattern.rstrip('\r\n').encode(encoding)
+    encoded_pattern: bytes = pattern.encode(encoding)
+    line_numbers = array.array('q')
+    offsets = array.array('q')
+    lines: int = 0
+    base: int = 0
+    pending: bytes = b''
+    with open(input_file, 'rb') as f:
+        _check_uncompressed(_magic_compression(f.peek(MAGIC_NUMBER_SIZE)))
+        block: bytes = f.read(BLOCK_SIZE)
+        # Lines never contain carriage returns in text mode.
+        go: bool = '\r' not in pattern
+        while go:
+            data: bytes = pending + block
+            # Complete lines only, except at the end of the file.
+            end: int = data.rfind(b'\n') + 1 if block else len(data)
+            chunk: bytes = data[:end]
+            pending = data[end:]
+
+            indices, starts = _match_chunk(chunk, needle, pattern,
+                                           encoded_pattern, loose_matching,
+                                           encoding)
+            remaining: int = max_occurrencies - len(line_numbers)
+            line_numbers.extend(
+                map(operator.add, indices[:remaining],
+                    itertools.repeat(lines + 1)))
+            offsets.extend(
+                map(operator.add, starts[:remaining], itertools.repeat(base)))
+            # Lines end with \n, \r\n or a lone \r.
+            lines += (chunk.count(b'\n') + chunk.count(b'\r') -
+                      chunk.count(b'\r\n'))
+            base += end
+
+            go = block != b'' and len(line_numbers) < max_occurrencies
+            block = f.read(BLOCK_SIZE)
+
+    return LineMatches(input_file, line_numbers, offsets, encoding)
+
+
+class LineIndex:
+    r"""The byte offsets of every ``step``-th line of a file.
+
+    Objects of this class are created by ``build_line_index`` and used by
+    ``read_line_range``.
+
+    :parameter input_file: the indexed file.
+    :parameter step: the distance, in lines, between two checkpoints.
+    :type input_file: str
+    :type step: int
+
+    .. note::
+         Lines are delimited by ``\n``. An index takes 8 bytes for every
+         ``step`` lines.
+    """
+
+    def __init__(self, input_file: str, step: int = LINE_INDEX_STEP):
+        r"""Create an empty index."""
+        if step < 1:
+            raise ValueError
+
+        self.input_file: str = input_file
+        self.step: int = step
+        # offsets[i] is where line i * step + 1 starts. A last line without
+        # newline has no checkpoint until it is complete.
+        self.offsets = array.array('q')
+        self._identity: tuple[int, int] = (0, 0)
+        # Offset and number of the lines scanned so far.
+        self._scanned: int = 0
+        self._lines: int = 0
+        self._size: int = 0
+
+    @property
+    def lines(self) -> int:
+        r"""The number of lines of the file when it was last indexed."""
+        return self._lines + (1 if self._size > self._scanned else 0)
+
+    def update(self):
+        r"""Index the lines added to the file since the last update.
+
+        The index is rebuilt if the file was replaced or truncated.
+
+        :raises: a built-in exception.
+        """
+        st: os.stat_result = os.stat(self.input_file)
+        if ((st.st_dev, st.st_ino) != self._identity
+                or st.st_size < self._scanned):
+            self.offsets = array.array('q')
+            self._identity = (st.st_dev, st.st_ino)
+            self._scanned = 0
+            self._lines = 0
+
+        with open(self.input_file, 'rb') as f:
+            f.seek(self._scanned)
+            pending: bytes = b''
+            block: bytes = f.read(BLOCK_SIZE)
+            while block:
+                data: bytes = pending + block
+                end: int = data.rfind(b'\n') + 1
+                pending = data[end:]
+                if end > 0:
+                    # Lines starting in this chunk, with their lengths
+                    # summed.
+                    parts: list[bytes] = data[:end].split(b'\n')
+                    parts.pop()
+                    lengths: list[int] = list(
+                        itertools.accumulate(
+                            itertools.chain((0, ), map(len, parts))))
+                    for j in range((-self._lines) % self.step, len(parts),
+                                   self.step):
+                        self.offsets.append(self._scanned + lengths[j] + j)
+                    self._scanned += end
+                    self._lines += len(parts)
+                block = f.read(BLOCK_SIZE)
+            self._size = self._scanned + len(pending)
+
+    def checkpoint(self, line_number: int) -> tuple[int, int]:
+        r"""Return the closest indexed line before a line, and its offset.
+
+        :parameter line_number: the line number, starting from ``1``.
+        :type line_number: int
+        :returns: the line number and the byte offset of the checkpoint.
+        :rtype: tuple[int, int]
+        :raises: ValueError or a built-in exception.
+        """
+        if line_number < 1:
+            raise ValueError
+
+        i: int = min((line_number - 1) // self.step, len(self.offsets) - 1)
+        checkpoint: tuple[int, int] = (1, 0)
+        if i >= 0:
+            checkpoint = (i * self.step + 1, self.offsets[i])
+
+        return checkpoint
+
+    def _check(self, input_file: str):
+        r"""Make sure the index is about the file and still valid."""
+        st: os.stat_result = os.stat(input_file)
+        if ((st.st_dev, st.st_ino) != self._identity
+                or st.st_size < self._size):
+            raise ValueError
+
+
+def build_line_index(input_file: str,
+                     step: int = LINE_INDEX_STEP) -> LineIndex:
+    r"""Index the offsets of the lines of a file in a single pass.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter step: the distance, in lines, between two checkpoints.
+         Defaults to ``LINE_INDEX_STEP``.
+    :type input_file: str
+    :type step: int
+    :returns: the index, which can be passed to ``read_line_range`` as
+         long as the file is only appended to. Call its ``update`` method
+         to index new lines.
+    :rtype: LineIndex
+    :raises: a built-in exception.
+    """
+    index: LineIndex = LineIndex(input_file, step)
+    index.update()
+
+    return index
+
+
+def _iter_line_range(input_file: str, line_from: int, line_to: int,
+                     index: LineIndex) -> Iterator[str]:
+    r"""Seek to the closest checkpoint and yield the lines in the range."""
+    import locale
+
+    encoding: str = locale.getpreferredencoding(False)
+    with open(input_file, 'rb') as f:
+        line_number: int
+        offset: int
+        if index is None:
+            offset, line_number = _line_starts(f.fileno(), [line_from],
+                                               b'\n')[line_from]
+            line_number += 1
+        else:
+            line_number, offset = index.checkpoint(line_from)
+        f.seek(offset)
+
+        line: bytes = f.readline()
+        while line and line_number <= line_to:
+            if line_number >= line_from:
+                yield line.decode(encoding).replace('\r\n', '\n')
+            line_number += 1
+            line = f.readline()
+
+
+def read_line_range(input_file: str,
+                    line_from: int,
+                    line_to: int,
+                    index: LineIndex = None) -> Iterator[str]:
+    r"""Read an interval of lines.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter line_from: the first line to read.
+    :parameter line_to: the last line to read.
+    :parameter index: an index of input_file, see ``build_line_index``.
+         Defaults to ``None`` which means that the file is scanned from the
+         beginning, without decoding it, up to line_from.
+    :type input_file: str
+    :type line_from: int
+    :type line_to: int
+    :type index: LineIndex
+    :returns: the lines, with their newline. Lines after the end of the
+         file are ignored.
+    :rtype: Iterator[str]
+    :raises: NegativeLineRangeError, ValueError if the index is not valid
+         for input_file, or a built-in exception.
+
+    .. note::
+         Line numbers start from ``1``. Lines are delimited by ``\n`` and
+         decoded with the preferred locale encoding, with ``\r\n``
+         translated to ``\n``.
+
+    .. note::
+         With an index, at most ``step - 1`` lines are read before
+         line_from.
+    """
+    if line_from < 1 or line_to < 1:
+        raise ValueError
+    if line_to - line_from < 0:
+        raise NegativeLineRangeError
+    if index is not None:
+        index._check(input_file)
+
+    return _iter_line_range(input_file, line_from, line_to, index)
+
+
+def insert_string_at_line(input_file: str,
+                          string_to_be_inserted: str,
+                          put_at_line_number: int,
+                          output_file: str,
+                          append: bool = True,
+                          newline_character: str = os.linesep,
+                          in_place: bool = False,
+                          preserve_line_endings: bool = False):
+    r"""Write a string at the specified line.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter string_to_be_inserted: the string that needs to be added.
+    :parameter put_at_line_number: the line number on which to append the
+         string.
+    :parameter output_file: the file that needs to be written with the new
+         content.
+    :parameter append: decides whether to append or prepend the string at the
+         selected line. Defaults to ``True``.
+    :parameter newline_character: set the character used to fill the file
+         in case line_number is greater than the number of lines of
+         input_file. Defaults to the default platform newline,
+         i.e: ``os.linesep``.
+    :parameter in_place: edit the file directly instead of rewriting it.
+         ``output_file`` must be ``input_file``. Defaults to ``False``.
+    :parameter preserve_line_endings: use the line ending detected in
+         input_file instead of ``newline_character`` and copy the
+         existing lines byte for byte. ``newline_character`` is used only
+         if input_file has no line endings. Defaults to ``False``.
+    :type input_file: str
+    :type string_to_be_inserted: str
+    :type line_number: int
+    :type output_file: str
+    :type append: bool
+    :type newline_character: str
+    :type in_place: bool
+    :type preserve_line_endings: bool
+    :returns: None
+    :raises: a built-in exception.
+
+    .. note::
+         Line numbers start from ``1``.
+
+    .. note::
+         Existing line endings of the input file are changed to
+         ``newline_character``, except in in-place mode and in
+         preserve_line_endings mode.
+
+    .. note::
+         In in-place mode only the bytes from the insertion point to the end
+         of the file are written: appending to the end of a file costs
+         about as much as the appended string, plus a read-only scan to find
+         the line. Lines are delimited by the last character of
+         ``newline_character``, ``\n`` in ``string_to_be_inserted`` is
+         written as ``newline_character`` and the file is encoded with the preferred
+         locale encoding, like in text mode. The part of the file being
+         changed is saved in a journal first, see
+         ``recover_in_place_edit``.
+
+    .. note::
+         In preserve_line_endings mode the file is handled as bytes, like in
+         in-place mode, but with the detected line ending, see
+         ``detect_newline``. The two modes can be combined.
+
+    .. note::
+         A compressed input_file is rewritten with the same compression
+         format, see ``get_line_matches``. In-place and
+         preserve_line_endings modes do not support compressed files.
+    """
+    if put_at_line_number < 1:
+        raise ValueError
+
+    compression: str = detect_compression(input_file)
+    if in_place or preserve_line_endings:
+        _check_uncompressed(compression)
+    if in_place:
+        _check_in_place(input_file, output_file)
+    if preserve_line_endings:
+        newline_character = detect_newline(input_file,
+                                           default=newline_character)
+
+    if in_place or preserve_line_endings:
+        _insert_string_at_line_bytes(input_file, output_file,
+                                     string_to_be_inserted, put_at_line_number,
+                                     append, newline_character, in_place)
+    else:
+        final_string: list[str]
+        with _open_text(input_file, 'r', compression) as f:
+            lines: Iterator[str] = iter(f.readline, str())
+            final_string = list(
+                _iter_insert_string_at_line(lines, string_to_be_inserted,
+                                            put_at_line_number, append,
+                                            newline_character))
+
+        _write_atomically(output_file, ''.join(final_string),
+                          newline_character, compression)
+
+
+def remove_line_interval(input_file: str,
+                         delete_line_from: int,
+                         delete_line_to: int,
+                         output_file: str,
+                         in_place: bool = False,
+                         preserve_line_endings: bool = False):
+    r"""Remove a line interval.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter delete_line_from: the line number from which start deleting.
+    :parameter delete_line_to: the line number to which stop deleting.
+    :parameter output_file: the file that needs to be written without the
+         selected lines.
+    :parameter in_place: edit the file directly instead of rewriting it.
+         ``output_file`` must be ``input_file``. Defaults to ``False``.
+    :type input_file: str
+    :type delete_line_from: int
+    :type delete_line_to: int
+    :parameter preserve_line_endings: split lines with the line ending
+         detected in input_file and copy the remaining lines byte for byte.
+         Defaults to ``False``.
+    :type output_file: str
+    :type in_place: bool
+    :type preserve_line_endings: bool
+    :returns: None
+    :raises: NegativeLineRangeError, LineOutOfFileBoundsError
+         or a built-in exception.
+
+    .. note::
+         Line numbers start from ``1``.
+
+    .. note::
+         It is possible to remove a single line only. This happens when
+         the parameters delete_line_from and delete_line_to are equal.
+
+    .. note::
+         In in-place mode only the bytes from the first removed line to the
+         end of the file are written, lines are delimited by ``\n`` and
+         the existing line endings are kept. See also
+         ``insert_string_at_line``.
+
+    .. note::
+         In preserve_line_endings mode the file is handled as bytes, lines
+         are delimited by the line ending detected with ``detect_newline``,
+         so files using ``\r`` alone are supported, and the existing
+         line endings are kept.
+
+    .. note::
+         Compressed files are supported like in ``insert_string_at_line``.
+    """
+    # Invalid line ranges.
+    if delete_line_from < 1 or delete_line_to < 1:
+        raise ValueError
+    # Base case delete_line_to - delete_line_from == 0: single line.
     if delete_line_to - delete_line_from < 0:
         raise NegativeLineRangeError
 
-    line_counter: int = 1
-    line_to_write: list[str] = list()
-    line: str
-
-    # Rewrite the file without the string.
-    with open(input_file, 'r') as f:
-        line = f.readline()
-        while line:
-            # Ignore the line interval where the content to be deleted lies.
-            if line_counter >= delete_line_from and line_counter <= delete_line_to:
-                pass
-            # Write the rest of the file.
+    compression: str = detect_compression(input_file)
+    if in_place or preserve_line_endings:
+        _check_uncompressed(compression)
+    if in_place:
+        _check_in_place(input_file, output_file)
+
+    if in_place or preserve_line_endings:
+        newline: bytes = b'\n'
+        if preserve_line_endings:
+            newline = detect_newline(input_file,
+                                     default='\n')[-1:].encode('ascii')
+        _remove_line_interval_bytes(input_file, output_file, delete_line_from,
+                                    delete_line_to, newline, in_place)
+    else:
+        line_to_write: list[str]
+
+        # Rewrite the file without the string.
+        with _open_text(input_file, 'r', compression) as f:
+            line_to_write = list(
+                _iter_remove_line_interval(iter(f.readline, str()),
+                                           delete_line_from, delete_line_to))
+
+        _write_atomically(output_file,
+                          ''.join(line_to_write),
+                          compression=compression)
+
+
+def substitute_lines(input_file: str,
+                     pattern: str,
+                     replacement: str,
+                     output_file: str,
+                     max_occurrencies: int = 0,
+                     loose_matching: bool = True) -> int:
+    r"""Replace the lines matching a pattern in a single pass.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter pattern: the pattern that needs to be searched, like in
+         ``get_line_matches``.
+    :parameter replacement: the new content of the matching lines, without
+         line ending.
+    :parameter output_file: the file that needs to be written with the new
+         content. It can be input_file.
+    :parameter max_occurrencies: the maximum number of lines to replace.
+         Defaults to ``0`` which means that all matching lines are
+         replaced.
+    :parameter loose_matching: ignore leading and trailing whitespace
+         characters for both pattern and lines. Defaults to ``True``.
+    :type input_file: str
+    :type pattern: str
+    :type replacement: str
+    :type output_file: str
+    :type max_occurrencies: int
+    :type loose_matching: bool
+    :returns: the number of replaced lines.
+    :rtype: int
+    :raises: a built-in exception.
+
+    .. note::
+         The file is read and written a block at a time, then output_file
+         is replaced atomically, even if no line matches. Every line keeps
+         its line ending, ``\n`` in ``replacement`` is written as the line
+         ending of the replaced line.
+
+    .. note::
+         Compressed files are supported like in ``insert_string_at_line``.
+    """
+    if max_occurrencies < 0 or max_occurrencies > sys.maxsize:
+        raise ValueError
+
+    if max_occurrencies == 0:
+        max_occurrencies = sys.maxsize
+    if loose_matching:
+        pattern = pattern.strip()
+
+    substitutions: int = 0
+    with _open_detected(input_file, newline=str()) as (f, compression):
+        with _atomic_text_file(output_file, str(), compression) as out:
+            for line, matched in _iter_substitute_lines(
+                    iter(f.readline, str()), pattern, replacement,
+                    max_occurrencies, loose_matching):
+                substitutions += matched
+                out.write(line)
+
+    return substitutions
+
+
+def substitute_lines_in_files(input_files: Iterable[str],
+                              pattern: str,
+                              replacement: str,
+                              max_occurrencies: int = 0,
+                              loose_matching: bool = True,
+                              max_workers: int = 4) -> dict[str, int]:
+    r"""Replace the lines matching a pattern in many files, in parallel.
+
+    :parameter input_files: the files that need to be edited.
+    :parameter pattern: the pattern that needs to be searched.
+    :parameter replacement: the new content of the matching lines.
+    :parameter max_occurrencies: the maximum number of lines to replace
+         in each file. Defaults to ``0`` which means all.
+    :parameter loose_matching: ignore leading and trailing whitespace
+         characters. Defaults to ``True``.
+    :parameter max_workers: the maximum number of files edited at the same
+         time. Defaults to ``4``.
+    :type input_files: Iterable[str]
+    :type pattern: str
+    :type replacement: str
+    :type max_occurrencies: int
+    :type loose_matching: bool
+    :type max_workers: int
+    :returns: the number of replaced lines of each file.
+    :rtype: dict[str, int]
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Each file is rewritten in place by ``substitute_lines``. If some
+         files cannot be edited, the others are edited anyway and the
+         first error, in input order, is raised at the end.
+    """
+    import concurrent.futures
+
+    if max_workers < 1 or max_occurrencies < 0 or max_occurrencies > sys.maxsize:
+        raise ValueError
+
+    substitutions: dict[str, int] = dict()
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='fpyutils-substitute') as executor:
+        futures: dict = {
+            f: executor.submit(substitute_lines, f, pattern, replacement, f,
+                               max_occurrencies, loose_matching)
+            # The same file edited twice at once would lose edits.
+            for f in dict.fromkeys(input_files)
+        }
+    for f, future in futures.items():
+        substitutions[f] = future.result()
+
+    return substitutions
+
+
+def _sorted_lines(text: str, unique: bool, reverse: bool) -> list[str]:
+    r"""Split text in lines, without newline, and sort them."""
+    lines: list[str] = text.split('\n')
+    # The text ends with a newline, or with the last line of the file.
+    if lines[-1] == str():
+        lines.pop()
+    if unique:
+        lines = list(set(lines))
+    lines.sort(reverse=reverse)
+
+    return lines
+
+
+def _write_lines(f, lines: Iterable[str]) -> int:
+    r"""Write lines, adding a newline to each one, and return their number."""
+    lines = iter(lines)
+    written: int = 0
+    batch: list[str] = list(itertools.islice(lines, 4096))
+    while batch != list():
+        batch.append(str())
+        f.write('\n'.join(batch))
+        written += len(batch) - 1
+        batch = list(itertools.islice(lines, 4096))
+
+    return written
+
+
+def _write_run(lines: Iterable[str], directory: str) -> str:
+    r"""Write sorted lines to a new file in directory and return its path."""
+    import tempfile
+
+    fd, run = tempfile.mkstemp(suffix='.run', dir=directory)
+    with open(fd, 'w', encoding='UTF-8', newline='\n') as f:
+        _write_lines(f, lines)
+
+    return run
+
+
+def _merge_runs(stack: contextlib.ExitStack, runs: list[str], unique: bool,
+                reverse: bool) -> Iterator[str]:
+    r"""Merge the lines of sorted run files, without newline.
+
+    The run files are closed by the stack.
+    """
+    files: list = [
+        stack.enter_context(open(r, encoding='UTF-8', newline='\n'))
+        for r in runs
+    ]
+    merged: Iterator[str] = heapq.merge(
+        *[map(operator.itemgetter(slice(0, -1)), f) for f in files],
+        reverse=reverse)
+    if unique:
+        merged = map(operator.itemgetter(0), itertools.groupby(merged))
+
+    return merged
+
+
+def _sort_run(text: str, unique: bool, reverse: bool, directory: str) -> str:
+    r"""Sort a chunk of lines in a worker and write it as a run file."""
+    return _write_run(_sorted_lines(text, unique, reverse), directory)
+
+
+def _merge_run_files(runs: list[str], unique: bool, reverse: bool,
+                     directory: str) -> str:
+    r"""Merge run files in a worker into a new one and remove them."""
+    run: str
+    with contextlib.ExitStack() as stack:
+        run = _write_run(_merge_runs(stack, runs, unique, reverse), directory)
+    for r in runs:
+        os.remove(r)
+
+    return run
+
+
+def sort_lines(input_file: str,
+               output_file: str,
+               unique: bool = False,
+               reverse: bool = False,
+               memory_limit: int = 64 * 1024 * 1024,
+               temporary_directory: str = None,
+               max_workers: int = None,
+               newline_character: str = os.linesep) -> int:
+    r"""Sort the lines of a file, even larger than the available memory.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter output_file: the file that needs to be written with the
+         sorted lines. It can be input_file.
+    :parameter unique: write only one copy of equal lines, like
+         ``sort -u``. Defaults to ``False``.
+    :parameter reverse: sort in descending order. Defaults to ``False``.
+    :parameter memory_limit: the approximate number of bytes the lines can
+         take in memory, across all processes. Defaults to 64 MiB.
+    :parameter temporary_directory: where the sorted runs and the new
+         output_file are written before the final rename. Defaults to
+         ``None`` which means the system temporary directory.
+    :parameter max_workers: the maximum number of processes sorting runs
+         at the same time. Defaults to ``None`` which means the number
+         of CPUs.
+    :parameter newline_character: the newline used to write output_file.
+         Defaults to the default platform newline, i.e: ``os.linesep``.
+    :type input_file: str
+    :type output_file: str
+    :type unique: bool
+    :type reverse: bool
+    :type memory_limit: int
+    :type temporary_directory: str
+    :type max_workers: int
+    :type newline_character: str
+    :returns: the number of lines written.
+    :rtype: int
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Lines are compared as strings, i.e. by Unicode code point, like
+         ``LC_ALL=C sort`` on UTF-8 files. Line endings are ignored and
+         a last line without newline gets one.
+
+    .. note::
+         A file up to about half of memory_limit is sorted in this
+         process. Otherwise its first half of memory_limit is sorted in
+         this process as well, and the rest is split in smaller runs which
+         are sorted in parallel by a process pool. Runs are written to
+         temporary_directory, then merged into output_file, which is
+         replaced atomically. Runs are merged ``SORT_MERGE_FAN_IN`` at a
+         time: very large files need several passes, also done in
+         parallel. temporary_directory needs about twice the size of the
+         file.
+
+    .. note::
+         Compressed files are supported like in ``insert_string_at_line``.
+    """
+    import concurrent.futures
+    import tempfile
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if memory_limit < 1 or max_workers < 1:
+        raise ValueError
+
+    # Sorting takes about twice the size of the text as string objects.
+    # Every other run exists once in this process and once in a worker.
+    head_size: int = max(memory_limit // 2, 1)
+    chunk_size: int = max(memory_limit // (4 * max_workers), 1)
+    lines_written: int = 0
+    with contextlib.ExitStack() as stack:
+        f, compression = stack.enter_context(_open_detected(input_file))
+        # Chunks end at the end of a line.
+        text: str = f.read(head_size) + f.readline()
+        chunks: Iterator[str] = iter(lambda: f.read(chunk_size) + f.readline(),
+                                     str())
+        following: str = next(chunks, str())
+        merged: Iterable[str]
+        if following == str():
+            # Everything fits in a single run.
+            merged = _sorted_lines(text, unique, reverse)
+        else:
+            directory: str = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix='fpyutils-sort-',
+                                            dir=temporary_directory))
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=max_workers))
+            # The first run is sorted in this process.
+            runs: list[str] = [_sort_run(text, unique, reverse, directory)]
+            text = str()
+            pending: list = list()
+            for text in itertools.chain((following, ), chunks):
+                if len(pending) >= max_workers:
+                    # Bound the number of runs in memory.
+                    runs.append(pending.pop(0).result())
+                pending.append(
+                    executor.submit(_sort_run, text, unique, reverse,
+                                    directory))
+            text = following = str()
+            runs.extend(p.result() for p in pending)
+
+            while len(runs) > SORT_MERGE_FAN_IN:
+                groups: list[list[str]] = [
+                    runs[i:i + SORT_MERGE_FAN_IN]
+                    for i in range(0, len(runs), SORT_MERGE_FAN_IN)
+                ]
+                runs = list(
+                    executor.map(_merge_run_files, groups,
+                                 itertools.repeat(unique),
+                                 itertools.repeat(reverse),
+                                 itertools.repeat(directory)))
+            merged = _merge_runs(stack, runs, unique, reverse)
+
+        with _atomic_text_file(output_file, newline_character, compression,
+                               temporary_directory) as out:
+            lines_written = _write_lines(out, merged)
+
+    return lines_written
+
+
+def _inotify_watch(directory: str) -> int:
+    r"""Watch the entries of a directory with inotify.
+
+    Return the inotify file descriptor, or ``-1`` if inotify is not
+    available.
+    """
+    import ctypes
+
+    fd: int = -1
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd >= 0 and libc.inotify_add_watch(fd, os.fsencode(directory),
+                                              INOTIFY_EVENTS) < 0:
+            os.close(fd)
+            fd = -1
+    except (AttributeError, OSError):
+        fd = -1
+
+    return fd
+
+
+def _syncfs(fd: int) -> bool:
+    r"""Flush the whole filesystem containing an open file to disk.
+
+    Return ``False`` if syncfs is not available.
+    """
+    import ctypes
+
+    synced: bool = False
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.syncfs(fd) < 0:
+            errno: int = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        synced = True
+    except AttributeError:
+        synced = False
+
+    return synced
+
+
+def _sync_paths(paths: Iterable[str]) -> int:
+    r"""Flush files and directories to disk and return the number of syncs.
+
+    Paths on the same filesystem are flushed with a single syncfs call if
+    possible, otherwise each one is synced with fsync.
+    """
+    devices: dict[int, list[str]] = dict()
+    for p in paths:
+        devices.setdefault(os.stat(p).st_dev, list()).append(p)
+
+    syncs: int = 0
+    for group in devices.values():
+        i: int = 0
+        synced: bool = False
+        while not synced and i < len(group):
+            fd: int = os.open(group[i], os.O_RDONLY)
+            try:
+                synced = i == 0 and _syncfs(fd)
+                if not synced:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            syncs += 1
+            i += 1
+
+    return syncs
+
+
+class LineMatchFollower:
+    r"""Match the lines appended to a growing file.
+
+    :parameter input_file: the file that needs to be read.
+    :parameter pattern: the pattern that needs to be searched.
+    :parameter loose_matching: ignore leading and trailing whitespace
+         characters for both pattern and matched strings. Defaults to ``True``.
+    :parameter use_inotify: wait for changes with inotify, where available,
+         instead of polling. Defaults to ``True``.
+    :parameter poll_interval: the seconds between two checks of the file
+         when polling. Defaults to ``1.0``.
+    :type input_file: str
+    :type pattern: str
+    :type loose_matching: bool
+    :type use_inotify: bool
+    :type poll_interval: float
+    :raises: a built-in exception.
+
+    .. note::
+         Each ``check`` reads only the data appended since the previous one.
+         If the file is replaced, for example by log rotation, or truncated,
+         the scan restarts from the beginning of the new content:
+         line numbers and occurrencies are counted from ``1`` again.
+
+    .. note::
+         A last line without newline is matched once it is complete.
+         Objects of this class are not thread safe.
+    """
+
+    def __init__(self,
+                 input_file: str,
+                 pattern: str,
+                 loose_matching: bool = True,
+                 use_inotify: bool = True,
+                 poll_interval: float = 1.0):
+        r"""Start from the beginning of the file."""
+        import locale
+
+        if poll_interval <= 0:
+            raise ValueError
+
+        self.input_file: str = input_file
+        self.loose_matching: bool = loose_matching
+        self.poll_interval: float = poll_interval
+        self._pattern: str = pattern.strip() if loose_matching else pattern
+        self._encoding: str = locale.getpreferredencoding(False)
+        self._fd: int = -1
+        self._identity: tuple[int, int] = (0, 0)
+        self._signature: tuple[int, int, int, int] = (0, 0, 0, 0)
+        self._offset: int = 0
+        self._pending: bytes = b''
+        self._lines: int = 0
+        self._occurrencies: int = 0
+        self._resets: int = 0
+
+        self._inotify: int = -1
+        if use_inotify:
+            self._inotify = _inotify_watch(
+                os.path.dirname(os.path.abspath(input_file)))
+
+    @property
+    def lines(self) -> int:
+        r"""The number of complete lines read so far."""
+        return self._lines
+
+    @property
+    def offset(self) -> int:
+        r"""The number of bytes read so far."""
+        return self._offset
+
+    @property
+    def resets(self) -> int:
+        r"""The number of times the file was replaced or truncated."""
+        return self._resets
+
+    @property
+    def uses_inotify(self) -> bool:
+        r"""Whether changes are detected with inotify."""
+        return self._inotify >= 0
+
+    def _stat(self) -> os.stat_result:
+        r"""Return the status of the file, or ``None`` if it is missing."""
+        st: os.stat_result = None
+        try:
+            st = os.stat(self.input_file)
+        except FileNotFoundError:
+            st = None
+
+        return st
+
+    def _reset(self, st: os.stat_result):
+        r"""Start again from the beginning of a new or truncated file."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._resets += 1
+        self._fd = os.open(self.input_file, os.O_RDONLY)
+        self._identity = (st.st_dev, st.st_ino)
+        self._offset = 0
+        self._pending = b''
+        self._lines = 0
+        self._occurrencies = 0
+
+    def _match(self, data: bytes, matches: dict[int, int]):
+        r"""Match complete lines, like ``get_line_matches`` does."""
+        last: int = 0
+        with io.TextIOWrapper(io.BytesIO(data), encoding=self._encoding) as f:
+            for line_counter, _, matched in _iter_line_matches(
+                    iter(f.readline, str()), self._pattern, sys.maxsize,
+                    self.loose_matching, True):
+                if matched:
+                    self._occurrencies += 1
+                    matches[self._occurrencies] = self._lines + line_counter
+                last = line_counter
+        self._lines += last
+
+    def _read(self, size: int) -> bytes:
+        r"""Read the next block, up to size."""
+        return os.pread(self._fd, min(BLOCK_SIZE, size - self._offset),
+                        self._offset) if size > self._offset else b''
+
+    def check(self) -> dict[int, int]:
+        r"""Match the lines appended since the previous check.
+
+        :returns: the new occurrencies, a dictionary where each key
+             corresponds to the number of occurrencies and each value to
+             the matched line number, like in ``get_line_matches``.
+        :rtype: dict[int, int]
+        :raises: a built-in exception.
+        """
+        matches: dict[int, int] = dict()
+        st: os.stat_result = self._stat()
+        if st is not None:
+            if (self._fd < 0 or (st.st_dev, st.st_ino) != self._identity
+                    or st.st_size < self._offset):
+                self._reset(st)
+
+            size: int = os.fstat(self._fd).st_size
+            block: bytes = self._read(size)
+            while block:
+                self._offset += len(block)
+                data: bytes = self._pending + block
+                end: int = data.rfind(b'\n') + 1
+                if end > 0:
+                    self._match(data[:end], matches)
+                self._pending = data[end:]
+                block = self._read(size)
+            self._signature = (st.st_dev, st.st_ino, size, st.st_mtime_ns)
+
+        return matches
+
+    def _changed(self) -> bool:
+        r"""Tell if the file differs from the last check."""
+        st: os.stat_result = self._stat()
+        signature: tuple[int, int, int, int] = (0, 0, 0, 0)
+        if st is not None:
+            signature = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+        return signature != self._signature
+
+    def _read_inotify_events(self) -> bool:
+        r"""Consume the pending events and tell if any is about the file."""
+        name: bytes = os.fsencode(os.path.basename(self.input_file))
+        found: bool = False
+        try:
+            buffer: bytes = os.read(self._inotify, 65536)
+        except BlockingIOError:
+            buffer = b''
+        position: int = 0
+        while position < len(buffer):
+            _, _, _, length = struct.unpack_from('iIII', buffer, position)
+            position += 16
+            if buffer[position:position + length].rstrip(b'\0') == name:
+                found = True
+            position += length
+
+        return found
+
+    def wait(self, timeout: float = None) -> bool:
+        r"""Wait until the file changes.
+
+        :parameter timeout: the maximum number of seconds to wait.
+             Defaults to ``None`` which means no limit.
+        :type timeout: float
+        :returns: ``True`` if the file changed since the last check,
+             ``False`` on timeout.
+        :rtype: bool
+        :raises: a built-in exception.
+        """
+        deadline: float = time.monotonic() + (timeout or 0)
+        changed: bool = self._changed()
+        go: bool = not changed
+        while go:
+            remaining: float = None
+            if timeout is not None:
+                remaining = max(0, deadline - time.monotonic())
+            if self._inotify >= 0:
+                ready: list = select.select([self._inotify], list(), list(),
+                                            remaining)[0]
+                if ready and self._read_inotify_events():
+                    changed = self._changed()
             else:
-                line_to_write.append(line)
-            line_counter += 1
-            line = f.readline()
+                time.sleep(self.poll_interval if remaining is None else min(
+                    self.poll_interval, remaining))
+                changed = self._changed()
+            go = not changed and (timeout is None
+                                  or time.monotonic() < deadline)
 
-    # Invalid line range.
-    if delete_line_from > line_counter or delete_line_to > line_counter:
-        raise LineOutOfFileBoundsError
+        return changed
 
-    # Atomic write.
-    # See
-    # https://stupidpythonideas.blogspot.com/2014/07/getting-atomic-writes-right.html
-    # https://docs.python.org/3/library/os.html#os.fsync
-    with tempfile.NamedTemporaryFile('w', delete=False) as f:
-        f.flush()
-        os.fsync(f.fileno())
-        f.write(''.join(line_to_write))
-    shutil.move(f.name, output_file)
+    def close(self):
+        r"""Release the file descriptors."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        if self._inotify >= 0:
+            os.close(self._inotify)
+            self._inotify = -1
+
+    def __enter__(self):
+        r"""Use as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Close on exit."""
+        self.close()
+
+
+class LineMatchCache:
+    r"""Memoize the results of ``get_line_matches``.
+
+    :parameter max_entries: the maximum number of results kept in memory.
+         Defaults to ``128``.
+    :parameter max_bytes: the maximum approximate size of the results kept
+         in memory. Defaults to ``64 MiB``.
+    :parameter directory: a directory where results are also stored, so
+         that they can be shared between processes. Defaults to ``None``
+         which means memory only.
+    :parameter max_disk_bytes: the maximum size of the results stored in
+         directory. Defaults to ``256 MiB``.
+    :type max_entries: int
+    :type max_bytes: int
+    :type directory: str
+    :type max_disk_bytes: int
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Results are identified by the device and inode of the file, and
+         are valid as long as its size and modification time do not
+         change: a lookup costs a single ``stat`` call. Files modified less
+         than ``RACY_INTERVAL`` seconds before being read are not cached
+         because a later change might leave the modification time
+         unchanged.
+
+    .. note::
+         The least recently used results are evicted first. Files in the
+         directory are replaced atomically. Their modification time is
+         updated when they are read, and the least recently used ones are
+         removed when their size exceeds max_disk_bytes.
+    """
+
+    # Seconds. Covers the modification time granularity of most file
+    # systems.
+    RACY_INTERVAL: float = 2.0
+
+    def __init__(self,
+                 max_entries: int = 128,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 directory: str = None,
+                 max_disk_bytes: int = 256 * 1024 * 1024):
+        r"""Create an empty cache."""
+        if max_entries < 1 or max_bytes < 1 or max_disk_bytes < 1:
+            raise ValueError
+
+        self.max_entries: int = max_entries
+        self.max_bytes: int = max_bytes
+        self.directory: str = directory
+        self.max_disk_bytes: int = max_disk_bytes
+        self._entries = collections.OrderedDict()
+        self._bytes: int = 0
+        self._lock = threading.Lock()
+        self._statistics: dict[str, int] = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+        }
+
+    @staticmethod
+    def _signature(st: os.stat_result) -> tuple[int, int]:
+        r"""Return the file status fields a result depends on."""
+        return (st.st_size, st.st_mtime_ns)
+
+    @staticmethod
+    def _size(value: tuple[dict[int, int], str]) -> int:
+        r"""Approximate the memory used by a result."""
+        return sys.getsizeof(value[0]) + sys.getsizeof(value[1])
+
+    def _disk_path(self, key: tuple) -> str:
+        r"""Return the file storing a result in the directory."""
+        import json
+
+        return os.path.join(
+            self.directory,
+            hashlib.sha256(json.dumps(key).encode('UTF-8')).hexdigest() +
+            '.json')
+
+    def _load(self, key: tuple,
+              signature: tuple[int, int]) -> tuple[dict[int, int], str]:
+        r"""Read a result from the directory, or return ``None``."""
+        import json
+
+        value: tuple[dict[int, int], str] = None
+        try:
+            with open(self._disk_path(key), 'r', encoding='UTF-8') as f:
+                data: dict = json.load(f)
+                if (data['key'] == list(key)
+                        and tuple(data['signature']) == signature):
+                    value = ({int(k): v
+                              for k, v in data['matches']}, data['lines'])
+                    # Least recently used results are evicted first.
+                    os.utime(f.fileno())
+        except (OSError, ValueError, KeyError):
+            value = None
+
+        return value
+
+    def _store(self, key: tuple, signature: tuple[int, int],
+               value: tuple[dict[int, int], str]):
+        r"""Write a result to the directory atomically."""
+        import json
+        import tempfile
+
+        fd, name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='UTF-8') as f:
+                json.dump(
+                    {
+                        'key': list(key),
+                        'signature': list(signature),
+                        'matches': list(value[0].items()),
+                        'lines': value[1],
+                    }, f)
+            os.replace(name, self._disk_path(key))
+        except BaseException:
+            os.remove(name)
+            raise
+
+    def _evict(self):
+        r"""Remove the least recently used results above max_disk_bytes."""
+        entries: list[tuple[int, int, str]] = list()
+        total: int = 0
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.json'):
+                    with contextlib.suppress(FileNotFoundError):
+                        st: os.stat_result = e.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, e.path))
+                        total += st.st_size
+        entries.sort()
+        i: int = 0
+        while total > self.max_disk_bytes and i < len(entries):
+            # Another process may have removed it.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entries[i][2])
+            total -= entries[i][1]
+            i += 1
+
+    def _remember(self, key: tuple, signature: tuple[int, int],
+                  value: tuple[dict[int, int], str]):
+        r"""Add a result to memory, evicting the oldest ones."""
+        size: int = self._size(value)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[2]
+            if size <= self.max_bytes:
+                self._entries[key] = (signature, value, size)
+                self._bytes += size
+                while (len(self._entries) > self.max_entries
+                       or self._bytes > self.max_bytes):
+                    self._bytes -= self._entries.popitem(last=False)[1][2]
+
+    def get_line_matches(
+            self,
+            input_file: str,
+            pattern: str,
+            max_occurrencies: int = 0,
+            loose_matching: bool = True,
+            keep_all_lines: bool = False) -> tuple[dict[int, int], str]:
+        r"""Call the ``get_line_matches`` function, with memoization.
+
+        :raises: a built-in exception.
+        """
+        st: os.stat_result = os.stat(input_file)
+        key: tuple = (st.st_dev, st.st_ino, pattern, max_occurrencies,
+                      loose_matching, keep_all_lines)
+        signature: tuple[int, int] = self._signature(st)
+
+        value: tuple[dict[int, int], str] = None
+        with self._lock:
+            entry: tuple = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(key)
+                self._statistics['hits'] += 1
+                value = entry[1]
+
+        if value is None and self.directory is not None:
+            value = self._load(key, signature)
+            if value is not None:
+                with self._lock:
+                    self._statistics['disk_hits'] += 1
+                self._remember(key, signature, value)
+
+        if value is None:
+            with self._lock:
+                self._statistics['misses'] += 1
+            value = get_line_matches(input_file, pattern, max_occurrencies,
+                                     loose_matching, keep_all_lines)
+
+            # Cache only if the file did not change while being read and
+            # it is old enough.
+            st = os.stat(input_file)
+            age: float = (time.time_ns() - st.st_mtime_ns) / 1e9
+            if (self._signature(st) == signature
+                    and age >= self.RACY_INTERVAL):
+                self._remember(key, signature, value)
+                if self.directory is not None:
+                    self._store(key, signature, value)
+                    self._evict()
+
+        # The caller may change the dictionary.
+        return dict(value[0]), value[1]
+
+    def clear(self):
+        r"""Remove all the results kept in memory."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def statistics(self) -> dict[str, int]:
+        r"""Return the counters of the cache.
+
+        :returns: the number of ``hits``, ``disk_hits`` and ``misses``, the
+             number of ``entries`` in memory and their approximate ``bytes``.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            statistics: dict[str, int] = dict(self._statistics)
+            statistics['entries'] = len(self._entries)
+            statistics['bytes'] = self._bytes
+
+        return statistics
+
+
+class FileEditCoordinator:
+    r"""Serialize and merge concurrent line edits of the same files.
+
+    :parameter max_workers: the maximum number of files edited at the same
+         time. Defaults to ``4``.
+    :parameter newline_character: the newline used to write the files,
+         like in ``insert_string_at_line``. Defaults to the default platform
+         newline, i.e: ``os.linesep``.
+    :parameter lock_directory: where the lock files are kept. Defaults to
+         ``None`` which means next to the edited files.
+    :type max_workers: int
+    :type newline_character: str
+    :type lock_directory: str
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Edits of a file are applied in submission order, each one on the
+         result of the previous ones. All the edits waiting for a file are
+         applied in a single read and a single atomic rewrite, while an
+         exclusive ``fcntl`` lock on a lock file is held: other processes
+         using this class with the same lock_directory never overwrite each
+         other's edits. An edit that fails does not prevent the others from
+         being applied.
+
+    .. note::
+         The lock file of a file is its name plus ``LOCK_SUFFIX``, or, in
+         lock_directory, the SHA-256 of its real path plus
+         ``LOCK_SUFFIX``. Lock files are never removed: removing one
+         while another process waits for it would let two processes edit
+         the file at the same time.
+
+    .. note::
+         Available on POSIX systems only.
+    """
+
+    def __init__(self,
+                 max_workers: int = 4,
+                 newline_character: str = os.linesep,
+                 lock_directory: str = None):
+        r"""Start without pending edits."""
+        import concurrent.futures
+
+        if max_workers < 1:
+            raise ValueError
+
+        self.newline_character: str = newline_character
+        self.lock_directory: str = lock_directory
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='fpyutils-edit')
+        self._lock = threading.Lock()
+        self._pending: dict[str, list] = dict()
+        self._closed: bool = False
+        self._statistics: dict[str, int] = {
+            'edits': 0,
+            'rewrites': 0,
+        }
+
+    def _submit(self, input_file: str, edit):
+        r"""Queue an edit, a function from lines to lines."""
+        import concurrent.futures
+
+        future = concurrent.futures.Future()
+        path: str = os.path.realpath(input_file)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError
+            schedule: bool = path not in self._pending
+            self._pending.setdefault(path, list()).append((edit, future))
+        if schedule:
+            self._executor.submit(self._drain, path)
+
+        return future
+
+    def _drain(self, path: str):
+        r"""Apply the queued edits of a file until there are none left."""
+        go: bool = True
+        while go:
+            with self._lock:
+                batch: list = self._pending[path]
+                self._pending[path] = list()
+            self._apply(path, batch)
+            with self._lock:
+                if self._pending[path] == list():
+                    del self._pending[path]
+                    go = False
+
+    def _lock_file(self, path: str) -> str:
+        r"""Return the path of the lock file of a file."""
+        lock_file: str = path + LOCK_SUFFIX
+        if self.lock_directory is not None:
+            lock_file = os.path.join(
+                self.lock_directory,
+                hashlib.sha256(os.fsencode(path)).hexdigest() + LOCK_SUFFIX)
+
+        return lock_file
+
+    def _apply(self, path: str, batch: list):
+        r"""Apply a batch of edits with a single rewrite."""
+        import fcntl
+
+        # Cancelled edits are skipped.
+        batch = [(edit, future) for edit, future in batch
+                 if future.set_running_or_notify_cancel()]
+        outcomes: list = list()
+        rewritten: bool = False
+        try:
+            with open(self._lock_file(path), 'a') as lock:
+                # Released when the file is closed.
+                fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+                with _open_detected(path) as (f, compression):
+                    lines: list[str] = list(iter(f.readline, str()))
+                changed: bool = False
+                for edit, future in batch:
+                    try:
+                        lines = list(edit(lines))
+                        changed = True
+                        outcomes.append((future, None))
+                    except Exception as e:
+                        outcomes.append((future, e))
+                if changed:
+                    _write_atomically(path, ''.join(lines),
+                                      self.newline_character, compression)
+                    rewritten = True
+        except BaseException as e:
+            # Nothing was written.
+            outcomes = [(future, e) for _, future in batch]
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            with self._lock:
+                self._statistics['edits'] += len(outcomes)
+                self._statistics['rewrites'] += int(rewritten)
+            for future, exception in outcomes:
+                if exception is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exception)
+
+    def insert_string_at_line(self,
+                              input_file: str,
+                              string_to_be_inserted: str,
+                              put_at_line_number: int,
+                              append: bool = True):
+        r"""Queue the insertion of a string, see ``insert_string_at_line``.
+
+        :returns: a future which resolves to ``None`` once the file is
+             written.
+        :rtype: concurrent.futures.Future
+        :raises: RuntimeError if the coordinator is closed, or a built-in
+             exception.
+        """
+        if put_at_line_number < 1:
+            raise ValueError
+
+        return self._submit(
+            input_file, lambda lines: _iter_insert_string_at_line(
+                lines, string_to_be_inserted, put_at_line_number, append, self.
+                newline_character))
+
+    def remove_line_interval(self, input_file: str, delete_line_from: int,
+                             delete_line_to: int):
+        r"""Queue the removal of a line interval, see ``remove_line_interval``.
+
+        :returns: a future which resolves to ``None`` once the file is
+             written.
+        :rtype: concurrent.futures.Future
+        :raises: NegativeLineRangeError, RuntimeError if the coordinator is
+             closed, or a built-in exception.
+        """
+        if delete_line_from < 1 or delete_line_to < 1:
+            raise ValueError
+        if delete_line_to - delete_line_from < 0:
+            raise NegativeLineRangeError
+
+        return self._submit(
+            input_file, lambda lines: _iter_remove_line_interval(
+                lines, delete_line_from, delete_line_to))
+
+    def statistics(self) -> dict[str, int]:
+        r"""Return the number of processed ``edits`` and of ``rewrites``.
+
+        Only the batches that replaced a file count as ``rewrites``.
+
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            return dict(self._statistics)
+
+    def close(self, wait: bool = True):
+        r"""Refuse new edits and optionally wait for the queued ones.
+
+        :parameter wait: wait for the queued edits. Defaults to ``True``.
+        :type wait: bool
+        """
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        r"""Use as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Wait for the queued edits and close on exit."""
+        self.close()
+
+
+class FileTransaction:
+    r"""Edit many files and replace them all, or none, at once.
+
+    :parameter newline_character: the newline used to write the files,
+         like in ``insert_string_at_line``. Defaults to the default platform
+         newline, i.e: ``os.linesep``.
+    :type newline_character: str
+
+    .. note::
+         Edits are applied in the order they are made, each one on the
+         result of the previous ones, and written to a copy of the file in
+         its directory, with ``TRANSACTION_SUFFIX``. The files change only
+         when the transaction is committed: the copies are flushed to disk
+         with one ``syncfs`` call for each filesystem, then renamed over the
+         files, then the directories are flushed the same way. Without
+         ``syncfs`` each copy and each directory is synced with ``fsync``.
+
+    .. note::
+         If a rename fails, the files already replaced are restored from
+         hard links to their old content, made before the first rename.
+         If the process dies during a commit, some files may be replaced
+         and the old content of the others is left in files ending with
+         ``TRANSACTION_SUFFIX``.
+
+    .. note::
+         When used as a context manager, the transaction is committed
+         if the block succeeds and rolled back otherwise.
+
+    .. note::
+         Available on POSIX systems only. Files are written in text mode,
+         with their compression format, like in ``insert_string_at_line``,
+         and keep their permissions.
+    """
+
+    def __init__(self, newline_character: str = os.linesep):
+        r"""Start without edits."""
+        self.newline_character: str = newline_character
+        # Edited file: staged copy.
+        self._staged: dict[str, str] = dict()
+        self._closed: bool = False
+        self._statistics: dict[str, int] = {
+            'edits': 0,
+            'files': 0,
+            'syncs': 0,
+        }
+
+    @property
+    def files(self) -> list[str]:
+        r"""The absolute paths of the edited files."""
+        return list(self._staged)
+
+    def _stage(self, input_file: str, edit):
+        r"""Apply an edit, a function from lines to lines, to a new copy."""
+        import tempfile
+
+        if self._closed:
+            raise RuntimeError
+
+        path: str = os.path.abspath(input_file)
+        source: str = self._staged.get(path, path)
+        mode: int = stat.S_IMODE(os.stat(path).st_mode)
+        fd, staged = tempfile.mkstemp(prefix='.' + os.path.basename(path) +
+                                      '.',
+                                      suffix=TRANSACTION_SUFFIX,
+                                      dir=os.path.dirname(path))
+        try:
+            with open(fd, 'wb') as raw:
+                with _open_detected(source) as (f, compression):
+                    with _text_stream(raw, 'w', compression,
+                                      self.newline_character) as out:
+                        out.writelines(edit(iter(f.readline, str())))
+            os.chmod(staged, mode)
+        except BaseException:
+            os.remove(staged)
+            raise
+
+        if source != path:
+            os.remove(source)
+        self._staged[path] = staged
+        self._statistics['edits'] += 1
+
+    def insert_string_at_line(self,
+                              input_file: str,
+                              string_to_be_inserted: str,
+                              put_at_line_number: int,
+                              append: bool = True):
+        r"""Stage the insertion of a string, see ``insert_string_at_line``.
+
+        :raises: RuntimeError if the transaction is over, or a built-in
+             exception.
+        """
+        if put_at_line_number < 1:
+            raise ValueError
+
+        self._stage(
+            input_file, lambda lines: _iter_insert_string_at_line(
+                lines, string_to_be_inserted, put_at_line_number, append, self.
+                newline_character))
+
+    def remove_line_interval(self, input_file: str, delete_line_from: int,
+                             delete_line_to: int):
+        r"""Stage the removal of a line interval, see ``remove_line_interval``.
+
+        :raises: NegativeLineRangeError, LineOutOfFileBoundsError,
+             RuntimeError if the transaction is over, or a built-in
+             exception.
+
+        .. note::
+             A failed edit is not staged, the previous edits of the file are
+             kept.
+        """
+        if delete_line_from < 1 or delete_line_to < 1:
+            raise ValueError
+        if delete_line_to - delete_line_from < 0:
+            raise NegativeLineRangeError
+
+        self._stage(
+            input_file, lambda lines: _iter_remove_line_interval(
+                lines, delete_line_from, delete_line_to))
+
+    def commit(self):
+        r"""Replace all the edited files.
+
+        :raises: RuntimeError if the transaction is over, or a built-in
+             exception, in which case no file is changed unless the
+             exception comes from syncing the directories.
+        """
+        if self._closed:
+            raise RuntimeError
+        self._closed = True
+
+        backups: dict[str, str] = dict()
+        replaced: list[str] = list()
+        try:
+            self._statistics['syncs'] += _sync_paths(self._staged.values())
+            for path, staged in self._staged.items():
+                backups[path] = staged[:-len(TRANSACTION_SUFFIX)] + '.old' + (
+                    TRANSACTION_SUFFIX)
+                os.link(path, backups[path])
+            for path, staged in self._staged.items():
+                os.replace(staged, path)
+                replaced.append(path)
+        except BaseException:
+            for path in replaced:
+                os.replace(backups[path], path)
+            self._remove(backups.values())
+            self._remove(self._staged.values())
+            raise
+
+        # All the files are replaced: only the backups are left to remove.
+        self._statistics['files'] = len(replaced)
+        try:
+            self._statistics['syncs'] += _sync_paths(
+                dict.fromkeys(os.path.dirname(p) for p in replaced))
+        finally:
+            self._remove(backups.values())
+
+    def rollback(self):
+        r"""Discard all the edits.
+
+        :raises: a built-in exception.
+        """
+        if not self._closed:
+            self._closed = True
+            self._remove(self._staged.values())
+
+    @staticmethod
+    def _remove(paths: Iterable[str]):
+        r"""Remove files, ignoring the missing ones."""
+        for p in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(p)
+
+    def statistics(self) -> dict[str, int]:
+        r"""Return the number of ``edits``, replaced ``files`` and ``syncs``.
+
+        :rtype: dict[str, int]
+        """
+        return dict(self._statistics)
+
+    def __enter__(self):
+        r"""Use as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Commit, or roll back if the block raised an exception."""
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
 
 
 if __name__ == '__main__':
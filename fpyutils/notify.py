@@ -20,16 +20,63 @@
 # along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
 #
 """Functions on notifications."""
+from __future__ import annotations
 
-import json
-import smtplib
-import ssl
-import urllib.request
-from email.mime.text import MIMEText
-from email.utils import formatdate
+import atexit
+import io
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING
 
 from .path import add_trailing_slash
 
+# Modules such as ssl, smtplib, email, http.client and urllib.request take
+# tens of milliseconds to import: they are imported where they are needed
+# so that importing fpyutils stays cheap. The type annotations are strings
+# and need them only for type checkers.
+if TYPE_CHECKING:
+    import http.client
+    import smtplib
+    import ssl
+    from email.mime.text import MIMEText
+
+# Recipients of a single mail transaction in a fan-out. RFC 5321 requires
+# servers to accept at least 100.
+SMTP_MAX_RECIPIENTS: int = 100
+
+# A single SSL context can be shared by all the connections: creating one
+# loads the system certificate store, which is expensive.
+_ssl_context: ssl.SSLContext = None
+_ssl_context_lock = threading.Lock()
+
+
+def _get_ssl_context() -> ssl.SSLContext:
+    r"""Return the cached default SSL context, creating it on first use."""
+    global _ssl_context
+
+    with _ssl_context_lock:
+        if _ssl_context is None:
+            import ssl
+            _ssl_context = ssl.create_default_context()
+
+    return _ssl_context
+
+
+def _build_email(message: str, sender: str, receiver: str,
+                 subject: str) -> MIMEText:
+    r"""Build the MIME object of a plain text email."""
+    from email.mime.text import MIMEText
+    from email.utils import formatdate
+
+    msg = MIMEText(message)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = receiver
+    msg['Date'] = formatdate(localtime=True)
+
+    return msg
+
 
 def send_email(message: str, smtp_server: str, port: int, sender: str,
                user: str, password: str, receiver: str, subject: str) -> dict:
@@ -66,19 +113,387 @@ def send_email(message: str, smtp_server: str, port: int, sender: str,
     #
     # You should have received a copy of the license along with this
     # work. If not, see <http://creativecommons.org/licenses/by-sa/4.0/>.
-    msg = MIMEText(message)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = receiver
-    msg['Date'] = formatdate(localtime=True)
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(smtp_server, port, context=context) as conn:
+    import smtplib
+
+    msg = _build_email(message, sender, receiver, subject)
+    with smtplib.SMTP_SSL(smtp_server, port,
+                          context=_get_ssl_context()) as conn:
         conn.login(user, password)
         result = conn.sendmail(sender, receiver, msg.as_string())
 
     return result
 
 
+class SMTPMailer:
+    r"""Send emails over a small pool of authenticated SMTP connections.
+
+    Connections are opened lazily, kept open between messages and closed
+    once they stay unused for more than ``idle_timeout`` seconds. A
+    connection that fails while sending is discarded and the message is
+    retried once on a fresh connection.
+
+    :parameter smtp_server: the address of the sending server.
+    :parameter port: the port of the sending server.
+    :parameter sender: the email of the sender.
+    :parameter user: the username of the sender.
+    :parameter password: the password of the sender.
+    :parameter pool_size: the maximum number of open connections.
+         Defaults to ``2``.
+    :parameter idle_timeout: the number of seconds after which an unused
+         connection is closed. Defaults to ``60.0``.
+    :parameter use_ssl: connect with ``smtplib.SMTP_SSL`` instead of plain
+         ``smtplib.SMTP``. Defaults to ``True``.
+    :type smtp_server: str
+    :type port: int
+    :type sender: str
+    :type user: str
+    :type password: str
+    :type pool_size: int
+    :type idle_timeout: float
+    :type use_ssl: bool
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Instances can be used as context managers: all the connections
+         are closed on exit.
+    """
+
+    def __init__(self,
+                 smtp_server: str,
+                 port: int,
+                 sender: str,
+                 user: str,
+                 password: str,
+                 pool_size: int = 2,
+                 idle_timeout: float = 60.0,
+                 use_ssl: bool = True):
+        r"""Create a mailer without opening any connection."""
+        if pool_size < 1 or idle_timeout < 0:
+            raise ValueError
+
+        self.smtp_server: str = smtp_server
+        self.port: int = port
+        self.sender: str = sender
+        self.user: str = user
+        self.password: str = password
+        self.idle_timeout: float = idle_timeout
+        self.use_ssl: bool = use_ssl
+
+        # Idle connections as (connection, time of last use) pairs.
+        self._idle: list[tuple[smtplib.SMTP, float]] = list()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def __enter__(self):
+        r"""Return the mailer itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Close all the connections."""
+        self.close()
+
+    def _connect(self) -> smtplib.SMTP:
+        r"""Open and authenticate a new connection."""
+        import smtplib
+
+        conn: smtplib.SMTP
+        if self.use_ssl:
+            conn = smtplib.SMTP_SSL(self.smtp_server,
+                                    self.port,
+                                    context=_get_ssl_context())
+        else:
+            conn = smtplib.SMTP(self.smtp_server, self.port)
+        try:
+            conn.login(self.user, self.password)
+        except BaseException:
+            _close_smtp_connection(conn)
+            raise
+
+        return conn
+
+    def _acquire(self) -> smtplib.SMTP:
+        r"""Get an idle connection or open a new one."""
+        stale: list[smtplib.SMTP] = list()
+        conn: smtplib.SMTP = None
+        with self._lock:
+            now: float = time.monotonic()
+            while self._idle and conn is None:
+                candidate, last_used = self._idle.pop()
+                if now - last_used > self.idle_timeout:
+                    stale.append(candidate)
+                else:
+                    conn = candidate
+            # Idle connections are sorted by last use, so anything left
+            # before a stale one is stale as well.
+            if stale:
+                stale.extend(c for c, _ in self._idle)
+                self._idle.clear()
+
+        for s in stale:
+            _close_smtp_connection(s)
+        if conn is None:
+            conn = self._connect()
+
+        return conn
+
+    def _release(self, conn: smtplib.SMTP):
+        r"""Put a healthy connection back in the pool."""
+        with self._lock:
+            self._idle.append((conn, time.monotonic()))
+
+    def _deliver(self, conn: smtplib.SMTP, send) -> tuple[smtplib.SMTP, dict]:
+        r"""Call send on the connection, reconnecting once on connection errors.
+
+        The returned connection is the one that should be used next.
+        """
+        import smtplib
+
+        result: dict
+        try:
+            result = send(conn)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            _close_smtp_connection(conn)
+            conn = self._connect()
+            try:
+                result = send(conn)
+            except BaseException:
+                _close_smtp_connection(conn)
+                raise
+
+        return conn, result
+
+    def _send_transactions(self, transactions) -> dict:
+        r"""Send ``(receivers, message)`` pairs over a single session.
+
+        Return the refused receivers of all the transactions.
+        """
+        refused: dict = dict()
+        with self._slots:
+            conn: smtplib.SMTP = self._acquire()
+            try:
+                for receivers, msg in transactions:
+                    conn, result = self._deliver(
+                        conn, lambda c: _send_transaction(
+                            c, self.sender, receivers, msg))
+                    refused.update(result)
+            except BaseException:
+                _close_smtp_connection(conn)
+                raise
+            self._release(conn)
+
+        return refused
+
+    def send(self, message: str, receiver: str, subject: str) -> dict:
+        r"""Send an email using a pooled connection.
+
+        :parameter message: the body of the message.
+        :parameter receiver: the email of the receiver.
+        :parameter subject: the subject field of the email.
+        :type message: str
+        :type receiver: str
+        :type subject: str
+        :returns: an empty dictionary on no error, otherwise an exception is raised.
+        :rtype: dict
+        :raises: a built-in exception.
+        """
+        return self.send_many([(message, receiver, subject)])[0]
+
+    def send_many(self, messages: list[tuple[str, str, str]]) -> list[dict]:
+        r"""Send several emails over a single session.
+
+        :parameter messages: ``(message, receiver, subject)`` tuples.
+        :type messages: list[tuple[str, str, str]]
+        :returns: one ``sendmail`` result for each message, in the same order.
+        :rtype: list[dict]
+        :raises: a built-in exception.
+
+        .. note::
+             If a message cannot be sent the exception is propagated and
+             the remaining messages are not sent.
+        """
+        results: list[dict] = list()
+        with self._slots:
+            conn: smtplib.SMTP = self._acquire()
+            try:
+                for message, receiver, subject in messages:
+                    msg: str = _build_email(message, self.sender, receiver,
+                                            subject).as_string()
+                    conn, result = self._deliver(
+                        conn, lambda c: c.sendmail(self.sender, receiver, msg))
+                    results.append(result)
+            except BaseException:
+                _close_smtp_connection(conn)
+                raise
+            self._release(conn)
+
+        return results
+
+    def send_to_many(
+            self,
+            message: str,
+            receivers: list[str],
+            subject: str,
+            max_recipients: int = SMTP_MAX_RECIPIENTS) -> dict[str, tuple]:
+        r"""Send the same email to many receivers over a single session.
+
+        :parameter message: the body of the message.
+        :parameter receivers: the emails of the receivers.
+        :parameter subject: the subject field of the email.
+        :parameter max_recipients: the maximum number of receivers of each
+             mail transaction. Defaults to ``SMTP_MAX_RECIPIENTS``.
+        :type message: str
+        :type receivers: list[str]
+        :type subject: str
+        :type max_recipients: int
+        :returns: the refused receivers, like ``sendmail``: each one is
+             mapped to the SMTP code and the reply of the server. An empty
+             dictionary means that all the receivers were accepted.
+        :rtype: dict[str, tuple]
+        :raises: ValueError or a built-in exception.
+
+        .. note::
+             The message is built once, with ``undisclosed-recipients:;``
+             in the ``To`` field, and sent in one transaction for every
+             max_recipients receivers. If the server supports pipelining,
+             the sender and all the receivers of a transaction are sent
+             without waiting for each reply.
+
+        .. note::
+             A refused receiver, or a transaction rejected by the server,
+             does not stop the others: the receivers are reported in the
+             result.
+        """
+        if max_recipients < 1:
+            raise ValueError
+
+        receivers = list(receivers)
+        msg: str = _build_email(message, self.sender,
+                                'undisclosed-recipients:;',
+                                subject).as_string()
+
+        return self._send_transactions(
+            (receivers[i:i + max_recipients], msg)
+            for i in range(0, len(receivers), max_recipients))
+
+    def send_personalized(self, messages: dict[str, str],
+                          subject: str) -> dict[str, tuple]:
+        r"""Send a different email to each receiver over a single session.
+
+        :parameter messages: the body of the message of each receiver.
+        :parameter subject: the subject field of the emails.
+        :type messages: dict[str, str]
+        :type subject: str
+        :returns: the refused receivers, see ``send_to_many``.
+        :rtype: dict[str, tuple]
+        :raises: a built-in exception.
+        """
+        return self._send_transactions(
+            ([receiver],
+             _build_email(message, self.sender, receiver, subject).as_string())
+            for receiver, message in messages.items())
+
+    def close(self):
+        r"""Close all the idle connections."""
+        with self._lock:
+            idle: list[tuple[smtplib.SMTP, float]] = self._idle
+            self._idle = list()
+        for conn, _ in idle:
+            _close_smtp_connection(conn)
+
+
+def _send_transaction(conn: smtplib.SMTP, sender: str, receivers: list[str],
+                      msg: str) -> dict:
+    r"""Run a mail transaction and return the refused receivers.
+
+    Rejections are reported in the result instead of being raised. The
+    envelope is pipelined if the server supports it.
+    """
+    import smtplib
+
+    refused: dict = dict()
+    try:
+        conn.ehlo_or_helo_if_needed()
+        if conn.has_extn('pipelining'):
+            commands: list[str] = ['MAIL FROM:' + smtplib.quoteaddr(sender)]
+            commands.extend('RCPT TO:' + smtplib.quoteaddr(r)
+                            for r in receivers)
+            conn.send(''.join(c + '\r\n' for c in commands))
+            replies: list[tuple[int,
+                                bytes]] = [conn.getreply() for _ in commands]
+            refused = {
+                r: reply
+                for r, reply in zip(receivers, replies[1:])
+                if reply[0] not in (250, 251)
+            }
+            if replies[0][0] != 250:
+                conn.rset()
+                raise smtplib.SMTPSenderRefused(*replies[0], sender)
+            if len(refused) == len(receivers):
+                conn.rset()
+                raise smtplib.SMTPRecipientsRefused(refused)
+            code, reply = conn.data(msg)
+            if code != 250:
+                conn.rset()
+                raise smtplib.SMTPDataError(code, reply)
+        else:
+            refused = conn.sendmail(sender, receivers, msg)
+    except smtplib.SMTPRecipientsRefused as e:
+        refused = e.recipients
+    except smtplib.SMTPResponseException as e:
+        refused = {r: (e.smtp_code, e.smtp_error) for r in receivers}
+
+    return refused
+
+
+def send_email_to_many(message: str,
+                       smtp_server: str,
+                       port: int,
+                       sender: str,
+                       user: str,
+                       password: str,
+                       receivers: list[str],
+                       subject: str,
+                       max_recipients: int = SMTP_MAX_RECIPIENTS) -> dict:
+    r"""Send an email to many receivers with a single login.
+
+    :parameter message: the body of the message.
+    :parameter smtp_server: the address of the sending server.
+    :parameter port: the port of the sending server.
+    :parameter sender: the email of the sender.
+    :parameter user: the username of the sender.
+    :parameter password: the password of the sender.
+    :parameter receivers: the emails of the receivers.
+    :parameter subject: the subject field of the email.
+    :parameter max_recipients: the maximum number of receivers of each
+         mail transaction. Defaults to ``SMTP_MAX_RECIPIENTS``.
+    :type message: str
+    :type smtp_server: str
+    :type port: int
+    :type sender: str
+    :type user: str
+    :type password: str
+    :type receivers: list[str]
+    :type subject: str
+    :type max_recipients: int
+    :returns: the refused receivers, see ``SMTPMailer.send_to_many``.
+    :rtype: dict
+    :raises: ValueError or a built-in exception.
+    """
+    with SMTPMailer(smtp_server, port, sender, user, password,
+                    pool_size=1) as mailer:
+        return mailer.send_to_many(message, receivers, subject, max_recipients)
+
+
+def _close_smtp_connection(conn: smtplib.SMTP):
+    r"""Close a connection politely, ignoring errors of broken ones."""
+    import smtplib
+
+    try:
+        conn.quit()
+    except (smtplib.SMTPException, OSError):
+        conn.close()
+
+
 def send_gotify_message(url: str,
                         token: str,
                         message: str = 'message',
@@ -102,11 +517,30 @@ def send_gotify_message(url: str,
     :returns: a ``http.client.HTTPResponse`` object
     :raises: ValueError or a built-in exception.
     """
+    import urllib.request
+
+    req = urllib.request.Request(url=_gotify_message_url(url, token),
+                                 data=_gotify_payload(message, title,
+                                                      priority),
+                                 method='POST')
+    req.add_header('Content-type', 'application/json; charset=UTF-8')
+
+    return urllib.request.urlopen(req)
+
+
+def _gotify_message_url(url: str, token: str) -> str:
+    r"""Return the URL of the message endpoint of a Gotify server."""
     # All URLs for a gotify server must start with 'http'.
     if not url.lower().startswith('http'):
         raise ValueError
 
-    full_url: str = add_trailing_slash(url) + 'message?token=' + token
+    return add_trailing_slash(url) + 'message?token=' + token
+
+
+def _gotify_payload(message: str, title: str, priority: int) -> bytes:
+    r"""Encode the JSON body of a Gotify message."""
+    import json
+
     payload: dict = {
         'title': title,
         'message': message,
@@ -114,12 +548,697 @@ def send_gotify_message(url: str,
     }
     data: str = json.dumps(payload)
 
-    req = urllib.request.Request(url=full_url,
-                                 data=bytes(data.encode('UTF-8')),
-                                 method='POST')
-    req.add_header('Content-type', 'application/json; charset=UTF-8')
+    return bytes(data.encode('UTF-8'))
 
-    return urllib.request.urlopen(req)
+
+class GotifyClient:
+    r"""Send notifications to a Gotify server over keep-alive connections.
+
+    Up to ``pool_size`` HTTP connections to the server are opened on
+    demand and reused by the following requests. A reused connection
+    that was closed by the server in the meantime is transparently
+    replaced.
+
+    :parameter url: the URL of the Gotify server
+    :parameter token: the APP token
+    :parameter pool_size: the maximum number of open connections, which
+         is also the maximum number of concurrent requests.
+         Defaults to ``4``.
+    :parameter timeout: the timeout in seconds of each connection.
+         Defaults to ``30.0``.
+    :type url: str
+    :type token: str
+    :type pool_size: int
+    :type timeout: float
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Instances can be used as context managers: all the connections
+         are closed on exit.
+    """
+
+    def __init__(self,
+                 url: str,
+                 token: str,
+                 pool_size: int = 4,
+                 timeout: float = 30.0):
+        r"""Create a client without opening any connection."""
+        if pool_size < 1:
+            raise ValueError
+
+        self.url: str = _gotify_message_url(url, token)
+        self.pool_size: int = pool_size
+        self.timeout: float = timeout
+
+        import urllib.parse
+
+        parts = urllib.parse.urlsplit(self.url)
+        self._https: bool = parts.scheme.lower() == 'https'
+        self._host: str = parts.hostname
+        self._port: int = parts.port
+        self._path: str = parts.path + '?' + parts.query
+
+        self._idle: list[http.client.HTTPConnection] = list()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size)
+
+    def __enter__(self):
+        r"""Return the client itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Close all the connections."""
+        self.close()
+
+    def _connect(self) -> http.client.HTTPConnection:
+        r"""Create a new, not yet connected, connection object."""
+        import http.client
+
+        if self._https:
+            return http.client.HTTPSConnection(self._host,
+                                               self._port,
+                                               timeout=self.timeout,
+                                               context=_get_ssl_context())
+        else:
+            return http.client.HTTPConnection(self._host,
+                                              self._port,
+                                              timeout=self.timeout)
+
+    def _request(self, conn: http.client.HTTPConnection,
+                 body: bytes) -> tuple[http.client.HTTPResponse, bytes]:
+        r"""POST a message and read the whole response."""
+        conn.request('POST',
+                     self._path,
+                     body=body,
+                     headers={
+                         'Content-type': 'application/json; charset=UTF-8',
+                     })
+        response: http.client.HTTPResponse = conn.getresponse()
+
+        # The response must be fully read before reusing the connection.
+        return response, response.read()
+
+    def send(self,
+             message: str = 'message',
+             title: str = 'title',
+             priority: int = 5) -> dict:
+        r"""Send a notification using a pooled connection.
+
+        :parameter message: the text of the message.
+            Defaults to ``message``.
+        :parameter title: the message title.
+            Defaults to ``title``.
+        :parameter priority: the message priority.
+            Defaults to ``5``.
+        :type message: str
+        :type title: str
+        :type priority: int
+        :returns: the decoded JSON reply of the server.
+        :rtype: dict
+        :raises: urllib.error.HTTPError or a built-in exception.
+        """
+        import http.client
+        import json
+        import urllib.error
+
+        body: bytes = _gotify_payload(message, title, priority)
+        with self._slots:
+            conn: http.client.HTTPConnection
+            reused: bool
+            with self._lock:
+                reused = len(self._idle) > 0
+                conn = self._idle.pop() if reused else self._connect()
+
+            try:
+                try:
+                    response, data = self._request(conn, body)
+                except (http.client.RemoteDisconnected, ConnectionError):
+                    # The server closed an idle keep-alive connection.
+                    if not reused:
+                        raise
+                    conn.close()
+                    response, data = self._request(conn, body)
+            except BaseException:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+
+        if response.status >= 400:
+            raise urllib.error.HTTPError(self.url, response.status,
+                                         response.reason, response.headers,
+                                         io.BytesIO(data))
+
+        return json.loads(data.decode('UTF-8')) if data else dict()
+
+    def send_many(self, notifications: list[tuple[str, str,
+                                                  int]]) -> list[dict]:
+        r"""Send several notifications concurrently.
+
+        :parameter notifications: ``(message, title, priority)`` tuples.
+        :type notifications: list[tuple[str, str, int]]
+        :returns: the decoded JSON replies of the server, in the same order
+             as the notifications.
+        :rtype: list[dict]
+        :raises: urllib.error.HTTPError or a built-in exception.
+
+        .. note::
+             At most ``pool_size`` requests are in flight at the same time.
+             The first exception raised is propagated.
+        """
+        import concurrent.futures
+
+        notifications = list(notifications)
+        if len(notifications) <= 1:
+            return [self.send(*n) for n in notifications]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(
+                self.pool_size, len(notifications))) as executor:
+            return list(executor.map(lambda n: self.send(*n), notifications))
+
+    def close(self):
+        r"""Close all the idle connections."""
+        with self._lock:
+            idle: list[http.client.HTTPConnection] = self._idle
+            self._idle = list()
+        for conn in idle:
+            conn.close()
+
+
+class NotificationDispatcher:
+    r"""Deliver notifications from background threads.
+
+    Any callable, such as ``send_email`` or ``send_gotify_message``, can be
+    queued together with its arguments. Submitting only appends to an
+    in-memory queue, so the caller never waits for the network. Failed
+    deliveries are retried with an exponential backoff.
+
+    :parameter workers: the number of delivery threads.
+         Defaults to ``1``.
+    :parameter max_queue_size: the maximum number of queued notifications.
+         Defaults to ``1024``.
+    :parameter max_retries: the number of retries after a failed delivery.
+         Defaults to ``3``.
+    :parameter backoff: the number of seconds to wait before the first
+         retry. The delay doubles at each following retry.
+         Defaults to ``0.5``.
+    :parameter max_backoff: the maximum delay between retries, in seconds.
+         Defaults to ``30.0``.
+    :parameter flush_on_exit: deliver the queued notifications when the
+         interpreter exits. Defaults to ``True``.
+    :type workers: int
+    :type max_queue_size: int
+    :type max_retries: int
+    :type backoff: float
+    :type max_backoff: float
+    :type flush_on_exit: bool
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         Instances can be used as context managers: the queue is flushed
+         and the threads are stopped on exit.
+
+    .. note::
+         If ``close`` times out, the notifications still queued are
+         dropped and the threads stop after their current delivery.
+    """
+
+    def __init__(self,
+                 workers: int = 1,
+                 max_queue_size: int = 1024,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 max_backoff: float = 30.0,
+                 flush_on_exit: bool = True):
+        r"""Create the queue and start the delivery threads."""
+        if (workers < 1 or max_queue_size < 1 or max_retries < 0 or backoff < 0
+                or max_backoff < 0):
+            raise ValueError
+
+        self.max_retries: int = max_retries
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+
+        # The size is checked by submit, so that the stop sentinels can
+        # always be queued.
+        self._max_queue_size: int = max_queue_size
+        self._queue: queue.Queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._closed: bool = False
+        self._statistics: dict[str, int] = {
+            'submitted': 0,
+            'delivered': 0,
+            'failed': 0,
+            'retried': 0,
+            'dropped': 0,
+            'pending': 0,
+        }
+
+        self._threads: list[threading.Thread] = [
+            threading.Thread(target=self._work, daemon=True)
+            for _ in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+        self._flush_on_exit: bool = flush_on_exit
+        if flush_on_exit:
+            atexit.register(self.close)
+
+    def __enter__(self):
+        r"""Return the dispatcher itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Flush the queue and stop the threads."""
+        self.close()
+
+    def _count(self, key: str, delta: int = 1):
+        r"""Update a statistic counter and wake up the waiters."""
+        with self._condition:
+            self._statistics[key] += delta
+            if key == 'pending':
+                self._condition.notify_all()
+
+    def _deliver(self, function, args: tuple, kwargs: dict) -> bool:
+        r"""Call the function, retrying it on errors."""
+        attempt: int = 0
+        delivered: bool = False
+        done: bool = False
+        while not done:
+            try:
+                function(*args, **kwargs)
+                delivered = True
+                done = True
+            except Exception:
+                if attempt >= self.max_retries:
+                    done = True
+                else:
+                    time.sleep(min(self.backoff * 2**attempt,
+                                   self.max_backoff))
+                    attempt += 1
+                    self._count('retried')
+
+        return delivered
+
+    def _work(self):
+        r"""Deliver notifications until a stop sentinel is found."""
+        go: bool = True
+        while go:
+            item = self._queue.get()
+            if item is None:
+                go = False
+            else:
+                if self._deliver(*item):
+                    self._count('delivered')
+                else:
+                    self._count('failed')
+                self._count('pending', -1)
+            self._queue.task_done()
+
+    def submit(self, function, *args, **kwargs) -> bool:
+        r"""Queue a call to ``function(*args, **kwargs)``.
+
+        :parameter function: the callable that delivers the notification.
+        :type function: typing.Callable
+        :returns: ``True`` if the notification was queued, ``False`` if
+             it was dropped because the queue is full.
+        :rtype: bool
+        :raises: RuntimeError if the dispatcher was closed.
+        """
+        queued: bool = True
+        # close() cannot run between the check and the put, so nothing is
+        # queued after the final flush.
+        with self._condition:
+            if self._closed:
+                raise RuntimeError
+            if self._queue.qsize() < self._max_queue_size:
+                self._queue.put_nowait((function, args, kwargs))
+                self._statistics['submitted'] += 1
+                self._statistics['pending'] += 1
+            else:
+                self._statistics['dropped'] += 1
+                queued = False
+
+        return queued
+
+    def send_email(self, *args, **kwargs) -> bool:
+        r"""Queue a ``send_email`` call with the same arguments."""
+        return self.submit(send_email, *args, **kwargs)
+
+    def send_gotify_message(self, *args, **kwargs) -> bool:
+        r"""Queue a ``send_gotify_message`` call with the same arguments."""
+        return self.submit(send_gotify_message, *args, **kwargs)
+
+    def flush(self, timeout: float = None) -> bool:
+        r"""Wait until all the queued notifications are processed.
+
+        :parameter timeout: the maximum number of seconds to wait.
+             Defaults to ``None`` which means to wait indefinitely.
+        :type timeout: float
+        :returns: ``True`` if the queue is empty, ``False`` on timeout.
+        :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: self._statistics['pending'] == 0, timeout)
+
+    def _drop_queued(self):
+        r"""Remove the notifications that are still queued."""
+        with self._condition:
+            dropped: int = 0
+            go: bool = True
+            while go:
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    dropped += 1
+                except queue.Empty:
+                    go = False
+            self._statistics['dropped'] += dropped
+            self._statistics['pending'] -= dropped
+            self._condition.notify_all()
+
+    def close(self, timeout: float = None) -> bool:
+        r"""Flush the queue and stop the delivery threads.
+
+        :parameter timeout: the maximum number of seconds to wait for the
+             queue to be flushed and for the threads to stop. Defaults to
+             ``None`` which means to wait indefinitely.
+        :type timeout: float
+        :returns: ``True`` if all the threads stopped, ``False`` on timeout.
+             In that case ``close`` can be called again to wait for them.
+        :rtype: bool
+        """
+        deadline: float = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+
+        with self._condition:
+            closing: bool = not self._closed
+            self._closed = True
+        if closing and self._flush_on_exit:
+            atexit.unregister(self.close)
+
+        if closing:
+            if not self.flush(timeout):
+                self._drop_queued()
+            # Nothing else is queued once the dispatcher is closed.
+            for _ in self._threads:
+                self._queue.put_nowait(None)
+
+        for t in self._threads:
+            if deadline is None:
+                t.join()
+            else:
+                t.join(max(0.0, deadline - time.monotonic()))
+
+        return not any(t.is_alive() for t in self._threads)
+
+    def statistics(self) -> dict[str, int]:
+        r"""Get the delivery statistics.
+
+        :returns: the number of ``submitted``, ``delivered``, ``failed``,
+             ``dropped`` and ``pending`` notifications and the number of
+             ``retried`` deliveries. Notifications are dropped when the
+             queue is full or when ``close`` times out.
+        :rtype: dict[str, int]
+        """
+        with self._condition:
+            return dict(self._statistics)
+
+
+class TokenBucket:
+    r"""A token bucket rate limiter.
+
+    :parameter rate: the number of tokens added each second.
+    :parameter capacity: the maximum number of tokens, i.e. the burst size.
+    :type rate: float
+    :type capacity: float
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         The bucket starts full.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        r"""Create a full bucket."""
+        if rate < 0 or capacity < 1:
+            raise ValueError
+
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self._tokens: float = capacity
+        self._last: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        r"""Add the tokens accumulated since the last call."""
+        now: float = time.monotonic()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def consume(self, tokens: float = 1.0) -> bool:
+        r"""Take tokens from the bucket if available.
+
+        :parameter tokens: the number of tokens to take.
+             Defaults to ``1.0``.
+        :type tokens: float
+        :returns: ``True`` if the tokens were taken, ``False`` otherwise.
+        :rtype: bool
+        """
+        with self._lock:
+            self._refill()
+            allowed: bool = self._tokens >= tokens
+            if allowed:
+                self._tokens -= tokens
+
+        return allowed
+
+    def available(self) -> float:
+        r"""Get the number of tokens in the bucket.
+
+        :returns: the tokens that can be taken now.
+        :rtype: float
+        """
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class NotificationCoalescer:
+    r"""Deduplicate, aggregate and rate limit notifications.
+
+    The first notification for a destination is delivered immediately
+    and opens a time window. Notifications submitted to the same
+    destination while the window is open are collected: identical ones
+    are counted instead of being repeated. When the window expires the
+    collected notifications are delivered as a single digest and a new
+    window is opened. On top of that, every destination has its own token
+    bucket: deliveries exceeding the rate are postponed to the next window.
+
+    :parameter deliver: a callable accepting ``destination``, ``title``
+         and ``message`` that sends a notification. For example a wrapper
+         around ``send_gotify_message`` or ``send_email``.
+    :parameter window: the duration of the coalescing window, in seconds.
+         Defaults to ``60.0``.
+    :parameter rate: the number of deliveries allowed each second for
+         each destination. Defaults to ``1.0``.
+    :parameter burst: the maximum number of consecutive deliveries for
+         each destination. Defaults to ``10``.
+    :type deliver: typing.Callable
+    :type window: float
+    :type rate: float
+    :type burst: int
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         There is no background timer: ``submit`` checks only the window of
+         its destination, the other expired windows are delivered by
+         ``flush``, which should be called periodically. ``deliver`` is
+         called without holding the internal lock.
+         Instances can be used as context managers: all the collected
+         notifications are delivered on exit.
+
+    .. note::
+         A destination is forgotten by ``flush`` once its window expired
+         with nothing collected and its token bucket is full again, so
+         many short-lived destinations do not accumulate.
+    """
+
+    def __init__(self,
+                 deliver,
+                 window: float = 60.0,
+                 rate: float = 1.0,
+                 burst: int = 10):
+        r"""Create a coalescer with no open windows."""
+        if window < 0 or rate < 0 or burst < 1:
+            raise ValueError
+
+        self.deliver = deliver
+        self.window: float = window
+        self.rate: float = rate
+        self.burst: int = burst
+
+        # destination -> window start time.
+        self._windows: dict = dict()
+        # destination -> {(title, message): count}, in submission order.
+        self._pending: dict = dict()
+        self._buckets: dict = dict()
+        self._lock = threading.Lock()
+        self._statistics: dict[str, int] = {
+            'submitted': 0,
+            'delivered': 0,
+            'coalesced': 0,
+            'rate_limited': 0,
+        }
+
+    def __enter__(self):
+        r"""Return the coalescer itself."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Deliver all the collected notifications."""
+        self.flush(force=True)
+
+    def _bucket(self, destination) -> TokenBucket:
+        r"""Get the token bucket of a destination."""
+        if destination not in self._buckets:
+            self._buckets[destination] = TokenBucket(self.rate, self.burst)
+
+        return self._buckets[destination]
+
+    def _take(self, destination, now: float, force: bool) -> list[tuple]:
+        r"""Take the collected notifications of a destination as a message.
+
+        Called with the lock held, when the window of the destination
+        expired or is not open yet. Return a list with the message to
+        deliver and the number of notifications it holds, or an empty list.
+        """
+        taken: list[tuple] = list()
+        pending: dict = self._pending.get(destination, dict())
+        if not pending:
+            # Quiet window: the next notification is sent at once.
+            self._windows.pop(destination, None)
+            self._pending.pop(destination, None)
+        elif force or self._bucket(destination).consume():
+            title: str
+            message: str
+            total: int = sum(pending.values())
+            if len(pending) == 1:
+                (title, message), count = next(iter(pending.items()))
+                if count > 1:
+                    message += '\n\n(repeated ' + str(count) + ' times)'
+            else:
+                title = str(total) + ' notifications'
+                message = '\n'.join(
+                    str(c) + 'x ' + t + ': ' + m
+                    for (t, m), c in pending.items())
+            taken.append((destination, title, message, total))
+            pending.clear()
+            self._windows[destination] = now
+        else:
+            self._statistics['rate_limited'] += 1
+            self._windows[destination] = now
+
+        return taken
+
+    def _deliver(self, messages: list[tuple]) -> int:
+        r"""Deliver messages without holding the lock.
+
+        A failed delivery does not stop the others: the first exception is
+        raised at the end.
+        """
+        deliveries: int = 0
+        error: Exception = None
+        for destination, title, message, total in messages:
+            try:
+                self.deliver(destination, title, message)
+                deliveries += 1
+                with self._lock:
+                    self._statistics['delivered'] += 1
+                    self._statistics['coalesced'] += total - 1
+            except Exception as e:
+                if error is None:
+                    error = e
+        if error is not None:
+            raise error
+
+        return deliveries
+
+    def submit(self, destination, title: str, message: str):
+        r"""Submit a notification.
+
+        :parameter destination: a hashable object identifying where the
+             notification goes, passed as-is to ``deliver``.
+        :parameter title: the title or subject of the notification.
+        :parameter message: the text of the notification.
+        :type destination: typing.Hashable
+        :type title: str
+        :type message: str
+        :returns: None
+        :raises: any exception raised by ``deliver``.
+        """
+        messages: list[tuple] = list()
+        with self._lock:
+            self._statistics['submitted'] += 1
+            pending: dict = self._pending.setdefault(destination, dict())
+            key: tuple[str, str] = (title, message)
+            pending[key] = pending.get(key, 0) + 1
+
+            # Only this destination is checked: the leading edge, when
+            # nothing was sent recently, or an expired window.
+            now: float = time.monotonic()
+            if (destination not in self._windows
+                    or now - self._windows[destination] >= self.window):
+                messages = self._take(destination, now, False)
+        self._deliver(messages)
+
+    def flush(self, force: bool = False) -> int:
+        r"""Deliver the notifications whose window expired.
+
+        :parameter force: deliver every collected notification, ignoring
+             both the windows and the rate limits. Defaults to ``False``.
+        :type force: bool
+        :returns: the number of deliveries.
+        :rtype: int
+        :raises: any exception raised by ``deliver``.
+        """
+        messages: list[tuple] = list()
+        with self._lock:
+            now: float = time.monotonic()
+            for destination in list(self._windows):
+                if force or now - self._windows[destination] >= self.window:
+                    messages += self._take(destination, now, force)
+            # Idle destinations, which would be rate limited no more.
+            for destination in list(self._buckets):
+                bucket: TokenBucket = self._buckets[destination]
+                if (destination not in self._windows
+                        and bucket.available() >= bucket.capacity):
+                    del self._buckets[destination]
+
+        return self._deliver(messages)
+
+    def statistics(self) -> dict[str, int]:
+        r"""Get the coalescing statistics.
+
+        :returns: the number of ``submitted`` notifications, of
+             ``delivered`` messages, of notifications ``coalesced`` into
+             other messages, of ``rate_limited`` delivery attempts and of
+             the ``destinations`` currently tracked.
+        :rtype: dict[str, int]
+        """
+        with self._lock:
+            statistics: dict[str, int] = dict(self._statistics)
+            statistics['destinations'] = len(self._windows.keys()
+                                             | self._buckets.keys())
+
+        return statistics
 
 
 if __name__ == '__main__':
@@ -20,12 +20,39 @@
 # along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
 #
 """Functions on paths."""
+from __future__ import annotations
 
 import datetime
+import functools
 import hashlib
-import pathlib
-import secrets
-import urllib
+import itertools
+import os
+
+# secrets and base64 are imported where they are needed so that
+# importing fpyutils stays cheap.
+
+# Maximum number of distinct hashed components kept in memory.
+HASHED_COMPONENT_CACHE_SIZE: int = 256
+
+
+@functools.lru_cache(maxsize=HASHED_COMPONENT_CACHE_SIZE)
+def _hashed_component(path_suffix: str, character_encoding: str,
+                      digest_size: int) -> str:
+    r"""Hash the path suffix. The result is deterministic so it is cached."""
+    return hashlib.blake2b(path_suffix.encode(character_encoding),
+                           digest_size=digest_size).hexdigest()
+
+
+# Calling next() on an itertools.count object is atomic in CPython, so
+# threads get distinct values without locking. Forked processes inherit the
+# counter but have a different PID.
+_unique_counter = itertools.count()
+
+
+def _unique_component(component_separator: str) -> str:
+    r"""Return the PID of the process and a per-process sequence number."""
+    return (format(os.getpid(), 'x') + component_separator +
+            format(next(_unique_counter), 'x'))
 
 
 def add_trailing_slash(uri: str) -> str:
@@ -45,12 +72,62 @@ def add_trailing_slash(uri: str) -> str:
     return uri
 
 
+def add_trailing_slashes(uris):
+    r"""Add a trailing slash when needed to many strings at once.
+
+    :param uris: strings, usually URIs. Lists and tuples, NumPy arrays of
+        strings, bytes or objects and PyArrow string arrays are processed in
+        one pass. Any other iterable, such as a generator, is processed
+        lazily.
+    :type uris: typing.Iterable[str]
+    :returns: the input strings with a trailing slash, in a container of the
+        same type as ``uris``. Other iterables result in a generator.
+    :rtype: typing.Iterable[str]
+    :raises: a built-in exception.
+
+    .. note::
+        Strings already ending with a slash are not copied. NumPy and PyArrow
+        are not dependencies of fpyutils: they are imported only when such
+        an array is passed.
+
+    .. note::
+        NumPy bytes arrays get a ``b'/'``. Other array-likes, such as
+        pandas series or NumPy arrays of other types, are iterated like any
+        other iterable and result in a generator.
+    """
+    module: str = type(uris).__module__.split('.')[0]
+    result = None
+
+    if isinstance(uris, (list, tuple)):
+        result = type(uris)(u if u.endswith('/') else u + '/' for u in uris)
+    elif module == 'numpy' and uris.dtype.kind in ['U', 'S']:
+        import numpy
+        slash = '/' if uris.dtype.kind == 'U' else b'/'
+        result = numpy.where(numpy.char.endswith(uris, slash), uris,
+                             numpy.char.add(uris, slash))
+    elif module == 'numpy' and uris.dtype.kind == 'O':
+        import numpy
+        result = numpy.array(
+            [u if u.endswith('/') else u + '/' for u in uris.flat],
+            dtype=object).reshape(uris.shape)
+    elif module == 'pyarrow':
+        import pyarrow.compute
+        result = pyarrow.compute.if_else(
+            pyarrow.compute.ends_with(uris, '/'), uris,
+            pyarrow.compute.binary_join_element_wise(uris, '/', ''))
+    else:
+        result = (u if u.endswith('/') else u + '/' for u in uris)
+
+    return result
+
+
 def gen_pseudorandom_path(path_suffix: str = str(),
                           date_component_format: str = '%F_%H-%M-%S_%f',
                           component_separator: str = '_',
                           pseudorandom_component_bytes: int = 4,
                           hash_component_digest_size: int = 3,
-                          character_encoding: str = 'UTF-8') -> str:
+                          character_encoding: str = 'UTF-8',
+                          unique: bool = False) -> str:
     r"""Generate a pseudorandom string useful for paths.
 
     :param path_suffix: the final part of the string.
@@ -65,23 +142,38 @@ def gen_pseudorandom_path(path_suffix: str = str(),
         Defaults to ``3``.
     :param character_encoding: the character encoding of the hashed component.
         Defaults to ``UTF-8``.
+    :param unique: add the process ID and a per-process counter after the
+        date component. Defaults to ``False``.
     :type path_suffix: str
     :type date_component_format: str
     :type component_separator: str
     :type pseudorandom_component_bytes: int
     :type hash_component_digest_size: int
     :type character_encoding: str
+    :type unique: bool
     :returns:
     :rtype: str
     :raises: a built-in exception.
 
     .. note::
         This system minimises the risk of collisions for creating a path.
+
+    .. note::
+        With ``unique`` set to ``True`` collisions are not possible among
+        the threads and the running processes of a host, without locks or
+        filesystem checks. A process reusing the PID of a terminated one is
+        told apart by the date component, as long as it includes the
+        seconds.
     """
+    import secrets
+
     # 1. the current date.
     # call the fpyutils.datetime module.
     date_component: str = datetime.date.strftime(datetime.datetime.now(),
                                                  date_component_format)
+    if unique:
+        date_component += component_separator + _unique_component(
+            component_separator)
 
     # 2. a pseudorandom component.
     pseudorandom_component: str = secrets.token_urlsafe(
@@ -89,9 +181,8 @@ def gen_pseudorandom_path(path_suffix: str = str(),
 
     # 3. a hash of path_suffix. This will be equal to
     #    'cec7ea' using blake2b and a digest size of 3.
-    hashed_component: str = (hashlib.blake2b(
-        path_suffix.encode(character_encoding),
-        digest_size=hash_component_digest_size).hexdigest())
+    hashed_component: str = _hashed_component(path_suffix, character_encoding,
+                                              hash_component_digest_size)
 
     # 4. the path suffix, if present.
     if path_suffix != str():
@@ -101,5 +192,243 @@ def gen_pseudorandom_path(path_suffix: str = str(),
             component_separator + hashed_component + path_suffix)
 
 
+def gen_pseudorandom_paths(number_of_paths: int,
+                           path_suffix: str = str(),
+                           date_component_format: str = '%F_%H-%M-%S_%f',
+                           component_separator: str = '_',
+                           pseudorandom_component_bytes: int = 4,
+                           hash_component_digest_size: int = 3,
+                           character_encoding: str = 'UTF-8',
+                           unique: bool = False) -> list[str]:
+    r"""Generate many pseudorandom strings useful for paths at once.
+
+    :param number_of_paths: how many strings to generate.
+    :param path_suffix: the final part of the strings.
+        Defaults to ``str()``.
+    :param date_component_format: the format of the date component.
+        Defaults to ``%F_%H-%M-%S_%f``.
+    :param component_separator: an element that separates the various components.
+        Defaults to ``_``.
+    :param pseudorandom_component_bytes: the number of bytes of the pseudorandom components.
+        Defaults to ``4``.
+    :param hash_component_digest_size: the digest size of the hashed component.
+        Defaults to ``3``.
+    :param character_encoding: the character encoding of the hashed component.
+        Defaults to ``UTF-8``.
+    :param unique: add the process ID and a per-process counter after the
+        date component. Defaults to ``False``.
+    :type number_of_paths: int
+    :type path_suffix: str
+    :type date_component_format: str
+    :type component_separator: str
+    :type pseudorandom_component_bytes: int
+    :type hash_component_digest_size: int
+    :type character_encoding: str
+    :type unique: bool
+    :returns: a list of distinct strings, each one in the same format
+        as the ones returned by ``gen_pseudorandom_path``.
+    :rtype: list[str]
+    :raises: ValueError if there are not enough distinct pseudorandom
+        components, or a built-in exception.
+
+    .. note::
+        The date and the hashed components are computed once for the whole
+        batch and all the randomness is read at once. Since the date
+        component is shared, the strings of a batch are guaranteed to be
+        distinct by redrawing duplicate pseudorandom components.
+
+    .. note::
+        With ``unique`` set to ``True`` the whole batch shares one
+        counter value, which keeps it apart from the other batches and
+        strings, see ``gen_pseudorandom_path``.
+    """
+    import base64
+
+    if (number_of_paths < 0 or pseudorandom_component_bytes < 1
+            or number_of_paths > 256**pseudorandom_component_bytes):
+        raise ValueError
+
+    date_component: str = datetime.date.strftime(datetime.datetime.now(),
+                                                 date_component_format)
+    if unique:
+        date_component += component_separator + _unique_component(
+            component_separator)
+    hashed_component: str = _hashed_component(path_suffix, character_encoding,
+                                              hash_component_digest_size)
+    if path_suffix != str():
+        path_suffix = component_separator + path_suffix
+
+    prefix: str = date_component + component_separator
+    suffix: str = component_separator + hashed_component + path_suffix
+    size: int = pseudorandom_component_bytes
+
+    paths: list[str] = list()
+    seen: set[bytes] = set()
+    while len(paths) < number_of_paths:
+        missing: int = number_of_paths - len(paths)
+        randomness: bytes = os.urandom(missing * size)
+        for i in range(0, missing * size, size):
+            token: bytes = randomness[i:i + size]
+            if token not in seen:
+                seen.add(token)
+                # Same encoding as secrets.token_urlsafe.
+                paths.append(prefix + base64.urlsafe_b64encode(token).rstrip(
+                    b'=').decode('ascii') + suffix)
+
+    return paths
+
+
+def create_unique_file(directory: str,
+                       path_suffix: str = str(),
+                       mode: int = 0o600,
+                       max_attempts: int = 8,
+                       **kwargs) -> str:
+    r"""Atomically create a new empty file with a unique name.
+
+    :param directory: the directory where the file is created.
+    :param path_suffix: the final part of the file name.
+        Defaults to ``str()``.
+    :param mode: the permissions of the new file.
+        Defaults to ``0o600``.
+    :param max_attempts: the number of names tried before giving up.
+        Defaults to ``8``.
+    :param kwargs: other arguments passed to ``gen_pseudorandom_path``.
+    :type directory: str
+    :type path_suffix: str
+    :type mode: int
+    :type max_attempts: int
+    :returns: the path of the new file.
+    :rtype: str
+    :raises: FileExistsError if all the attempts fail, or a built-in exception.
+
+    .. note::
+        The file is created with ``O_CREAT | O_EXCL``, so an existing file
+        is never opened or truncated. Names are generated in unique mode,
+        see ``gen_pseudorandom_path``.
+    """
+    if max_attempts < 1:
+        raise ValueError
+
+    flags: int = (os.O_WRONLY | os.O_CREAT | os.O_EXCL
+                  | getattr(os, 'O_CLOEXEC', 0))
+    attempt: int = 0
+    created: str = str()
+    while created == str():
+        attempt += 1
+        path: str = os.path.join(
+            directory,
+            gen_pseudorandom_path(path_suffix=path_suffix,
+                                  unique=True,
+                                  **kwargs))
+        try:
+            os.close(os.open(path, flags, mode))
+            created = path
+        except FileExistsError:
+            if attempt >= max_attempts:
+                raise
+
+    return created
+
+
+class PseudorandomPathGenerator:
+    r"""Generate pseudorandom strings useful for paths with fixed options.
+
+    All the options of ``gen_pseudorandom_path`` except the path suffix are
+    bound once, and the final part of the string, i.e. the hashed
+    component and the suffix, is kept for the most recently used suffixes.
+
+    :param date_component_format: the format of the date component.
+        Defaults to ``%F_%H-%M-%S_%f``.
+    :param component_separator: an element that separates the various components.
+        Defaults to ``_``.
+    :param pseudorandom_component_bytes: the number of bytes of the pseudorandom components.
+        Defaults to ``4``.
+    :param hash_component_digest_size: the digest size of the hashed component.
+        Defaults to ``3``.
+    :param character_encoding: the character encoding of the hashed component.
+        Defaults to ``UTF-8``.
+    :param unique: add the process ID and a per-process counter after the
+        date component. Defaults to ``False``.
+    :type date_component_format: str
+    :type component_separator: str
+    :type pseudorandom_component_bytes: int
+    :type hash_component_digest_size: int
+    :type character_encoding: str
+    :type unique: bool
+    """
+
+    def __init__(self,
+                 date_component_format: str = '%F_%H-%M-%S_%f',
+                 component_separator: str = '_',
+                 pseudorandom_component_bytes: int = 4,
+                 hash_component_digest_size: int = 3,
+                 character_encoding: str = 'UTF-8',
+                 unique: bool = False):
+        r"""Bind the options."""
+        self.date_component_format: str = date_component_format
+        self.component_separator: str = component_separator
+        self.pseudorandom_component_bytes: int = pseudorandom_component_bytes
+        self.hash_component_digest_size: int = hash_component_digest_size
+        self.character_encoding: str = character_encoding
+        self.unique: bool = unique
+
+        self._final_component = functools.lru_cache(
+            maxsize=HASHED_COMPONENT_CACHE_SIZE)(self._build_final_component)
+
+    def _build_final_component(self, path_suffix: str) -> str:
+        r"""Join the hashed component and the path suffix."""
+        final_component: str = (
+            self.component_separator +
+            _hashed_component(path_suffix, self.character_encoding,
+                              self.hash_component_digest_size))
+        if path_suffix != str():
+            final_component += self.component_separator + path_suffix
+
+        return final_component
+
+    def __call__(self, path_suffix: str = str()) -> str:
+        r"""Generate a pseudorandom string.
+
+        :param path_suffix: the final part of the string.
+            Defaults to ``str()``.
+        :type path_suffix: str
+        :returns: a string in the same format as the one returned by
+            ``gen_pseudorandom_path``.
+        :rtype: str
+        :raises: a built-in exception.
+        """
+        import secrets
+
+        date_component: str = datetime.datetime.now().strftime(
+            self.date_component_format)
+        if self.unique:
+            date_component += self.component_separator + _unique_component(
+                self.component_separator)
+
+        return (date_component + self.component_separator +
+                secrets.token_urlsafe(self.pseudorandom_component_bytes) +
+                self._final_component(path_suffix))
+
+    def generate_many(
+        self, number_of_paths: int, path_suffix: str = str()) -> list[str]:
+        r"""Generate many pseudorandom strings at once.
+
+        :param number_of_paths: how many strings to generate.
+        :param path_suffix: the final part of the strings.
+            Defaults to ``str()``.
+        :type number_of_paths: int
+        :type path_suffix: str
+        :returns: see ``gen_pseudorandom_paths``.
+        :rtype: list[str]
+        :raises: ValueError or a built-in exception.
+        """
+        return gen_pseudorandom_paths(number_of_paths, path_suffix,
+                                      self.date_component_format,
+                                      self.component_separator,
+                                      self.pseudorandom_component_bytes,
+                                      self.hash_component_digest_size,
+                                      self.character_encoding, self.unique)
+
+
 if __name__ == '__main__':
     pass
@@ -20,16 +20,107 @@
 # along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
 #
 """Functions on shell."""
+from __future__ import annotations
 
-import subprocess
+import codecs
+import contextlib
+import hashlib
+import os
 import sys
 
+# subprocess, tempfile, json and the platform specific modules are imported
+# where they are needed so that importing fpyutils stays cheap.
 
-def execute_command_live_output(
-        command: str,
-        shell: str = '/bin/bash',
-        dry_run: bool = False,
-        output_character_encoding: str = 'UTF-8') -> int:
+# Size of the blocks copied from the output of a command to its log files,
+# and of the pipe the output goes through, where possible.
+BLOCK_SIZE: int = 1024 * 1024
+
+
+def _set_pipe_size(fd: int):
+    r"""Make a pipe hold a block, if the platform allows it."""
+    # F_SETPIPE_SZ is Linux only and limited by /proc/sys/fs/pipe-max-size.
+    with contextlib.suppress(AttributeError, ImportError, OSError):
+        import fcntl
+        fcntl.fcntl(fd, fcntl.F_SETPIPE_SZ, BLOCK_SIZE)
+
+
+def _write_all(fd: int, data: bytes):
+    r"""Write all the data to a file descriptor."""
+    view = memoryview(data)
+    while len(view) > 0:
+        view = view[os.write(fd, view):]
+
+
+def _relay_copy(source: int, sinks: list[int], text_output,
+                output_character_encoding: str):
+    r"""Copy the content of a pipe to the sinks, in blocks, until end of file.
+
+    If text_output is not ``None``, the data is also decoded and written to
+    it.
+    """
+    decoder = codecs.getincrementaldecoder(output_character_encoding)()
+    data: bytes = os.read(source, BLOCK_SIZE)
+    while data != b'':
+        for sink in sinks:
+            _write_all(sink, data)
+        if text_output is not None:
+            text_output.write(decoder.decode(data))
+            text_output.flush()
+        data = os.read(source, BLOCK_SIZE)
+    if text_output is not None:
+        text_output.write(decoder.decode(b'', final=True))
+        text_output.flush()
+
+
+def _open_log_files(stack, log_files: list[str]) -> list[int]:
+    r"""Open files for appending, closing them with the exit stack."""
+    sinks: list[int] = list()
+    for f in dict.fromkeys(log_files):
+        # Other writers can append to the same files.
+        fd: int = os.open(f, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        stack.callback(os.close, fd)
+        sinks.append(fd)
+
+    return sinks
+
+
+def _relay(source: int, sinks: list[int], output_character_encoding: str):
+    r"""Copy the content of a file descriptor to the console and the sinks."""
+    console: int = -1
+    sys.stdout.flush()
+    with contextlib.suppress(AttributeError, OSError, ValueError):
+        console = sys.stdout.fileno()
+
+    if console >= 0:
+        _relay_copy(source, [console] + sinks, None, output_character_encoding)
+    else:
+        _relay_copy(source, sinks, sys.stdout, output_character_encoding)
+
+
+def _execute_command_logged(command: str, shell: str,
+                            output_character_encoding: str,
+                            log_files: list[str]) -> int:
+    r"""Execute a command and copy its output to the console and log files."""
+    import subprocess
+
+    with contextlib.ExitStack() as stack:
+        sinks: list[int] = _open_log_files(stack, log_files)
+        process = stack.enter_context(
+            subprocess.Popen([shell, '-c', command],
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT))
+        source: int = process.stdout.fileno()
+        _set_pipe_size(source)
+        _relay(source, sinks, output_character_encoding)
+
+    return process.returncode
+
+
+def execute_command_live_output(command: str,
+                                shell: str = '/bin/bash',
+                                dry_run: bool = False,
+                                output_character_encoding: str = 'UTF-8',
+                                log_files: list[str] = None) -> int:
     r"""Execute and print the output of a command relatime.
 
     :parameter command: the shell commands that needs to be executed.
@@ -39,13 +130,25 @@ def execute_command_live_output(
          Defaults to ``False``.
     :parameter output_character_encoding: the character encoding of the output.
          Defaults to ``UTF-8``.
+    :parameter log_files: files where the output of the command is also
+         appended. Defaults to ``None`` which means no file.
     :type command: str
     :type shell: str
     :type dry_run: bool
     :type output_character_encoding: str
+    :type log_files: list[str]
     :returns: process.returncode, the return code of the executed command.
     :rtype: int
     :raises: a subprocess, sys or a built-in exception.
+
+    .. note::
+         With log_files, both the standard output and the standard error of
+         the command go through a single pipe and are copied, as bytes and
+         in large blocks, to the standard output and to each file. The files
+         are opened in append mode, which ``splice`` does not support, so
+         other writers can share them. The output is decoded only if the
+         standard output has no file descriptor. Dry runs do not write to
+         log_files.
     """
     # See https://stackoverflow.com/a/53811881
     #
@@ -57,11 +160,15 @@ def execute_command_live_output(
     #
     # You should have received a copy of the license along with this
     # work. If not, see <http://creativecommons.org/licenses/by-sa/4.0/>.
+    import subprocess
 
     retval: int
     if dry_run:
         print(shell + ' -c ' + command)
         retval = 0
+    elif log_files:
+        retval = _execute_command_logged(command, shell,
+                                         output_character_encoding, log_files)
     else:
         # See also https://stackoverflow.com/questions/7407667/python-subprocess-subshells-and-redirection/7407744
         # and https://stackoverflow.com/a/58696973
@@ -82,5 +189,232 @@ def execute_command_live_output(
     return retval
 
 
+def _file_digest(input_file: str) -> str:
+    r"""Return the SHA-256 of a file, or ``None`` if it does not exist."""
+    digest: str = None
+    try:
+        with open(input_file, 'rb') as f:
+            h = hashlib.sha256()
+            block: bytes = f.read(BLOCK_SIZE)
+            while block != b'':
+                h.update(block)
+                block = f.read(BLOCK_SIZE)
+        digest = h.hexdigest()
+    except FileNotFoundError:
+        digest = None
+
+    return digest
+
+
+class CommandCache:
+    r"""Store the output and the return code of commands on disk.
+
+    :parameter directory: the directory of the cache, created if needed.
+         It can be shared by many processes.
+    :parameter max_bytes: the maximum size of the stored outputs.
+         Defaults to ``256 MiB``.
+    :parameter cache_failures: also store the results of commands with a
+         non-zero return code. Defaults to ``False``, so that transient
+         errors, such as network ones, are not replayed.
+    :type directory: str
+    :type max_bytes: int
+    :type cache_failures: bool
+    :raises: ValueError or a built-in exception.
+
+    .. note::
+         A result is identified by the SHA-256 of the shell, the command,
+         the working directory, the values of the selected environment
+         variables and the SHA-256 of the content of the declared input
+         files. Commands must be deterministic: anything else they depend
+         on is not checked.
+
+    .. note::
+         Each result is a single file with an ``.entry`` suffix, written to
+         a temporary file and renamed. When the size of the results exceeds
+         max_bytes, the least recently used ones are removed: the
+         modification time of a result is updated when it is replayed.
+    """
+
+    # Size of the header of a result file, holding the return code.
+    HEADER_SIZE: int = 32
+
+    def __init__(self,
+                 directory: str,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 cache_failures: bool = False):
+        r"""Create the directory if needed."""
+        if max_bytes < 1:
+            raise ValueError
+
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.cache_failures: bool = cache_failures
+        self._statistics: dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, command: str, shell: str, input_files: list[str],
+              environment_variables: list[str]) -> str:
+        r"""Return the result file of a command."""
+        import json
+
+        environment: dict[str, str] = {
+            v: os.environ.get(v)
+            for v in environment_variables
+        }
+        digests: dict[str, str] = {f: _file_digest(f) for f in input_files}
+        key: str = json.dumps(
+            [shell, command, os.getcwd(), environment, digests],
+            sort_keys=True)
+
+        return os.path.join(
+            self.directory,
+            hashlib.sha256(key.encode('UTF-8')).hexdigest() + '.entry')
+
+    def _replay(self, path: str, output_character_encoding: str,
+                log_files: list[str]) -> int:
+        r"""Copy a stored output to the console and return its return code.
+
+        Return ``None`` if there is no result.
+        """
+        retval: int = None
+        with contextlib.ExitStack() as stack:
+            try:
+                fd: int = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                fd = -1
+            if fd >= 0:
+                stack.callback(os.close, fd)
+                retval = int(os.read(fd, self.HEADER_SIZE))
+                # Least recently used results are evicted first.
+                with contextlib.suppress(OSError):
+                    os.utime(fd)
+                _relay(fd, _open_log_files(stack, log_files),
+                       output_character_encoding)
+
+        return retval
+
+    def _evict(self):
+        r"""Remove the least recently used results above max_bytes."""
+        entries: list[tuple[int, int, str]] = list()
+        total: int = 0
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.entry'):
+                    with contextlib.suppress(FileNotFoundError):
+                        st: os.stat_result = e.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, e.path))
+                        total += st.st_size
+        entries.sort()
+        i: int = 0
+        while total > self.max_bytes and i < len(entries):
+            # Another process may have removed it.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(entries[i][2])
+            total -= entries[i][1]
+            i += 1
+
+    def _execute(self, path: str, command: str, shell: str,
+                 output_character_encoding: str, log_files: list[str]) -> int:
+        r"""Execute a command and store its result, if needed."""
+        import tempfile
+
+        retval: int
+        fd, name = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # The output follows the header, which is written last.
+                f.write(b' ' * (self.HEADER_SIZE - 1) + b'\n')
+                f.flush()
+                retval = execute_command_live_output(
+                    command, shell, False, output_character_encoding,
+                    [name] + log_files)
+                f.seek(0)
+                f.write(str(retval).encode('ascii'))
+            if retval == 0 or self.cache_failures:
+                os.replace(name, path)
+            else:
+                os.remove(name)
+        except BaseException:
+            os.remove(name)
+            raise
+
+        return retval
+
+    def execute_command_live_output(
+            self,
+            command: str,
+            shell: str = '/bin/bash',
+            dry_run: bool = False,
+            output_character_encoding: str = 'UTF-8',
+            log_files: list[str] = None,
+            input_files: list[str] = None,
+            environment_variables: list[str] = None) -> int:
+        r"""Call the ``execute_command_live_output`` function, or replay it.
+
+        :parameter input_files: the files the result depends on.
+             Defaults to ``None`` which means none.
+        :parameter environment_variables: the names of the environment
+             variables the result depends on. Defaults to ``None`` which
+             means none.
+        :type input_files: list[str]
+        :type environment_variables: list[str]
+        :raises: a subprocess, sys or a built-in exception.
+
+        .. note::
+             Standard output and standard error are stored together, like
+             with log_files, and replayed as bytes.
+        """
+        logs: list[str] = log_files or list()
+        retval: int
+        if dry_run:
+            retval = execute_command_live_output(command, shell, True)
+        else:
+            path: str = self._path(command, shell, input_files or list(),
+                                   environment_variables or list())
+            retval = self._replay(path, output_character_encoding, logs)
+            if retval is not None:
+                self._statistics['hits'] += 1
+            else:
+                self._statistics['misses'] += 1
+                retval = self._execute(path, command, shell,
+                                       output_character_encoding, logs)
+                self._evict()
+
+        return retval
+
+    def clear(self):
+        r"""Remove all the stored results.
+
+        :raises: a built-in exception.
+        """
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.entry'):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.remove(e.path)
+
+    def statistics(self) -> dict[str, int]:
+        r"""Return the counters of the cache.
+
+        :returns: the number of ``hits`` and ``misses`` of this object, the
+             number of stored ``entries`` and their ``bytes``.
+        :rtype: dict[str, int]
+        """
+        statistics: dict[str, int] = dict(self._statistics)
+        statistics['entries'] = 0
+        statistics['bytes'] = 0
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if e.name.endswith('.entry'):
+                    with contextlib.suppress(FileNotFoundError):
+                        statistics['bytes'] += e.stat().st_size
+                        statistics['entries'] += 1
+
+        return statistics
+
+
 if __name__ == '__main__':
     pass
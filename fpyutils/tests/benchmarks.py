@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# benchmarks.py
+#
+# Copyright (C) 2017-2023 Franco Masotti (see /README.md)
+#
+# This file is part of fpyutils.
+#
+# fpyutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fpyutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Notification throughput benchmarks against local stand-in servers.
+
+Run with ``python -m fpyutils.tests.benchmarks [number_of_messages]``.
+Everything runs offline on localhost.
+"""
+from __future__ import annotations
+
+import sys
+import time
+from unittest.mock import patch
+
+from .. import notify
+from .servers import GotifyStandIn, SMTPStandIn, plain_smtp
+
+
+def percentile(values: list[float], p: float) -> float:
+    r"""Return the nearest-rank percentile of the values."""
+    ordered: list[float] = sorted(values)
+    rank: int = max(1, -(-len(ordered) * p // 100))
+
+    return ordered[int(rank) - 1]
+
+
+def measure(send, items: list, batch: bool = False) -> dict[str, float]:
+    r"""Time the delivery of the items.
+
+    ``send`` is called once for each item, or once for all of them
+    if ``batch`` is ``True``. In the latter case the latency of each message
+    is the batch duration divided by the number of messages.
+    """
+    latencies: list[float] = list()
+    start: float = time.perf_counter()
+    if batch:
+        send(items)
+        latencies = [(time.perf_counter() - start) / len(items)] * len(items)
+    else:
+        for i in items:
+            t: float = time.perf_counter()
+            send(i)
+            latencies.append(time.perf_counter() - t)
+    elapsed: float = time.perf_counter() - start
+
+    return {
+        'messages_per_second': len(items) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def benchmark_email(messages: int = 200) -> dict[str, dict[str, float]]:
+    r"""Benchmark single, pooled, batch and fan-out email sending.
+
+    A fan-out sends the first message to all the receivers.
+    """
+    items: list[tuple[str, str, str]] = [('body ' + str(i), 'r@example.com',
+                                          'subject ' + str(i))
+                                         for i in range(messages)]
+    results: dict[str, dict[str, float]] = dict()
+    with SMTPStandIn() as server:
+
+        def single(i):
+            notify.send_email(i[0], server.host, server.port, 's@example.com',
+                              'user', 'password', i[1], i[2])
+
+        with patch('smtplib.SMTP_SSL', plain_smtp):
+            results['single'] = measure(single, items)
+        with notify.SMTPMailer(server.host,
+                               server.port,
+                               's@example.com',
+                               'user',
+                               'password',
+                               use_ssl=False) as mailer:
+            results['pooled'] = measure(lambda i: mailer.send(*i), items)
+            results['batch'] = measure(mailer.send_many, items, batch=True)
+
+            def fan_out(i):
+                mailer.send_to_many(i[0][0], [r[1] for r in i], i[0][2])
+
+            results['fan-out'] = measure(fan_out, items, batch=True)
+
+    return results
+
+
+def benchmark_gotify(messages: int = 200) -> dict[str, dict[str, float]]:
+    r"""Benchmark single, pooled and batch Gotify notifications."""
+    items: list[tuple[str, str, int]] = [('message ' + str(i), 'title', 5)
+                                         for i in range(messages)]
+    results: dict[str, dict[str, float]] = dict()
+    with GotifyStandIn() as server:
+
+        def single(i):
+            notify.send_gotify_message(server.url, 'token', *i).close()
+
+        results['single'] = measure(single, items)
+        with notify.GotifyClient(server.url, 'token') as client:
+            results['pooled'] = measure(lambda i: client.send(*i), items)
+            results['batch'] = measure(client.send_many, items, batch=True)
+
+    return results
+
+
+def main(messages: int = 200):
+    r"""Print the benchmark results as a table."""
+    print('{:<8} {:<8} {:>12} {:>10} {:>10}'.format('target', 'mode',
+                                                    'messages/s', 'p50 ms',
+                                                    'p99 ms'))
+    for target, function in (('email', benchmark_email), ('gotify',
+                                                          benchmark_gotify)):
+        for mode, r in function(messages).items():
+            print('{:<8} {:<8} {:>12.1f} {:>10.3f} {:>10.3f}'.format(
+                target, mode, r['messages_per_second'], r['p50_ms'],
+                r['p99_ms']))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# servers.py
+#
+# Copyright (C) 2017-2023 Franco Masotti (see /README.md)
+#
+# This file is part of fpyutils.
+#
+# fpyutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# fpyutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with fpyutils.  If not, see <http://www.gnu.org/licenses/>.
+#
+"""Local stand-in servers for the notify tests and benchmarks."""
+from __future__ import annotations
+
+import base64
+import http.server
+import json
+import smtplib
+import socketserver
+import threading
+import urllib.parse
+
+
+def plain_smtp(host: str, port: int, context=None) -> smtplib.SMTP:
+    r"""Replace ``smtplib.SMTP_SSL`` with a plain connection.
+
+    The stand-in SMTP server does not speak TLS.
+    """
+    return smtplib.SMTP(host, port)
+
+
+class _StandIn:
+    r"""A server running in a background thread."""
+
+    server: socketserver.TCPServer
+
+    def __enter__(self):
+        r"""Start serving."""
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        args=(0.05, ),
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        r"""Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
+
+    @property
+    def host(self) -> str:
+        r"""The listening address."""
+        return self.server.server_address[0]
+
+    @property
+    def port(self) -> int:
+        r"""The listening port."""
+        return self.server.server_address[1]
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    r"""A minimal SMTP session with AUTH support."""
+
+    # Multi-line replies are written piecewise: avoid delayed ACK stalls.
+    disable_nagle_algorithm = True
+
+    def _reply(self, line: str):
+        self.wfile.write((line + '\r\n').encode('UTF-8'))
+
+    def _readline(self) -> str:
+        return self.rfile.readline().decode('UTF-8').rstrip('\r\n')
+
+    def _auth(self, arguments: list[str]) -> tuple[str, str]:
+        r"""Run the PLAIN or LOGIN authentication exchange."""
+        mechanism: str = arguments[0].upper() if arguments else str()
+        user: str = str()
+        password: str = str()
+        if mechanism == 'PLAIN':
+            if len(arguments) > 1:
+                response = arguments[1]
+            else:
+                self._reply('334 ')
+                response = self._readline()
+            _, user, password = base64.b64decode(response).decode(
+                'UTF-8').split('\0')
+        elif mechanism == 'LOGIN':
+            self._reply('334 VXNlcm5hbWU6')
+            user = base64.b64decode(self._readline()).decode('UTF-8')
+            self._reply('334 UGFzc3dvcmQ6')
+            password = base64.b64decode(self._readline()).decode('UTF-8')
+
+        return user, password
+
+    def handle(self):
+        r"""Serve commands until QUIT or disconnection."""
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+
+        sender: str = str()
+        recipients: list[str] = list()
+        self._reply('220 localhost fpyutils stand-in ESMTP')
+        go: bool = True
+        while go:
+            line: str = self._readline()
+            words: list[str] = line.split()
+            verb: str = words[0].upper() if words else str()
+            if verb == str() or verb == 'QUIT':
+                if verb == 'QUIT':
+                    self._reply('221 Bye')
+                go = False
+            elif verb == 'EHLO':
+                self._reply('250-localhost')
+                if server.pipelining:
+                    self._reply('250-PIPELINING')
+                self._reply('250-AUTH PLAIN LOGIN')
+                self._reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self._reply('250 localhost')
+            elif verb == 'AUTH':
+                if self._auth(words[1:]) == server.credentials:
+                    self._reply('235 Authentication successful')
+                else:
+                    self._reply('535 Authentication failed')
+            elif verb == 'MAIL':
+                sender = line.split(':', 1)[1].split()[0].strip('<>')
+                recipients = list()
+                self._reply('250 OK')
+            elif verb == 'RCPT':
+                recipient: str = line.split(':', 1)[1].split()[0].strip('<>')
+                if recipient in server.refused:
+                    self._reply('550 No such user')
+                else:
+                    recipients.append(recipient)
+                    self._reply('250 OK')
+            elif verb == 'DATA':
+                if not recipients:
+                    self._reply('503 No valid recipients')
+                else:
+                    self._reply('354 End data with <CR><LF>.<CR><LF>')
+                    data: list[str] = list()
+                    data_line: str = self._readline()
+                    while data_line != '.':
+                        # Dot unstuffing.
+                        data.append(data_line[1:] if data_line.
+                                    startswith('..') else data_line)
+                        data_line = self._readline()
+                    with server.lock:
+                        server.messages.append({
+                            'sender': sender,
+                            'recipients': recipients,
+                            'data': '\n'.join(data),
+                        })
+                    self._reply('250 OK')
+            elif verb == 'RSET':
+                sender = str()
+                recipients = list()
+                self._reply('250 OK')
+            elif verb == 'NOOP':
+                self._reply('250 OK')
+            else:
+                self._reply('502 Command not implemented')
+
+
+class SMTPStandIn(_StandIn):
+    r"""A local SMTP server storing the received messages in memory.
+
+    :parameter user: the accepted username.
+    :parameter password: the accepted password.
+    :parameter refused: recipients that are rejected with a 550 reply.
+    :parameter pipelining: advertise the PIPELINING extension.
+    """
+
+    def __init__(self,
+                 user: str = 'user',
+                 password: str = 'password',
+                 refused: tuple = tuple(),
+                 pipelining: bool = True):
+        r"""Bind to a free port on localhost."""
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0),
+                                                      _SMTPHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.credentials = (user, password)
+        self.server.refused = set(refused)
+        self.server.pipelining = pipelining
+        self.server.sessions = 0
+        self.server.messages = list()
+
+    @property
+    def messages(self) -> list[dict]:
+        r"""The received messages."""
+        with self.server.lock:
+            return list(self.server.messages)
+
+    @property
+    def sessions(self) -> int:
+        r"""The number of accepted connections."""
+        with self.server.lock:
+            return self.server.sessions
+
+
+class _GotifyHandler(http.server.BaseHTTPRequestHandler):
+    r"""The ``/message`` endpoint of a Gotify server."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        r"""Count the connections."""
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _send_json(self, status: int, payload: dict):
+        body: bytes = json.dumps(payload).encode('UTF-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        r"""Store a message."""
+        url = urllib.parse.urlsplit(self.path)
+        token: list[str] = urllib.parse.parse_qs(url.query).get(
+            'token', [str()])
+        data: bytes = self.rfile.read(int(self.headers['Content-Length']))
+        if url.path != '/message':
+            self._send_json(404, {'error': 'Not Found'})
+        elif token[0] != self.server.token:
+            self._send_json(401, {'error': 'Unauthorized'})
+        else:
+            payload: dict = json.loads(data.decode('UTF-8'))
+            with self.server.lock:
+                self.server.messages.append(payload)
+                payload['id'] = len(self.server.messages)
+            self._send_json(200, payload)
+
+    def log_message(self, format, *args):
+        r"""Keep the test output clean."""
+
+
+class GotifyStandIn(_StandIn):
+    r"""A local HTTP server mimicking the Gotify message API.
+
+    :parameter token: the accepted application token.
+    """
+
+    def __init__(self, token: str = 'token'):
+        r"""Bind to a free port on localhost."""
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      _GotifyHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.token = token
+        self.server.connections = 0
+        self.server.messages = list()
+
+    @property
+    def url(self) -> str:
+        r"""The base URL of the server."""
+        return 'http://' + self.host + ':' + str(self.port)
+
+    @property
+    def messages(self) -> list[dict]:
+        r"""The received messages."""
+        with self.server.lock:
+            return list(self.server.messages)
+
+    @property
+    def connections(self) -> int:
+        r"""The number of accepted connections."""
+        with self.server.lock:
+            return self.server.connections
+
+
+if __name__ == '__main__':
+    pass
@@ -21,13 +21,27 @@
 #
 """Tests."""
 
+import bz2
+import concurrent.futures
+import functools
+import gzip
+import http.client
+import importlib.util
 import io
+import lzma
+import os
 import pathlib
+import smtplib
+import subprocess
+import sys
 import tempfile
+import threading
 import unittest
+import urllib.error
 from unittest.mock import mock_open, patch
 
-from .. import exceptions, filelines, path, shell
+from .. import cli, exceptions, filelines, notify, path, shell
+from . import benchmarks, servers
 
 # filelines module.
 FAKE_FILE_AS_STRING = '''\
@@ -66,6 +80,25 @@ End of toc\n\
 '''
 
 
+def coordinated_inserts(filename: str, prefix: str, number: int) -> dict:
+    r"""Insert lines through a FileEditCoordinator in a child process."""
+    with filelines.FileEditCoordinator(newline_character='\n') as c:
+        futures = [
+            c.insert_string_at_line(filename, prefix + str(i) + '\n', 1)
+            for i in range(number)
+        ]
+        concurrent.futures.wait(futures)
+
+    return c.statistics()
+
+
+def cached_command(directory: str, command: str) -> int:
+    r"""Run a command through a CommandCache in a child process."""
+    with patch('sys.stdout', new_callable=io.StringIO):
+        return shell.CommandCache(directory).execute_command_live_output(
+            command)
+
+
 class TestFileLines(unittest.TestCase):
     r"""filelines modules test."""
 
@@ -351,6 +384,894 @@ class TestFileLines(unittest.TestCase):
         with self.assertRaises(exceptions.NegativeLineRangeError):
             self._test_helper_remove_line_interval(buff, line_from, line_to)
 
+    def test_in_place(self):
+        r"""In-place edits give the same results as full rewrites."""
+        cases = [
+            ('insert_string_at_line', ['x\n', 4, None, True, '\n']),
+            ('insert_string_at_line', ['x\n', 4, None, False, '\n']),
+            ('insert_string_at_line', ['x\n', 11, None, True, '\n']),
+            ('insert_string_at_line', ['x', 20, None, False, '\n']),
+            ('remove_line_interval', [5, 9, None]),
+            ('remove_line_interval', [1, 12, None]),
+            ('remove_line_interval', [11, 11, None]),
+        ]
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            for function, args in cases:
+                # output_file.
+                args[2] = filename
+                results = list()
+                for in_place in [False, True]:
+                    with open(filename, 'w') as f:
+                        f.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+                    getattr(filelines, function)(filename,
+                                                 *args,
+                                                 in_place=in_place)
+                    with open(filename) as f:
+                        results.append(f.read())
+                self.assertEqual(results[0], results[1])
+                self.assertFalse(
+                    os.path.exists(filename + filelines.JOURNAL_SUFFIX))
+
+            # Existing line endings are kept.
+            with open(filename, 'wb') as f:
+                f.write(b'a\r\nb\r\n')
+            filelines.insert_string_at_line(filename,
+                                            'c\n',
+                                            2,
+                                            filename,
+                                            newline_character='\r\n',
+                                            in_place=True)
+            filelines.remove_line_interval(filename,
+                                           1,
+                                           1,
+                                           filename,
+                                           in_place=True)
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), b'b\r\nc\r\n')
+
+            # Appending writes the new bytes only.
+            written = list()
+            pwrite = os.pwrite
+
+            def counting_pwrite(fd, data, offset):
+                written.append(len(data))
+                return pwrite(fd, data, offset)
+
+            with open(filename, 'w') as f:
+                f.write(FAKE_FILE_WITH_MATCHES_AS_STRING * 100)
+            with patch('os.pwrite', counting_pwrite):
+                filelines.insert_string_at_line(filename,
+                                                'last\n',
+                                                1101,
+                                                filename,
+                                                newline_character='\n',
+                                                in_place=True)
+            self.assertEqual(sum(written), len('last\n'))
+
+            with self.assertRaises(exceptions.LineOutOfFileBoundsError):
+                filelines.remove_line_interval(filename,
+                                               1,
+                                               1103,
+                                               filename,
+                                               in_place=True)
+            with self.assertRaises(ValueError):
+                filelines.remove_line_interval(filename,
+                                               1,
+                                               1,
+                                               filename + '.copy',
+                                               in_place=True)
+
+    def test_detect_newline(self):
+        r"""test_detect_newline."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            for content, expected in [
+                (b'a\nb\r\nc\r\n', '\r\n'),
+                (b'a\nb\nc\r\n', '\n'),
+                (b'a\rb\rc', '\r'),
+                (b'abc', '\n'),
+            ]:
+                with open(filename, 'wb') as f:
+                    f.write(content)
+                self.assertEqual(
+                    filelines.detect_newline(filename, default='\n'), expected)
+
+            # A carriage return cut off from its line feed is ignored.
+            with open(filename, 'wb') as f:
+                f.write(b'a\r\nb\r\n')
+            self.assertEqual(filelines.detect_newline(filename, 4), '\r\n')
+            with self.assertRaises(ValueError):
+                filelines.detect_newline(filename, 0)
+
+    def test_preserve_line_endings(self):
+        r"""Untouched lines are copied byte for byte."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            output = str(pathlib.PurePath(d, 'output'))
+            # A lone line feed still ends a line but it is not rewritten.
+            for content, newline, tail in [
+                (b'a\r\nb\nc\r\n', b'\r\n', b'c\r\n'),
+                (b'a\rb\rc\r', b'\r', b'c\r'),
+            ]:
+                for in_place in [False, True]:
+                    with open(filename, 'wb') as f:
+                        f.write(content)
+                    destination = filename if in_place else output
+                    filelines.insert_string_at_line(filename,
+                                                    'x\ny',
+                                                    5,
+                                                    destination,
+                                                    newline_character='\n',
+                                                    in_place=in_place,
+                                                    preserve_line_endings=True)
+                    with open(destination, 'rb') as f:
+                        self.assertEqual(
+                            f.read(),
+                            content + newline + b'x' + newline + b'y')
+                    filelines.remove_line_interval(destination,
+                                                   1,
+                                                   2,
+                                                   destination,
+                                                   in_place=in_place,
+                                                   preserve_line_endings=True)
+                    with open(destination, 'rb') as f:
+                        self.assertEqual(
+                            f.read(), tail + newline + b'x' + newline + b'y')
+
+    def _test_helper_compressed_file(self, compress, decompress):
+        r"""Compressed files helper."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            output = str(pathlib.PurePath(d, 'output'))
+            with open(filename, 'wb') as f:
+                f.write(compress(FAKE_FILE_WITH_MATCHES_AS_STRING.encode()))
+
+            matches, lines = filelines.get_line_matches(filename,
+                                                        '[](TOC)',
+                                                        keep_all_lines=True)
+            self.assertEqual(matches, {1: 4, 2: 10})
+            self.assertEqual(lines, FAKE_FILE_WITH_MATCHES_AS_STRING)
+
+            # The output is compressed like the input.
+            filelines.insert_string_at_line(filename, 'x\n', 1, output, False,
+                                            '\n')
+            with open(output, 'rb') as f:
+                self.assertEqual(
+                    decompress(f.read()).decode(),
+                    'x\n' + FAKE_FILE_WITH_MATCHES_AS_STRING)
+            filelines.remove_line_interval(output, 1, 4, output)
+            with open(output, 'rb') as f:
+                self.assertEqual(
+                    decompress(f.read()).decode().replace(os.linesep, '\n'),
+                    FAKE_FILE_WITH_MATCHES_AS_STRING.split('\n', 3)[3])
+
+            with self.assertRaises(ValueError):
+                filelines.remove_line_interval(filename,
+                                               1,
+                                               1,
+                                               filename,
+                                               in_place=True)
+            with self.assertRaises(ValueError):
+                filelines.insert_string_at_line(filename,
+                                                'x',
+                                                1,
+                                                output,
+                                                preserve_line_endings=True)
+
+    def test_compressed_files(self):
+        r"""test_compressed_files."""
+        for module in [gzip, bz2, lzma]:
+            self._test_helper_compressed_file(module.compress,
+                                              module.decompress)
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            with open(filename, 'wb') as f:
+                f.write(FAKE_FILE_AS_STRING.encode())
+            self.assertEqual(filelines.detect_compression(filename), str())
+
+            # Text that looks like the start of a bzip2 header.
+            expected = ({1: 2}, '[](TOC)\n')
+            with open(filename, 'w') as f:
+                f.write('BZh is a word\n[](TOC)\n')
+            self.assertEqual(filelines.detect_compression(filename), str())
+            self.assertEqual(filelines.get_line_matches(filename, '[](TOC)'),
+                             expected)
+
+            # A FIFO is read only once.
+            fifo = str(pathlib.PurePath(d, 'fifo'))
+            os.mkfifo(fifo)
+            for content in [
+                    b'abcdefgh\n[](TOC)\nxyz\n',
+                    gzip.compress(b'abcdefgh\n[](TOC)\nxyz\n')
+            ]:
+
+                def write():
+                    with open(fifo, 'wb') as f:
+                        f.write(content)
+
+                writer = threading.Thread(target=write)
+                writer.start()
+                self.assertEqual(filelines.get_line_matches(fifo, '[](TOC)'),
+                                 expected)
+                writer.join()
+
+    @unittest.skipUnless(importlib.util.find_spec('zstandard'),
+                         'zstandard is not installed')
+    def test_compressed_files_zstd(self):
+        r"""test_compressed_files_zstd."""
+        import zstandard
+
+        def decompress(data):
+            decompressor = zstandard.ZstdDecompressor().decompressobj()
+            return decompressor.decompress(data)
+
+        self._test_helper_compressed_file(zstandard.ZstdCompressor().compress,
+                                          decompress)
+
+    def test_line_match_follower(self):
+        r"""test_line_match_follower."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            for use_inotify in [True, False]:
+                with open(filename, 'w') as f:
+                    f.write(FAKE_FILE_WITH_MATCHES_AS_STRING + '[](TOC)')
+                with filelines.LineMatchFollower(
+                        filename,
+                        '[](TOC)',
+                        use_inotify=use_inotify,
+                        poll_interval=0.01) as follower:
+                    self.assertEqual(follower.check(), {1: 4, 2: 10})
+                    self.assertEqual(follower.lines, 11)
+                    self.assertFalse(follower.wait(0.05))
+
+                    # Only the appended data is read. The last line
+                    # is now complete.
+                    with open(filename, 'a') as f:
+                        f.write('\nfoo\n[](TOC)\n')
+                    self.assertTrue(follower.wait(5))
+                    with patch('os.pread', wraps=os.pread) as pread:
+                        self.assertEqual(follower.check(), {3: 12, 4: 14})
+                    self.assertEqual(pread.call_args[0][1],
+                                     len('\nfoo\n[](TOC)\n'))
+                    self.assertEqual(follower.check(), dict())
+
+                    # Rotation.
+                    os.rename(filename, filename + '.1')
+                    with open(filename, 'w') as f:
+                        f.write('[](TOC)\n')
+                    self.assertTrue(follower.wait(5))
+                    self.assertEqual(follower.check(), {1: 1})
+
+                    # Truncation.
+                    with open(filename, 'w') as f:
+                        f.write(str())
+                    self.assertEqual(follower.check(), dict())
+                    self.assertEqual(follower.resets, 2)
+                    self.assertEqual(follower.offset, 0)
+
+    def test_line_match_cache(self):
+        r"""test_line_match_cache."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            with open(filename, 'w') as f:
+                f.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+            # Old enough to be cached.
+            os.utime(filename, (1000000000, 1000000000))
+            expected = filelines.get_line_matches(filename, '[](TOC)')
+
+            cache = filelines.LineMatchCache(directory=d)
+            self.assertEqual(cache.get_line_matches(filename, '[](TOC)'),
+                             expected)
+            # A hit only needs a stat call.
+            with patch('builtins.open') as o, patch('os.stat',
+                                                    wraps=os.stat) as st:
+                matches, lines = cache.get_line_matches(filename, '[](TOC)')
+            o.assert_not_called()
+            self.assertEqual(st.call_count, 1)
+            self.assertEqual((matches, lines), expected)
+            # Results are copies.
+            matches[1] = 0
+            self.assertEqual(cache.get_line_matches(filename, '[](TOC)'),
+                             expected)
+            self.assertEqual(
+                cache.get_line_matches(filename, '[](TOC)', 1),
+                filelines.get_line_matches(filename, '[](TOC)', 1))
+
+            statistics = cache.statistics()
+            self.assertEqual(statistics['hits'], 2)
+            self.assertEqual(statistics['misses'], 2)
+            self.assertEqual(statistics['entries'], 2)
+
+            # The directory is shared with other caches.
+            other = filelines.LineMatchCache(max_entries=1, directory=d)
+            self.assertEqual(other.get_line_matches(filename, '[](TOC)'),
+                             expected)
+            other.get_line_matches(filename, '[](TOC)', 1)
+            statistics = other.statistics()
+            self.assertEqual(statistics['disk_hits'], 2)
+            self.assertEqual(statistics['misses'], 0)
+            self.assertEqual(statistics['entries'], 1)
+
+            # A change invalidates the results.
+            with open(filename, 'a') as f:
+                f.write('[](TOC)\n')
+            os.utime(filename, (1000000001, 1000000001))
+            self.assertEqual(cache.get_line_matches(filename, '[](TOC)'),
+                             filelines.get_line_matches(filename, '[](TOC)'))
+            self.assertEqual(cache.statistics()['misses'], 3)
+
+            # Files changed right now are not cached.
+            with open(filename, 'a') as f:
+                f.write('[](TOC)\n')
+            cache.clear()
+            cache.get_line_matches(filename, '[](TOC)')
+            cache.get_line_matches(filename, '[](TOC)')
+            self.assertEqual(cache.statistics()['misses'], 5)
+
+            # Hard links share the results.
+            link = str(pathlib.PurePath(d, 'link'))
+            os.link(filename, link)
+            os.utime(filename, (1000000000, 1000000000))
+            cache.get_line_matches(filename, '[](TOC)')
+            misses = cache.statistics()['misses']
+            cache.get_line_matches(link, '[](TOC)')
+            self.assertEqual(cache.statistics()['misses'], misses)
+
+            # The directory is bounded.
+            size = max(
+                os.path.getsize(e.path) for e in os.scandir(d)
+                if e.name.endswith('.json'))
+            bounded = filelines.LineMatchCache(directory=d,
+                                               max_disk_bytes=2 * size)
+            for i in range(4):
+                bounded.get_line_matches(filename, '[](TOC)', i)
+            self.assertLessEqual(
+                len([e for e in os.listdir(d) if e.endswith('.json')]), 2)
+
+            with self.assertRaises(ValueError):
+                filelines.LineMatchCache(max_entries=0)
+            with self.assertRaises(ValueError):
+                filelines.LineMatchCache(max_disk_bytes=0)
+
+    def test_file_edit_coordinator(self):
+        r"""test_file_edit_coordinator."""
+        import fcntl
+
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            with open(filename, 'w') as f:
+                f.write(FAKE_FILE_AS_STRING)
+
+            with filelines.FileEditCoordinator(
+                    newline_character='\n') as coordinator:
+                # Hold the lock like another process would: the edits
+                # queue up and are merged.
+                with open(filename + filelines.LOCK_SUFFIX, 'a') as lock:
+                    fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                    futures = [
+                        coordinator.insert_string_at_line(
+                            filename,
+                            str(i) + '\n', 1, False) for i in range(100)
+                    ]
+                    removal = coordinator.remove_line_interval(filename, 1, 50)
+                    failure = coordinator.remove_line_interval(
+                        filename, 200, 200)
+                for future in futures + [removal]:
+                    self.assertIsNone(future.result(timeout=10))
+                with self.assertRaises(exceptions.LineOutOfFileBoundsError):
+                    failure.result(timeout=10)
+                statistics = coordinator.statistics()
+                self.assertEqual(statistics['edits'], 102)
+                self.assertLessEqual(statistics['rewrites'], 2)
+
+                with self.assertRaises(ValueError):
+                    coordinator.insert_string_at_line(filename, 'x', 0)
+                with self.assertRaises(exceptions.NegativeLineRangeError):
+                    coordinator.remove_line_interval(filename, 2, 1)
+            with self.assertRaises(RuntimeError):
+                coordinator.insert_string_at_line(filename, 'x', 1)
+
+            with open(filename) as f:
+                self.assertEqual(
+                    f.read(),
+                    ''.join(str(i) + '\n'
+                            for i in range(49, -1, -1)) + FAKE_FILE_AS_STRING)
+
+            # No edit is lost between processes.
+            with concurrent.futures.ProcessPoolExecutor(max_workers=2) as e:
+                list(
+                    e.map(coordinated_inserts, [filename] * 2, ['a', 'b'],
+                          [50, 50]))
+            with open(filename) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(len(lines), 50 + 2 + 100)
+            self.assertEqual(len([x for x in lines if x[0] in 'ab']), 100)
+
+            # Failed edits do not rewrite the file. Lock files can be kept
+            # apart.
+            locks = str(pathlib.PurePath(d, 'locks'))
+            os.mkdir(locks)
+            os.remove(filename + filelines.LOCK_SUFFIX)
+            with filelines.FileEditCoordinator(
+                    lock_directory=locks) as coordinator:
+                with self.assertRaises(exceptions.LineOutOfFileBoundsError):
+                    coordinator.remove_line_interval(filename, 500,
+                                                     500).result(timeout=10)
+                self.assertEqual(coordinator.statistics(), {
+                    'edits': 1,
+                    'rewrites': 0
+                })
+            self.assertEqual(len(os.listdir(locks)), 1)
+            self.assertFalse(os.path.exists(filename + filelines.LOCK_SUFFIX))
+
+    def test_find_line_matches(self):
+        r"""test_find_line_matches."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            for content in [
+                    FAKE_FILE_WITH_MATCHES_AS_STRING,
+                    FAKE_FILE_WITH_MATCHES_AS_STRING.replace('\n', '\r\n'),
+                    FAKE_FILE_WITH_MATCHES_AS_STRING.replace('\n', '\r'),
+                    'a\r[](TOC)\rb\n[](TOC)\r\n \r[](TOC) \r',
+                    FAKE_FILE_WITH_MATCHES_AS_STRING * 100
+            ]:
+                with open(filename, 'w', newline='') as f:
+                    f.write(content)
+                for pattern, max_occurrencies, loose_matching in [
+                    ('[](TOC)', 0, True),
+                    ('[](TOC)', 1, True),
+                    ('[](TOC)\n', 0, False),
+                    ('[](TOC)', 0, False),
+                    (str(), 0, True),
+                ]:
+                    expected = filelines.get_line_matches(
+                        filename, pattern, max_occurrencies, loose_matching)
+                    matches = filelines.find_line_matches(
+                        filename, pattern, max_occurrencies, loose_matching)
+                    self.assertEqual(matches, expected[0])
+                    self.assertEqual(dict(matches), expected[0])
+                    self.assertEqual(matches.text(), expected[1])
+
+            matches = filelines.find_line_matches(filename, '[](TOC)')
+            self.assertEqual(len(matches), 200)
+            self.assertEqual(matches.line_numbers.itemsize, 8)
+            self.assertEqual(matches[2], 10)
+            self.assertEqual(matches.line(2), '[](TOC)\n')
+            self.assertEqual(list(matches.lines())[:2], ['[](TOC)\n'] * 2)
+            self.assertEqual(matches.offsets[0],
+                             FAKE_FILE_WITH_MATCHES_AS_STRING.index('[](TOC)'))
+            with self.assertRaises(KeyError):
+                matches[0]
+            with self.assertRaises(KeyError):
+                matches.line(201)
+
+            with open(filename, 'wb') as f:
+                f.write(gzip.compress(b'[](TOC)\n'))
+            with self.assertRaises(ValueError):
+                filelines.find_line_matches(filename, '[](TOC)')
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'),
+                         'NumPy is not installed')
+    def test_find_line_matches_numpy(self):
+        r"""test_find_line_matches_numpy."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            with open(filename, 'w') as f:
+                f.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+            matches = filelines.find_line_matches(filename, '[](TOC)')
+            self.assertEqual(matches.to_numpy().tolist(), [4, 10])
+            self.assertEqual(
+                matches.to_numpy('offsets').tolist(), list(matches.offsets))
+            self.assertFalse(matches.to_numpy().flags.writeable)
+            with self.assertRaises(ValueError):
+                matches.to_numpy('lines')
+
+    def test_read_line_range(self):
+        r"""test_read_line_range."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            lines = FAKE_FILE_WITH_MATCHES_AS_STRING.splitlines(keepends=True)
+            for content in [
+                    FAKE_FILE_WITH_MATCHES_AS_STRING,
+                    FAKE_FILE_WITH_MATCHES_AS_STRING.replace('\n', '\r\n'),
+            ]:
+                with open(filename, 'w', newline='') as f:
+                    f.write(content)
+                index = filelines.build_line_index(filename, 3)
+                self.assertEqual(index.lines, 11)
+                self.assertEqual(len(index.offsets), 4)
+                for line_from, line_to in [(1, 1), (1, 11), (3, 7), (4, 4),
+                                           (10, 20), (12, 13)]:
+                    expected = lines[line_from - 1:line_to]
+                    self.assertEqual(
+                        list(
+                            filelines.read_line_range(filename, line_from,
+                                                      line_to)), expected)
+                    self.assertEqual(
+                        list(
+                            filelines.read_line_range(filename, line_from,
+                                                      line_to, index)),
+                        expected)
+
+            self.assertEqual(index.checkpoint(1), (1, 0))
+            self.assertEqual(index.checkpoint(6),
+                             (4, len(''.join(lines[:3])) + 3))
+
+            # Appending a partial line, then completing it.
+            with open(filename, 'a') as f:
+                f.write('new')
+            self.assertEqual(
+                list(filelines.read_line_range(filename, 11, 12, index)),
+                ['End of toc\n', 'new'])
+            index.update()
+            self.assertEqual(index.lines, 12)
+            self.assertEqual(len(index.offsets), 4)
+            with open(filename, 'a') as f:
+                f.write(' line\nlast\n')
+            index.update()
+            self.assertEqual(index.lines, 13)
+            self.assertEqual(len(index.offsets), 5)
+            self.assertEqual(
+                list(filelines.read_line_range(filename, 11, 13, index)),
+                ['End of toc\n', 'new line\n', 'last\n'])
+
+            # A truncated file makes the index stale.
+            with open(filename, 'w') as f:
+                f.write('# One\n')
+            with self.assertRaises(ValueError):
+                filelines.read_line_range(filename, 1, 1, index)
+            index.update()
+            self.assertEqual(
+                list(filelines.read_line_range(filename, 1, 2, index)),
+                ['# One\n'])
+
+            with self.assertRaises(ValueError):
+                filelines.read_line_range(filename, 0, 1)
+            with self.assertRaises(ValueError):
+                filelines.build_line_index(filename, 0)
+            with self.assertRaises(exceptions.NegativeLineRangeError):
+                filelines.read_line_range(filename, 2, 1)
+
+    def test_substitute_lines(self):
+        r"""test_substitute_lines."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            output = str(pathlib.PurePath(d, 'output'))
+            content = FAKE_FILE_WITH_MATCHES_AS_STRING.replace(
+                '[](TOC)\n', ' [](TOC)\r\n', 1)
+            for pattern, replacement, max_occurrencies, loose_matching, expected in [
+                ('[](TOC)', 'toc', 0, True,
+                 content.replace(' [](TOC)\r\n',
+                                 'toc\r\n').replace('[](TOC)\n', 'toc\n')),
+                ('[](TOC)', 'toc', 1, True,
+                 content.replace(' [](TOC)\r\n', 'toc\r\n')),
+                ('[](TOC)\n', 'a\nb', 0, False,
+                 content.replace('[](TOC)\n', 'a\nb\n', 2)),
+                ('[](TOC)', 'toc', 0, False, content),
+                ('End of toc', 'end', 0, False, content),
+            ]:
+                with open(filename, 'w', newline='') as f:
+                    f.write(content)
+                self.assertEqual(
+                    filelines.substitute_lines(filename, pattern, replacement,
+                                               output, max_occurrencies,
+                                               loose_matching),
+                    len(
+                        filelines.get_line_matches(filename, pattern,
+                                                   max_occurrencies,
+                                                   loose_matching)[0]))
+                with open(output, newline='') as f:
+                    self.assertEqual(f.read(), expected)
+
+            # The last line without newline, replaced in place.
+            with open(filename, 'w') as f:
+                f.write('# One\n[](TOC)')
+            self.assertEqual(
+                filelines.substitute_lines(filename, '[](TOC)', 'a\nb',
+                                           filename, 0, False), 1)
+            with open(filename) as f:
+                self.assertEqual(f.read(), '# One\na\nb')
+
+            with gzip.open(filename, 'wt') as f:
+                f.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+            self.assertEqual(
+                filelines.substitute_lines(filename, '[](TOC)', 'toc',
+                                           filename), 2)
+            with gzip.open(filename, 'rt') as f:
+                self.assertEqual(
+                    f.read(),
+                    FAKE_FILE_WITH_MATCHES_AS_STRING.replace('[](TOC)', 'toc'))
+
+            with self.assertRaises(ValueError):
+                filelines.substitute_lines(filename, '[](TOC)', 'toc',
+                                           filename, -1)
+
+            # Many files.
+            filenames = [
+                str(pathlib.PurePath(d, 'testing' + str(i))) for i in range(8)
+            ]
+            for i, f in enumerate(filenames):
+                with open(f, 'w') as g:
+                    g.write(FAKE_FILE_WITH_MATCHES_AS_STRING * i)
+            self.assertEqual(
+                filelines.substitute_lines_in_files(filenames + filenames[:1],
+                                                    '[](TOC)', 'toc', 0, True,
+                                                    3),
+                {f: 2 * i
+                 for i, f in enumerate(filenames)})
+            for i, f in enumerate(filenames):
+                with open(f) as g:
+                    self.assertEqual(
+                        g.read(),
+                        FAKE_FILE_WITH_MATCHES_AS_STRING.replace(
+                            '[](TOC)', 'toc') * i)
+
+            missing = str(pathlib.PurePath(d, 'missing'))
+            with self.assertRaises(FileNotFoundError):
+                filelines.substitute_lines_in_files([missing] + filenames,
+                                                    'toc', '[](TOC)')
+            with open(filenames[1]) as f:
+                self.assertEqual(f.read(), FAKE_FILE_WITH_MATCHES_AS_STRING)
+            with self.assertRaises(ValueError):
+                filelines.substitute_lines_in_files(filenames,
+                                                    'toc',
+                                                    '[](TOC)',
+                                                    max_workers=0)
+
+    def test_sort_lines(self):
+        r"""test_sort_lines."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            output = str(pathlib.PurePath(d, 'output'))
+            directory = str(pathlib.PurePath(d, 'runs'))
+            os.mkdir(directory)
+            lines = FAKE_FILE_WITH_MATCHES_AS_STRING.split('\n')[:-1] * 3
+            content = '\r\n'.join(lines)
+
+            for unique, reverse in [(False, False), (True, False),
+                                    (False, True), (True, True)]:
+                expected = sorted(set(lines) if unique else lines,
+                                  reverse=reverse)
+                # In memory and with runs merged in several passes.
+                for memory_limit in [1024 * 1024, 64]:
+                    with open(filename, 'w', newline='') as f:
+                        f.write(content)
+                    with patch.object(filelines, 'SORT_MERGE_FAN_IN', 3):
+                        self.assertEqual(
+                            filelines.sort_lines(filename, output, unique,
+                                                 reverse, memory_limit,
+                                                 directory, 2, '\n'),
+                            len(expected))
+                    with open(output, newline='') as f:
+                        self.assertEqual(f.read(),
+                                         ''.join(x + '\n' for x in expected))
+                    self.assertEqual(os.listdir(directory), list())
+
+            # Up to half of memory_limit, without a process pool.
+            with patch('concurrent.futures.ProcessPoolExecutor',
+                       side_effect=AssertionError):
+                self.assertEqual(
+                    filelines.sort_lines(filename, output, False, False,
+                                         2 * len(content), directory, 1, '\n'),
+                    len(lines))
+                with self.assertRaises(AssertionError):
+                    filelines.sort_lines(filename, output, False, False,
+                                         len(content), directory, 1, '\n')
+
+            # In place and compressed.
+            with gzip.open(filename, 'wt') as f:
+                f.write('b\na\nb\n')
+            self.assertEqual(
+                filelines.sort_lines(filename,
+                                     filename,
+                                     unique=True,
+                                     newline_character='\n'), 2)
+            with gzip.open(filename, 'rt') as f:
+                self.assertEqual(f.read(), 'a\nb\n')
+
+            with open(filename, 'w') as f:
+                f.write(str())
+            self.assertEqual(filelines.sort_lines(filename, output), 0)
+            with open(output) as f:
+                self.assertEqual(f.read(), str())
+
+            with self.assertRaises(ValueError):
+                filelines.sort_lines(filename, output, memory_limit=0)
+            with self.assertRaises(ValueError):
+                filelines.sort_lines(filename, output, max_workers=0)
+
+    def test_file_transaction(self):
+        r"""test_file_transaction."""
+        with tempfile.TemporaryDirectory() as d:
+            filenames = [
+                str(pathlib.PurePath(d, 'testing' + str(i))) for i in range(4)
+            ]
+            expected = FAKE_FILE_WITH_MATCHES_AS_STRING.replace(
+                '[](TOC)\nThis is some more content\n', 'toc\n')
+
+            def reset():
+                for f in filenames:
+                    with open(f, 'w') as g:
+                        g.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+                os.chmod(filenames[0], 0o640)
+
+            def edit(transaction):
+                for f in filenames:
+                    transaction.remove_line_interval(f, 4, 5)
+                    transaction.insert_string_at_line(f, 'toc\n', 3)
+
+            def contents():
+                result = list()
+                for f in filenames:
+                    with open(f) as g:
+                        result.append(g.read())
+                return result
+
+            reset()
+            with filelines.FileTransaction('\n') as t:
+                edit(t)
+                self.assertEqual(contents(),
+                                 [FAKE_FILE_WITH_MATCHES_AS_STRING] * 4)
+                self.assertEqual(t.files, filenames)
+            self.assertEqual(contents(), [expected] * 4)
+            self.assertEqual(t.statistics(), {
+                'edits': 8,
+                'files': 4,
+                'syncs': 2
+            })
+            self.assertEqual(os.stat(filenames[0]).st_mode & 0o777, 0o640)
+            self.assertEqual(sorted(os.listdir(d)),
+                             [pathlib.PurePath(f).name for f in filenames])
+            with self.assertRaises(RuntimeError):
+                t.insert_string_at_line(filenames[0], 'toc\n', 1)
+            with self.assertRaises(RuntimeError):
+                t.commit()
+
+            # A failed block.
+            reset()
+            with self.assertRaises(exceptions.LineOutOfFileBoundsError):
+                with filelines.FileTransaction('\n') as t:
+                    edit(t)
+                    t.remove_line_interval(filenames[0], 20, 21)
+            self.assertEqual(contents(),
+                             [FAKE_FILE_WITH_MATCHES_AS_STRING] * 4)
+            self.assertEqual(len(os.listdir(d)), 4)
+
+            # A failed rename restores the replaced files.
+            replace = os.replace
+
+            def failing_replace(src, dst):
+                if dst == filenames[2]:
+                    raise OSError
+                replace(src, dst)
+
+            t = filelines.FileTransaction('\n')
+            edit(t)
+            with patch('os.replace', failing_replace):
+                with self.assertRaises(OSError):
+                    t.commit()
+            self.assertEqual(contents(),
+                             [FAKE_FILE_WITH_MATCHES_AS_STRING] * 4)
+            self.assertEqual(len(os.listdir(d)), 4)
+
+            # A failed directory sync leaves no backup behind.
+            sync_paths = filelines._sync_paths
+
+            def failing_sync_paths(paths):
+                paths = list(paths)
+                if paths == [d]:
+                    raise OSError
+                return sync_paths(paths)
+
+            t = filelines.FileTransaction('\n')
+            edit(t)
+            with patch.object(filelines, '_sync_paths', failing_sync_paths):
+                with self.assertRaises(OSError):
+                    t.commit()
+            self.assertEqual(contents(), [expected] * 4)
+            self.assertEqual(t.statistics()['files'], 4)
+            self.assertEqual(len(os.listdir(d)), 4)
+            reset()
+
+            # Without syncfs.
+            with patch.object(filelines, '_syncfs', return_value=False):
+                with filelines.FileTransaction('\n') as t:
+                    edit(t)
+            self.assertEqual(contents(), [expected] * 4)
+            self.assertEqual(t.statistics()['syncs'], 5)
+
+            with gzip.open(filenames[0], 'wt') as f:
+                f.write(FAKE_FILE_WITH_MATCHES_AS_STRING)
+            with filelines.FileTransaction('\n') as t:
+                t.remove_line_interval(filenames[0], 4, 5)
+                t.insert_string_at_line(filenames[0], 'toc\n', 3)
+            with gzip.open(filenames[0], 'rt') as f:
+                self.assertEqual(f.read(), expected)
+
+    def test_recover_in_place_edit(self):
+        r"""test_recover_in_place_edit."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            original = FAKE_FILE_WITH_MATCHES_AS_STRING.encode('UTF-8')
+            with open(filename, 'wb') as f:
+                f.write(original)
+            self.assertFalse(filelines.recover_in_place_edit(filename))
+
+            # Fail in the middle of the shift: the edit is undone.
+            filelines.BLOCK_SIZE, block_size = 4, filelines.BLOCK_SIZE
+            pwrite = os.pwrite
+            calls = {'n': 0}
+
+            def failing_pwrite(fd, data, offset):
+                calls['n'] += 1
+                if calls['n'] == 4:
+                    raise OSError
+                return pwrite(fd, data, offset)
+
+            try:
+                with patch('os.pwrite', failing_pwrite):
+                    with self.assertRaises(OSError):
+                        filelines.remove_line_interval(filename,
+                                                       2,
+                                                       2,
+                                                       filename,
+                                                       in_place=True)
+            finally:
+                filelines.BLOCK_SIZE = block_size
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), original)
+            self.assertFalse(
+                os.path.exists(filename + filelines.JOURNAL_SUFFIX))
+
+            # A journal left behind by a crash.
+            with open(filename + filelines.JOURNAL_SUFFIX, 'wb') as f:
+                f.write(b'4 ' + str(len(original)).encode('ascii') + b'\n' +
+                        original[4:])
+            with open(filename, 'wb') as f:
+                f.write(original[:4] + b'garbage')
+            self.assertTrue(filelines.recover_in_place_edit(filename))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), original)
+
+            # Journals interrupted while they were written: the file was
+            # not modified yet.
+            header = b'4 ' + str(len(original)).encode('ascii') + b'\n'
+            for journal in [b'', b'4', header, header + original[4:10]]:
+                with open(filename + filelines.JOURNAL_SUFFIX, 'wb') as f:
+                    f.write(journal)
+                self.assertFalse(filelines.recover_in_place_edit(filename))
+                self.assertFalse(
+                    os.path.exists(filename + filelines.JOURNAL_SUFFIX))
+                with open(filename, 'rb') as f:
+                    self.assertEqual(f.read(), original)
+
+            # The journal and its directory are synced before the edit.
+            fsync = os.fsync
+            synced = list()
+
+            def recording_fsync(fd):
+                synced.append(
+                    os.path.exists(filename + filelines.JOURNAL_SUFFIX))
+                return fsync(fd)
+
+            with patch('os.fsync',
+                       recording_fsync), patch('os.pwrite',
+                                               side_effect=OSError) as p:
+                with self.assertRaises(OSError):
+                    filelines.remove_line_interval(filename,
+                                                   2,
+                                                   2,
+                                                   filename,
+                                                   in_place=True)
+            p.assert_called()
+            self.assertEqual(synced[:2], [True, True])
+            # The undo failed as well: the next call recovers the file.
+            self.assertTrue(filelines.recover_in_place_edit(filename))
+            with open(filename, 'rb') as f:
+                self.assertEqual(f.read(), original)
+
 
 class TestShell(unittest.TestCase):
     """shell modules test."""
@@ -400,6 +1321,164 @@ class TestShell(unittest.TestCase):
             '/bin/bash: line 1: falsse: command not found\n'
         ], [127])
 
+    def test_execute_command_live_output_log_files(self):
+        r"""test_execute_command_live_output_log_files."""
+        command = 'printf "one\\ntwo"; echo " three" >&2; exit 3'
+        expected = 'one\ntwo three\n'
+        with tempfile.TemporaryDirectory() as d:
+            console = str(pathlib.PurePath(d, 'console'))
+            logs = [str(pathlib.PurePath(d, 'log' + str(i))) for i in range(2)]
+            with open(logs[0], 'w') as f:
+                f.write('previous\n')
+
+            # The standard output as a file descriptor. The log files are
+            # appended to.
+            for _ in range(2):
+                with open(console, 'w') as f:
+                    with patch('sys.stdout', f):
+                        self.assertEqual(
+                            shell.execute_command_live_output(command,
+                                                              log_files=logs),
+                            3)
+                with open(console) as f:
+                    self.assertEqual(f.read(), expected)
+            with open(logs[0]) as f:
+                self.assertEqual(f.read(), 'previous\n' + expected * 2)
+            with open(logs[1]) as f:
+                self.assertEqual(f.read(), expected * 2)
+
+            # The standard output without file descriptor.
+            with patch('sys.stdout', new_callable=io.StringIO) as f:
+                self.assertEqual(
+                    shell.execute_command_live_output(
+                        'printf "\\xc3"; '
+                        'printf "\\xa8"',
+                        log_files=logs[1:]), 0)
+            self.assertEqual(f.getvalue(), 'è')
+            with open(logs[1], 'rb') as f:
+                self.assertEqual(f.read(), expected.encode() * 2 + b'\xc3\xa8')
+
+            # Dry runs do not write to the log files.
+            with patch('sys.stdout', new_callable=io.StringIO) as f:
+                shell.execute_command_live_output('true',
+                                                  dry_run=True,
+                                                  log_files=logs[1:])
+            with open(logs[1], 'rb') as f:
+                self.assertEqual(len(f.read()), 2 * len(expected) + 2)
+
+            # Concurrent writers do not overwrite each other.
+            size = 4 * shell.BLOCK_SIZE
+            commands = [
+                'head -c ' + str(size) + ' /dev/zero | tr "\\0" ' + c
+                for c in 'ab'
+            ]
+            os.remove(logs[0])
+            with open(os.devnull, 'w') as f:
+                with patch('sys.stdout', f):
+                    with concurrent.futures.ThreadPoolExecutor(
+                            max_workers=2) as e:
+                        list(
+                            e.map(
+                                functools.partial(
+                                    shell.execute_command_live_output,
+                                    log_files=logs[:1]), commands))
+            with open(logs[0], 'rb') as f:
+                content = f.read()
+            self.assertEqual(content.count(b'a'), size)
+            self.assertEqual(content.count(b'b'), size)
+
+    def test_command_cache(self):
+        r"""test_command_cache."""
+        command = 'echo run >> "$RUNS"; printf "out"; echo " err" >&2; exit 3'
+        with tempfile.TemporaryDirectory() as d:
+            directory = str(pathlib.PurePath(d, 'cache'))
+            runs = str(pathlib.PurePath(d, 'runs'))
+            log = str(pathlib.PurePath(d, 'log'))
+            input_file = str(pathlib.PurePath(d, 'input'))
+            with open(input_file, 'w') as f:
+                f.write('one')
+            cache = shell.CommandCache(directory, cache_failures=True)
+
+            def execute(log_files=None):
+                with patch('sys.stdout',
+                           new_callable=io.StringIO) as stdout, patch.dict(
+                               os.environ, {'RUNS': runs}):
+                    retval = cache.execute_command_live_output(
+                        command,
+                        log_files=log_files,
+                        input_files=[input_file],
+                        environment_variables=['RUNS', 'FPYUTILS_TEST'])
+                return retval, stdout.getvalue()
+
+            def count_runs():
+                with open(runs) as f:
+                    return len(f.readlines())
+
+            self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(execute([log]), (3, 'out err\n'))
+            self.assertEqual(count_runs(), 1)
+            with open(log) as f:
+                self.assertEqual(f.read(), 'out err\n')
+
+            # Changed inputs.
+            with open(input_file, 'w') as f:
+                f.write('two')
+            self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(count_runs(), 2)
+            with patch.dict(os.environ, {'FPYUTILS_TEST': '1'}):
+                self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(count_runs(), 3)
+            self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(count_runs(), 3)
+            statistics = cache.statistics()
+            self.assertEqual((statistics['hits'], statistics['misses'],
+                              statistics['entries']), (2, 3, 3))
+
+            # Dry runs are not cached.
+            with patch('sys.stdout', new_callable=io.StringIO) as stdout:
+                self.assertEqual(
+                    cache.execute_command_live_output('false', dry_run=True),
+                    0)
+            self.assertEqual(stdout.getvalue(), '/bin/bash -c false\n')
+
+            # Failures are not stored by default.
+            cache = shell.CommandCache(directory)
+            with open(input_file, 'w') as f:
+                f.write('four')
+            self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(execute(), (3, 'out err\n'))
+            self.assertEqual(count_runs(), 5)
+            self.assertEqual(len(os.listdir(directory)), 3)
+            with open(input_file, 'w') as f:
+                f.write('two')
+
+            # The least recently used results are evicted.
+            size = statistics['bytes'] // 3
+            cache = shell.CommandCache(directory, 2 * size, True)
+            execute()
+            with open(input_file, 'w') as f:
+                f.write('three')
+            execute()
+            self.assertEqual(count_runs(), 6)
+            self.assertEqual(cache.statistics()['entries'], 2)
+            with open(input_file, 'w') as f:
+                f.write('two')
+            execute()
+            self.assertEqual(count_runs(), 6)
+            cache.clear()
+            self.assertEqual(cache.statistics()['entries'], 0)
+
+            # Concurrent processes.
+            with concurrent.futures.ProcessPoolExecutor(4) as executor:
+                retvals = list(
+                    executor.map(cached_command, [directory] * 8,
+                                 ['printf out'] * 8))
+            self.assertEqual(retvals, [0] * 8)
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            with self.assertRaises(ValueError):
+                shell.CommandCache(directory, 0)
+
 
 class TestPath(unittest.TestCase):
     r"""path modules test."""
@@ -432,6 +1511,116 @@ class TestPath(unittest.TestCase):
                     date_component_format=date_component_format,
                     component_separator=component_separator)))
 
+    def test_gen_pseudorandom_paths(self):
+        r"""test_gen_pseudorandom_paths."""
+        path_suffix = '1234567890'
+        paths = path.gen_pseudorandom_paths(1000,
+                                            path_suffix=path_suffix,
+                                            date_component_format='%F')
+        self.assertEqual(len(paths), 1000)
+        self.assertEqual(len(set(paths)), 1000)
+        for p in paths:
+            self.assertEqual(len(p), 10 + 1 + 6 + 1 + 6 + 1 + len(path_suffix))
+            self.assertTrue(p.endswith('_' + path_suffix))
+        # Same format as the single path generator.
+        single = path.gen_pseudorandom_path(path_suffix=path_suffix,
+                                            date_component_format='%F')
+        self.assertEqual(paths[0][:11], single[:11])
+        self.assertEqual(paths[0][18:], single[18:])
+
+        # Every possible 1 byte component is drawn.
+        paths = path.gen_pseudorandom_paths(256,
+                                            pseudorandom_component_bytes=1)
+        self.assertEqual(len(set(paths)), 256)
+        with self.assertRaises(ValueError):
+            path.gen_pseudorandom_paths(257, pseudorandom_component_bytes=1)
+        self.assertEqual(path.gen_pseudorandom_paths(0), list())
+
+        # Batches do not collide with each other in unique mode.
+        paths = list()
+        for _ in range(20):
+            paths += path.gen_pseudorandom_paths(
+                256,
+                date_component_format='%F',
+                pseudorandom_component_bytes=1,
+                unique=True)
+        self.assertEqual(len(set(paths)), 20 * 256)
+        self.assertEqual(paths[0].split('_')[1], format(os.getpid(), 'x'))
+
+    def test_pseudorandom_path_generator(self):
+        r"""test_pseudorandom_path_generator."""
+        path._hashed_component.cache_clear()
+        g = path.PseudorandomPathGenerator(date_component_format='%F',
+                                           component_separator='-')
+        paths = [g('1234567890') for _ in range(10)]
+        for p in paths:
+            self.assertEqual(len(p), 10 + 1 + 6 + 1 + 6 + 1 + 10)
+            hashed_component = path._hashed_component('1234567890', 'UTF-8', 3)
+            self.assertTrue(p.endswith('-' + hashed_component + '-1234567890'))
+        self.assertEqual(len(g()), 10 + 1 + 6 + 1 + 6)
+
+        # The hash of a repeated suffix is computed once.
+        info = path._hashed_component.cache_info()
+        self.assertEqual(info.misses, 2)
+        path.gen_pseudorandom_path(path_suffix='1234567890')
+        self.assertEqual(path._hashed_component.cache_info().misses, 2)
+
+        self.assertEqual(path._hashed_component(str(), 'UTF-8', 3), 'cec7ea')
+
+        paths = g.generate_many(5, 'x')
+        self.assertEqual(len(set(paths)), 5)
+        self.assertTrue(all(p.endswith('-x') for p in paths))
+
+        g = path.PseudorandomPathGenerator(date_component_format='%F',
+                                           component_separator='-',
+                                           unique=True)
+        paths = g.generate_many(3) + g.generate_many(3)
+        # The date, the PID and the counter of each batch.
+        components = [p.split('-')[:5] for p in paths]
+        pid = format(os.getpid(), 'x')
+        self.assertEqual({c[3] for c in components}, {pid})
+        self.assertEqual(len({c[4] for c in components}), 2)
+
+    def test_gen_pseudorandom_path_unique(self):
+        r"""test_gen_pseudorandom_path_unique."""
+        # A single pseudorandom byte would collide often without the
+        # unique component.
+        generate = functools.partial(path.gen_pseudorandom_path,
+                                     date_component_format='%F',
+                                     pseudorandom_component_bytes=1,
+                                     unique=True)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as e:
+            paths = list(e.map(generate, [str()] * 2000))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=2) as e:
+            paths += list(e.map(generate, [str()] * 200, chunksize=10))
+        self.assertEqual(len(set(paths)), len(paths))
+        self.assertTrue(paths[0].startswith(paths[0][:10] + '_' +
+                                            format(os.getpid(), 'x') + '_'))
+
+        g = path.PseudorandomPathGenerator(pseudorandom_component_bytes=1,
+                                           unique=True)
+        paths = [g('x') for _ in range(1000)]
+        self.assertEqual(len(set(paths)), len(paths))
+
+    def test_create_unique_file(self):
+        r"""test_create_unique_file."""
+        with tempfile.TemporaryDirectory() as d:
+            files = {path.create_unique_file(d, 'log') for _ in range(100)}
+            self.assertEqual(len(files), 100)
+            for f in files:
+                self.assertTrue(f.endswith('_log'))
+                self.assertEqual(os.stat(f).st_size, 0)
+                self.assertEqual(os.stat(f).st_mode & 0o777, 0o600)
+
+            # Existing files are never reused.
+            with patch('fpyutils.path.gen_pseudorandom_path',
+                       return_value='existing'):
+                pathlib.Path(d, 'existing').write_text('data')
+                with self.assertRaises(FileExistsError):
+                    path.create_unique_file(d, max_attempts=3)
+                self.assertEqual(
+                    pathlib.Path(d, 'existing').read_text(), 'data')
+
     def test_add_trailing_slash(self):
         r"""test_add_trailing_slash."""
         # Empty string.
@@ -443,17 +1632,659 @@ class TestPath(unittest.TestCase):
         self.assertEqual(path.add_trailing_slash('http://a b c'),
                          'http://a b c/')
 
+    def test_add_trailing_slashes(self):
+        r"""test_add_trailing_slashes."""
+        uris = [str(), '/', 'http://a b c/', 'http://a b c']
+        expected = ['/', '/', 'http://a b c/', 'http://a b c/']
+        result = path.add_trailing_slashes(uris)
+        self.assertEqual(result, expected)
+        # Strings with a trailing slash are not copied.
+        self.assertIs(result[2], uris[2])
+
+        self.assertEqual(path.add_trailing_slashes(tuple(uris)),
+                         tuple(expected))
+
+        # Generators are streamed.
+        result = path.add_trailing_slashes(u for u in uris)
+        self.assertFalse(isinstance(result, (list, tuple)))
+        self.assertEqual(list(result), expected)
+
+    @unittest.skipUnless(importlib.util.find_spec('numpy'),
+                         'NumPy is not installed')
+    def test_add_trailing_slashes_numpy(self):
+        r"""test_add_trailing_slashes_numpy."""
+        import numpy
+        uris = ['a', 'b/', 'http://c']
+        expected = ['a/', 'b/', 'http://c/']
+        result = path.add_trailing_slashes(numpy.array(uris))
+        self.assertIsInstance(result, numpy.ndarray)
+        self.assertEqual(result.tolist(), expected)
+        result = path.add_trailing_slashes(numpy.array(uris, dtype=object))
+        self.assertEqual(result.dtype, object)
+        self.assertEqual(result.tolist(), expected)
+        result = path.add_trailing_slashes(numpy.array(uris, dtype=bytes))
+        self.assertEqual(result.dtype.kind, 'S')
+        self.assertEqual(result.tolist(), [e.encode() for e in expected])
+
+    @unittest.skipUnless(importlib.util.find_spec('pyarrow'),
+                         'PyArrow is not installed')
+    def test_add_trailing_slashes_pyarrow(self):
+        r"""test_add_trailing_slashes_pyarrow."""
+        import pyarrow
+        result = path.add_trailing_slashes(pyarrow.array(['a', 'b/', None]))
+        self.assertIsInstance(result, pyarrow.Array)
+        self.assertEqual(result.to_pylist(), ['a/', 'b/', None])
+
 
 class TestNotify(unittest.TestCase):
     r"""notify modules test."""
 
+    @patch('smtplib.SMTP_SSL', servers.plain_smtp)
     def test_send_email(self):
-        r"""Nothing to test."""
-        pass
+        r"""test_send_email."""
+        with servers.SMTPStandIn() as server:
+            result = notify.send_email('Hello', server.host, server.port,
+                                       's@example.com', 'user', 'password',
+                                       'r@example.com', 'Greetings')
+            self.assertEqual(result, dict())
+            self.assertEqual(len(server.messages), 1)
+            self.assertEqual(server.messages[0]['sender'], 's@example.com')
+            self.assertEqual(server.messages[0]['recipients'],
+                             ['r@example.com'])
+            self.assertIn('Subject: Greetings', server.messages[0]['data'])
+
+            # Wrong credentials.
+            with self.assertRaises(smtplib.SMTPAuthenticationError):
+                notify.send_email('Hello', server.host, server.port,
+                                  's@example.com', 'user', 'wrong',
+                                  'r@example.com', 'Greetings')
 
     def test_send_gotify_message(self):
-        r"""Nothing to test."""
-        pass
+        r"""test_send_gotify_message."""
+        with servers.GotifyStandIn(token='tkn') as server:
+            with notify.send_gotify_message(server.url, 'tkn', 'm', 't',
+                                            7) as response:
+                self.assertEqual(response.status, 200)
+            self.assertEqual(server.messages, [{
+                'title': 't',
+                'message': 'm',
+                'priority': 7,
+                'id': 1
+            }])
+
+            with self.assertRaises(urllib.error.HTTPError):
+                notify.send_gotify_message(server.url + '/', 'wrong')
+
+    def test_pooled_delivery(self):
+        r"""Pooled and batch sends reuse connections on local servers."""
+        messages = [('body ' + str(i), 'r@example.com', 's')
+                    for i in range(20)]
+        with servers.SMTPStandIn() as server:
+            with notify.SMTPMailer(server.host,
+                                   server.port,
+                                   's@example.com',
+                                   'user',
+                                   'password',
+                                   use_ssl=False) as mailer:
+                mailer.send_many(messages)
+                for m in messages:
+                    mailer.send(*m)
+            self.assertEqual(len(server.messages), 40)
+            self.assertEqual(server.sessions, 1)
+
+        notifications = [('message ' + str(i), 'title', 5) for i in range(20)]
+        with servers.GotifyStandIn() as server:
+            with notify.GotifyClient(server.url, 'token',
+                                     pool_size=2) as client:
+                replies = client.send_many(notifications)
+                for n in notifications:
+                    client.send(*n)
+            self.assertEqual(len(server.messages), 40)
+            self.assertEqual(sorted(r['id'] for r in replies),
+                             list(range(1, 21)))
+            self.assertLessEqual(server.connections, 2)
+
+    def test_benchmarks(self):
+        r"""Run the benchmarks on a few messages."""
+        for function, modes in ((benchmarks.benchmark_email,
+                                 {'single', 'pooled', 'batch',
+                                  'fan-out'}), (benchmarks.benchmark_gotify,
+                                                {'single', 'pooled',
+                                                 'batch'})):
+            results = function(5)
+            self.assertEqual(set(results), modes)
+            for r in results.values():
+                self.assertGreater(r['messages_per_second'], 0)
+                self.assertLessEqual(r['p50_ms'], r['p99_ms'])
+        self.assertEqual(benchmarks.percentile([3, 1, 2, 4], 50), 2)
+        self.assertEqual(benchmarks.percentile(list(range(1, 101)), 99), 99)
+
+    @patch('smtplib.SMTP_SSL', servers.plain_smtp)
+    def test_send_email_to_many(self):
+        r"""test_send_email_to_many."""
+        receivers = ['r' + str(i) + '@example.com' for i in range(250)]
+        refused = ['r' + str(i) + '@example.com' for i in range(200, 250)]
+        refused.append('r7@example.com')
+        for pipelining in [True, False]:
+            with servers.SMTPStandIn(refused=refused,
+                                     pipelining=pipelining) as server:
+                with notify.SMTPMailer(server.host,
+                                       server.port,
+                                       's@example.com',
+                                       'user',
+                                       'password',
+                                       use_ssl=False) as mailer:
+                    # The last transaction is refused as a whole.
+                    result = mailer.send_to_many('Hello', receivers,
+                                                 'Greetings')
+                    self.assertEqual(set(result), set(refused))
+                    self.assertEqual(result['r7@example.com'],
+                                     (550, b'No such user'))
+                    self.assertEqual(len(server.messages), 2)
+                    self.assertEqual(server.messages[0]['recipients'],
+                                     receivers[:7] + receivers[8:100])
+                    self.assertEqual(server.messages[1]['recipients'],
+                                     receivers[100:200])
+                    self.assertEqual(server.messages[0]['data'],
+                                     server.messages[1]['data'])
+                    self.assertIn('To: undisclosed-recipients:;',
+                                  server.messages[0]['data'])
+
+                    result = mailer.send_personalized(
+                        {
+                            'a@example.com': 'Hello a',
+                            'r7@example.com': 'Hello r7',
+                            'b@example.com': 'Hello b',
+                        }, 'Greetings')
+                    self.assertEqual(list(result), ['r7@example.com'])
+                    self.assertEqual(
+                        [m['recipients'] for m in server.messages[2:]],
+                        [['a@example.com'], ['b@example.com']])
+                    self.assertIn('Hello b', server.messages[3]['data'])
+                    self.assertIn('To: b@example.com',
+                                  server.messages[3]['data'])
+
+                    with self.assertRaises(ValueError):
+                        mailer.send_to_many('Hello', receivers, 'Greetings', 0)
+                self.assertEqual(server.sessions, 1)
+
+        with servers.SMTPStandIn() as server:
+            self.assertEqual(
+                notify.send_email_to_many('Hello', server.host, server.port,
+                                          's@example.com', 'user', 'password',
+                                          receivers[:3], 'Greetings', 2),
+                dict())
+            self.assertEqual([m['recipients'] for m in server.messages],
+                             [receivers[:2], receivers[2:3]])
+
+    @patch('smtplib.SMTP_SSL')
+    def test_smtp_mailer(self, smtp_ssl):
+        r"""test_smtp_mailer."""
+        conn = smtp_ssl.return_value
+        conn.sendmail.return_value = dict()
+        messages = [('body ' + str(i), 'r' + str(i) + '@example.com', 'subj')
+                    for i in range(5)]
+
+        # A batch uses one session only and the connection is reused.
+        with notify.SMTPMailer('smtp.example.com', 465, 's@example.com',
+                               'user', 'password') as mailer:
+            self.assertEqual(mailer.send_many(messages), [dict()] * 5)
+            self.assertEqual(mailer.send('body', 'r@example.com', 'subj'),
+                             dict())
+        self.assertEqual(smtp_ssl.call_count, 1)
+        self.assertEqual(conn.login.call_count, 1)
+        self.assertEqual(conn.sendmail.call_count, 6)
+        conn.quit.assert_called_once()
+
+        # The SSL context is cached.
+        self.assertIs(smtp_ssl.call_args[1]['context'],
+                      notify._get_ssl_context())
+
+        # Reconnect once on a dropped connection.
+        smtp_ssl.reset_mock()
+        conn.sendmail.side_effect = [
+            smtplib.SMTPServerDisconnected(),
+            dict(),
+        ]
+        with notify.SMTPMailer('smtp.example.com', 465, 's@example.com',
+                               'user', 'password') as mailer:
+            self.assertEqual(mailer.send('body', 'r@example.com', 'subj'),
+                             dict())
+        self.assertEqual(smtp_ssl.call_count, 2)
+
+        # Idle connections are replaced.
+        smtp_ssl.reset_mock()
+        conn.sendmail.side_effect = None
+        with notify.SMTPMailer('smtp.example.com',
+                               465,
+                               's@example.com',
+                               'user',
+                               'password',
+                               idle_timeout=0) as mailer:
+            mailer.send('body', 'r@example.com', 'subj')
+            mailer._idle[0] = (mailer._idle[0][0], 0.0)
+            mailer.send('body', 'r@example.com', 'subj')
+        self.assertEqual(smtp_ssl.call_count, 2)
+
+        with self.assertRaises(ValueError):
+            notify.SMTPMailer('smtp.example.com',
+                              465,
+                              's@example.com',
+                              'user',
+                              'password',
+                              pool_size=0)
+
+    @patch('http.client.HTTPConnection')
+    def test_gotify_client(self, http_connection):
+        r"""test_gotify_client."""
+        conn = http_connection.return_value
+        response = conn.getresponse.return_value
+        response.status = 200
+        response.will_close = False
+        response.read.return_value = b'{"id": 1}'
+
+        with notify.GotifyClient('http://gotify.example.com:8080',
+                                 'tkn',
+                                 pool_size=1) as client:
+            self.assertEqual(client.send('m', 't', 1), {'id': 1})
+            replies = client.send_many([('m', 't', 1)] * 3)
+            self.assertEqual(replies, [{'id': 1}] * 3)
+        # One connection only, reused by all the requests.
+        http_connection.assert_called_once_with('gotify.example.com',
+                                                8080,
+                                                timeout=30.0)
+        self.assertEqual(conn.request.call_count, 4)
+        self.assertEqual(conn.request.call_args[0],
+                         ('POST', '/message?token=tkn'))
+        conn.close.assert_called_once()
+
+        # A keep-alive connection closed by the server is replaced.
+        conn.reset_mock()
+        conn.getresponse.side_effect = [
+            response,
+            http.client.RemoteDisconnected(),
+            response,
+        ]
+        with notify.GotifyClient('http://gotify.example.com:8080',
+                                 'tkn') as client:
+            client.send()
+            client.send()
+        self.assertEqual(conn.request.call_count, 3)
+
+        # HTTP errors.
+        conn.getresponse.side_effect = None
+        response.status = 401
+        with notify.GotifyClient('http://gotify.example.com:8080',
+                                 'tkn') as client:
+            with self.assertRaises(urllib.error.HTTPError):
+                client.send()
+
+        with self.assertRaises(ValueError):
+            notify.GotifyClient('gotify.example.com', 'tkn')
+
+    def test_notification_dispatcher(self):
+        r"""test_notification_dispatcher."""
+        delivered = list()
+        attempts = {'n': 0}
+
+        def flaky(value):
+            attempts['n'] += 1
+            if attempts['n'] < 3:
+                raise ConnectionError
+            delivered.append(value)
+
+        def broken():
+            raise ConnectionError
+
+        with notify.NotificationDispatcher(workers=1,
+                                           max_retries=2,
+                                           backoff=0.001,
+                                           flush_on_exit=False) as d:
+            self.assertTrue(d.submit(delivered.append, 1))
+            self.assertTrue(d.submit(flaky, 2))
+            self.assertTrue(d.submit(broken))
+            self.assertTrue(d.flush(timeout=10))
+            stats = d.statistics()
+        self.assertEqual(delivered, [1, 2])
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['delivered'], 2)
+        self.assertEqual(stats['failed'], 1)
+        self.assertEqual(stats['retried'], 4)
+        self.assertEqual(stats['pending'], 0)
+
+        with self.assertRaises(RuntimeError):
+            d.submit(delivered.append, 3)
+
+        # A full queue drops the notification instead of blocking.
+        started = threading.Semaphore(0)
+        release = threading.Event()
+
+        def blocked():
+            started.release()
+            release.wait()
+
+        with notify.NotificationDispatcher(max_queue_size=1,
+                                           flush_on_exit=False) as d:
+            self.assertTrue(d.submit(blocked))
+            self.assertTrue(started.acquire(timeout=10))
+            self.assertTrue(d.submit(delivered.append, 3))
+            self.assertFalse(d.submit(delivered.append, 4))
+            self.assertEqual(d.statistics()['dropped'], 1)
+            release.set()
+        self.assertEqual(delivered, [1, 2, 3])
+
+        # A close that times out still stops the threads.
+        release.clear()
+        d = notify.NotificationDispatcher(workers=2,
+                                          max_queue_size=4,
+                                          flush_on_exit=False)
+        d.submit(blocked)
+        d.submit(blocked)
+        self.assertTrue(started.acquire(timeout=10))
+        self.assertTrue(started.acquire(timeout=10))
+        d.submit(delivered.append, 5)
+        self.assertFalse(d.close(timeout=0.01))
+        release.set()
+        self.assertTrue(d.close(timeout=10))
+        stats = d.statistics()
+        self.assertEqual(stats['delivered'], 2)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(delivered, [1, 2, 3])
+
+        # Queued notifications are delivered on close.
+        d = notify.NotificationDispatcher(workers=2, flush_on_exit=False)
+        for i in range(100):
+            d.submit(delivered.append, i)
+        self.assertTrue(d.close())
+        self.assertEqual(len(delivered), 103)
+
+        # Notifications accepted while closing are not lost.
+        d = notify.NotificationDispatcher(workers=2, flush_on_exit=False)
+        accepted = list()
+
+        def produce():
+            go = True
+            while go:
+                try:
+                    accepted.append(d.submit(delivered.append, 0))
+                except RuntimeError:
+                    go = False
+
+        producers = [threading.Thread(target=produce) for _ in range(4)]
+        for t in producers:
+            t.start()
+        d.close()
+        for t in producers:
+            t.join()
+        self.assertEqual(d.statistics()['delivered'], accepted.count(True))
+        self.assertEqual(d.statistics()['pending'], 0)
+
+        with patch('fpyutils.notify.send_gotify_message') as send:
+            with notify.NotificationDispatcher(flush_on_exit=False) as d:
+                d.send_gotify_message('http://gotify.example.com', 'tkn')
+        send.assert_called_once_with('http://gotify.example.com', 'tkn')
+
+    @patch('fpyutils.notify.time')
+    def test_notification_coalescer(self, clock):
+        r"""test_notification_coalescer."""
+        clock.monotonic.return_value = 0.0
+        sent = list()
+
+        def deliver(destination, title, message):
+            sent.append((destination, title, message))
+
+        # Half a token every window.
+        c = notify.NotificationCoalescer(deliver,
+                                         window=10,
+                                         rate=0.05,
+                                         burst=2)
+
+        # The first notification goes out immediately, the duplicates are
+        # collected.
+        for _ in range(100):
+            c.submit('a', 'error', 'job failed')
+        self.assertEqual(sent, [('a', 'error', 'job failed')])
+
+        # Destinations are independent.
+        c.submit('b', 'info', 'ok')
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(c.statistics()['destinations'], 2)
+
+        # Window expiry: identical notifications are deduplicated.
+        clock.monotonic.return_value = 10.0
+        self.assertEqual(c.flush(), 1)
+        self.assertEqual(sent[2],
+                         ('a', 'error', 'job failed\n\n(repeated 99 times)'))
+
+        # Bursts of different notifications become a digest.
+        c.submit('a', 'error', 'job failed')
+        c.submit('a', 'warning', 'disk full')
+        c.submit('a', 'warning', 'disk full')
+        clock.monotonic.return_value = 20.0
+        c.flush()
+        self.assertEqual(sent[3],
+                         ('a', '3 notifications',
+                          '1x error: job failed\n2x warning: disk full'))
+
+        # Rate limit: the bucket is empty so the digest is postponed.
+        c.submit('a', 'error', 'again')
+        clock.monotonic.return_value = 30.0
+        self.assertEqual(c.flush(), 0)
+        self.assertEqual(c.statistics()['rate_limited'], 1)
+
+        # Forced flush ignores limits.
+        self.assertEqual(c.flush(force=True), 1)
+        self.assertEqual(sent[4], ('a', 'error', 'again'))
+
+        stats = c.statistics()
+        self.assertEqual(stats['submitted'], 105)
+        self.assertEqual(stats['delivered'], 5)
+        self.assertEqual(stats['coalesced'], 100)
+
+        # Idle destinations are forgotten once their bucket is full: only
+        # the one of 'b' is full here.
+        clock.monotonic.return_value = 40.0
+        self.assertEqual(c.flush(), 0)
+        self.assertEqual(c.statistics()['destinations'], 1)
+        clock.monotonic.return_value = 100.0
+        self.assertEqual(c.flush(), 0)
+        self.assertEqual(c.statistics()['destinations'], 0)
+        c.submit('a', 'error', 'new')
+        self.assertEqual(sent[5], ('a', 'error', 'new'))
+
+        # submit checks only its own destination.
+        c.submit('b', 'info', 'one')
+        c.submit('b', 'info', 'two')
+        clock.monotonic.return_value = 200.0
+        c.submit('a', 'error', 'other')
+        self.assertEqual([x[0] for x in sent[6:]], ['b', 'a'])
+        self.assertEqual(c.flush(), 1)
+        self.assertEqual(sent[8], ('b', 'info', 'two'))
+
+        # Deliveries do not hold the lock of the coalescer.
+        def statistics_from_thread(destination, title, message):
+            t = threading.Thread(target=c.statistics)
+            t.start()
+            t.join(5)
+            sent.append(t.is_alive())
+
+        c.deliver = statistics_from_thread
+        c.flush(force=True)
+        c.submit('c', 'info', 'ok')
+        self.assertEqual(sent[-1], False)
+
+    @patch('fpyutils.notify.time')
+    def test_token_bucket(self, clock):
+        r"""test_token_bucket."""
+        clock.monotonic.return_value = 0.0
+        b = notify.TokenBucket(rate=2, capacity=3)
+        self.assertEqual([b.consume() for _ in range(4)],
+                         [True, True, True, False])
+        clock.monotonic.return_value = 1.0
+        self.assertEqual(b.available(), 2)
+        self.assertTrue(b.consume(2))
+        self.assertFalse(b.consume())
+
+        with self.assertRaises(ValueError):
+            notify.TokenBucket(rate=1, capacity=0)
+
+
+class TestCli(unittest.TestCase):
+    r"""cli module test."""
+
+    def _main(self, argv: list, stdin: str = str()):
+        r"""Run the command line interface on the given standard input."""
+        with patch('sys.stdin', io.StringIO(stdin)), patch(
+                'sys.stdout', new_callable=io.StringIO) as stdout, patch(
+                    'sys.stderr', new_callable=io.StringIO) as stderr:
+            retval = cli.main(argv)
+
+        return retval, stdout.getvalue(), stderr.getvalue()
+
+    def test_streaming(self):
+        r"""Subcommands stream the standard input to the standard output."""
+        self.assertEqual(
+            self._main(['match', '[](TOC)'], FAKE_FILE_WITH_MATCHES_AS_STRING),
+            (0, '4\n10\n', str()))
+        self.assertEqual(
+            self._main(['match', '-m', '1', '[](TOC)'],
+                       FAKE_FILE_WITH_MATCHES_AS_STRING), (0, '4\n', str()))
+        self.assertEqual(
+            self._main(['match', '--strict', '[](TOC)'],
+                       FAKE_FILE_WITH_MATCHES_AS_STRING), (1, str(), str()))
+
+        self.assertEqual(
+            self._main(['insert', '-n', 'lf', 'x\n', '1'],
+                       FAKE_FILE_AS_STRING),
+            (0, '# One\nx\n## One.Two\n', str()))
+        self.assertEqual(
+            self._main(['insert', '-n', 'lf', '-p', 'x\n', '1'],
+                       FAKE_FILE_AS_STRING),
+            (0, 'x\n# One\n## One.Two\n', str()))
+        self.assertEqual(
+            self._main(['insert', '-n', 'lf', 'x', '4'], FAKE_FILE_AS_STRING),
+            (0, FAKE_FILE_AS_STRING + '\nx', str()))
+
+        self.assertEqual(
+            self._main(['remove-range', '1', '1'], FAKE_FILE_AS_STRING),
+            (0, '## One.Two\n', str()))
+
+        retval, _, stderr = self._main(['remove-range', '2', '1'])
+        self.assertEqual(retval, 2)
+        self.assertIn('NegativeLineRangeError', stderr)
+
+    def test_files_and_batch(self):
+        r"""Edit files, one at a time and in a batch."""
+        with tempfile.TemporaryDirectory() as d:
+            filename = str(pathlib.PurePath(d, 'testing'))
+            output = str(pathlib.PurePath(d, 'output'))
+            with open(filename, 'w') as f:
+                f.write(FAKE_FILE_AS_STRING)
+
+            self.assertEqual(
+                self._main(['insert', '-o', output, 'x\n', '1', filename]),
+                (0, str(), str()))
+            with open(output) as f:
+                self.assertEqual(f.read(), '# One\nx\n## One.Two\n')
+
+            retval, _, stderr = self._main(['remove-range', '-i', '1', '1'])
+            self.assertEqual(retval, 2)
+            self.assertIn('--in-place needs a file', stderr)
+
+            batch = '\n'.join([
+                '# Comments and empty lines are ignored.',
+                str(),
+                'match "## One.Two" ' + filename,
+                'insert -i -e -n lf "three\\n" 3 ' + filename,
+                'remove-range -i 1 1 ' + filename,
+                'match missing ' + filename,
+                'remove-range -i 1 1 ' + filename,
+            ])
+            self.assertEqual(self._main(['batch'], batch), (1, '2\n', str()))
+            with open(filename) as f:
+                self.assertEqual(f.read(), '## One.Two\nthree\n')
+
+            retval, stdout, stderr = self._main(['batch', '--keep-going'],
+                                                'match x\nrun -d true\n')
+            self.assertEqual(retval, 2)
+            self.assertEqual(stdout, '/bin/bash -c true\n')
+            self.assertIn('match needs an input file', stderr)
+
+        # Unavailable files.
+        retval, _, stderr = self._main(['match', 'x', '/not/a/file'])
+        self.assertEqual(retval, 2)
+        self.assertIn('fpyutils: error: match', stderr)
+
+    def test_run(self):
+        r"""test_run."""
+        self.assertEqual(self._main(['run', 'false'])[0], 1)
+        self.assertEqual(self._main(['run', '--dry-run', 'false']),
+                         (0, '/bin/bash -c false\n', str()))
+        with tempfile.TemporaryDirectory() as d:
+            log = str(pathlib.PurePath(d, 'log'))
+            self.assertEqual(
+                self._main(['run', '-l', log, '-l', log, 'echo one']),
+                (0, 'one\n', str()))
+            with open(log) as f:
+                self.assertEqual(f.read(), 'one\n')
+
+
+# Maximum time to import a submodule, in microseconds. Much larger than the
+# actual time, it is meant to catch eager imports of heavy modules.
+IMPORT_TIME_BUDGET = 50000
+
+HEAVY_MODULES = [
+    'email', 'http', 'json', 'secrets', 'shutil', 'smtplib', 'ssl',
+    'subprocess', 'tempfile', 'urllib'
+]
+
+
+class TestPackage(unittest.TestCase):
+    r"""Package level tests."""
+
+    def _import(self, statement: str) -> tuple:
+        r"""Import in a new interpreter.
+
+        Return the cumulative import time of the fpyutils modules and
+        the names of the imported top level modules.
+        """
+        command = [
+            sys.executable, '-X', 'importtime', '-c',
+            statement + '; import sys; print(" ".join(sys.modules))'
+        ]
+        result = subprocess.run(command,
+                                capture_output=True,
+                                check=True,
+                                text=True,
+                                cwd=str(pathlib.Path(__file__).parents[2]))
+        elapsed = 0
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            # Only top level entries: nested ones are already included.
+            if len(fields) == 3 and fields[2].startswith(' fpyutils'):
+                elapsed += int(fields[1])
+
+        return elapsed, {m.split('.')[0] for m in result.stdout.split()}
+
+    def test_import_time(self):
+        r"""Importing a submodule does not import the others."""
+        for module in ['exceptions', 'filelines', 'path', 'shell', 'notify']:
+            elapsed, modules = self._import('import fpyutils.' + module)
+            self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+            self.assertEqual(modules & set(HEAVY_MODULES), set())
+
+        elapsed, modules = self._import('import fpyutils')
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+        self.assertEqual(modules & set(HEAVY_MODULES), set())
+
+    def test_lazy_submodules(self):
+        r"""test_lazy_submodules."""
+        import fpyutils
+        self.assertIs(fpyutils.filelines, filelines)
+        self.assertIn('notify', dir(fpyutils))
+        with self.assertRaises(AttributeError):
+            fpyutils.not_a_module
 
 
 if __name__ == '__main__':